@@ -2,9 +2,6 @@ import streamlit as st
 
 from config import APP_NAME
 from modules.authentication import AuthenticationManager
-from modules.conversation import ConversationHandler
-from modules.session import SessionHandler
-from modules.views import ViewsManager
 
 st.set_page_config(
     page_title=APP_NAME,
@@ -16,9 +13,18 @@ st.title(APP_NAME)
 if "authentication_manager" not in st.session_state:
     st.session_state.authentication_manager = AuthenticationManager()
 
+# Only needed past the password check, so the login screen renders without loading them
+from modules.conversation import ConversationHandler  # noqa: E402
+from modules.session import SessionHandler  # noqa: E402
+from modules.views import ViewsManager  # noqa: E402
+
 if "session_handler" not in st.session_state:
     st.session_state.session_handler = SessionHandler()
 
+# Kept in the URL, so that a refresh resumes the same conversation
+st.query_params["session"] = st.session_state["session_id"]
+st.query_params["client"] = st.session_state["client_id"]
+
 if "conversation_handler" not in st.session_state:
     st.session_state.conversation_handler = ConversationHandler()
 
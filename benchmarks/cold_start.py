@@ -0,0 +1,116 @@
+"""
+Cold-start benchmark for the Streamlit app.
+
+Every measurement runs in a fresh interpreter, as a new container would:
+
+- import time of what the login screen needs, and of what the main view adds on top of it
+- first-render time of `App.py` through Streamlit's `AppTest`, before and after logging in
+- first-render time of the login screen of the pages that call the API, which must not load
+  the heavy modules either
+
+The median of each is compared against a threshold and the script exits non-zero on a
+regression, so it can gate CI:
+
+    python benchmarks/cold_start.py --runs 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+LOGIN_IMPORTS = "import streamlit, config, modules.authentication"
+MAIN_VIEW_IMPORTS = "import modules.conversation, modules.session, modules.views"
+
+IMPORT_SCRIPT = """
+import time
+{setup}
+started_at = time.perf_counter()
+{imports}
+print(time.perf_counter() - started_at)
+"""
+
+RENDER_SCRIPT = """
+import time
+from streamlit.testing.v1 import AppTest
+
+app = AppTest.from_file("{path}", default_timeout=120)
+if {logged_in}:
+    app.session_state["password_correct"] = True
+started_at = time.perf_counter()
+app.run()
+elapsed = time.perf_counter() - started_at
+if app.exception:
+    raise SystemExit(str(app.exception))
+print(elapsed)
+"""
+
+# Default thresholds, in milliseconds
+THRESHOLDS = {
+    "import:login": 1500,
+    "import:main_view": 2500,
+    "render:login": 2500,
+    "render:main_view": 5000,
+    "render:batch_login": 2500,
+    "render:compare_login": 2500,
+    "render:cost_login": 2500,
+}
+
+PAGES = {"batch": "pages/Batch.py", "compare": "pages/Compare.py", "cost": "pages/Cost.py"}
+
+
+def measure(script: str) -> float:
+    env = {**os.environ, "OPENAI_MODEL": os.environ.get("OPENAI_MODEL") or "_4_1"}
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1]) * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    for name, threshold in THRESHOLDS.items():
+        parser.add_argument(
+            f"--max-{name.replace(':', '-').replace('_', '-')}-ms",
+            type=float,
+            help=f"threshold for {name} (default: {threshold})",
+        )
+    args = parser.parse_args()
+
+    scripts = {
+        "import:login": IMPORT_SCRIPT.format(setup="", imports=LOGIN_IMPORTS),
+        "import:main_view": IMPORT_SCRIPT.format(setup=LOGIN_IMPORTS, imports=MAIN_VIEW_IMPORTS),
+        "render:login": RENDER_SCRIPT.format(path="App.py", logged_in=False),
+        "render:main_view": RENDER_SCRIPT.format(path="App.py", logged_in=True),
+        **{
+            f"render:{name}_login": RENDER_SCRIPT.format(path=path, logged_in=False)
+            for name, path in PAGES.items()
+        },
+    }
+
+    failed = False
+    print(f"{'benchmark':<20}{'median ms':>12}{'max ms':>12}{'threshold':>12}")
+    for name, script in scripts.items():
+        timings = [measure(script) for _ in range(args.runs)]
+        median = statistics.median(timings)
+        override = getattr(args, f"max_{name.replace(':', '_')}_ms")
+        threshold = override if override is not None else THRESHOLDS[name]
+        status = "" if median <= threshold else "  REGRESSION"
+        failed |= median > threshold
+        print(f"{name:<20}{median:>12.0f}{max(timings):>12.0f}{threshold:>12.0f}{status}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Parse-cost benchmark for MQM annotations of growing size.
+
+For each number of errors, compares the best of `--runs` timings of:
+
+- `json.loads`, the untyped parse that exports used to repeat on every call
+- `MQMAnnotation.model_validate_json`, the typed parse done once per response
+- the lenient salvage of the same response truncated mid-error
+- reading back the annotation kept alongside the message
+
+    python benchmarks/mqm_parse.py --sizes 10 100 1000 10000
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.conversation import ConversationHandler  # noqa: E402
+from modules.mqm import ErrorCategory, MQMAnnotation, Severity, parse_annotation  # noqa: E402
+
+
+def make_response(n_errors: int) -> str:
+    categories, severities = list(ErrorCategory), list(Severity)
+    errors = [
+        {
+            "category": categories[idx % len(categories)].value,
+            "severity": severities[idx % len(severities)].value,
+            "in_source": {
+                "token_index": [idx, idx + 1],
+                "character_span": [idx * 8, idx * 8 + 12],
+                "token": "Αστικός Κώδικας",
+            },
+            "in_target": {
+                "token_index": [idx],
+                "character_span": [idx * 7, idx * 7 + 15],
+                "token": "Bürgerliches Gesetzbuch",
+            },
+        }
+        for idx in range(n_errors)
+    ]
+    return json.dumps({"errors": errors}, ensure_ascii=False)
+
+
+def best_ms(func, runs: int) -> float:
+    number = 10
+    return min(timeit.repeat(func, number=number, repeat=runs)) / number * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    # Only the parsing methods are used, which need no session state
+    conversation_handler = ConversationHandler.__new__(ConversationHandler)
+
+    print(f"{'errors':>8}{'json ms':>12}{'typed ms':>12}{'salvage ms':>12}{'cached ms':>12}")
+    for n_errors in args.sizes:
+        text = make_response(n_errors)
+        truncated = text[: len(text) - 40]
+        message = {"role": "assistant", "content": text}
+        conversation_handler.get_annotation(message)
+
+        # The salvage logs every call
+        with contextlib.redirect_stdout(io.StringIO()):
+            salvage_ms = best_ms(lambda: parse_annotation(truncated, lenient=True), args.runs)
+        timings = (
+            best_ms(lambda: json.loads(text), args.runs),
+            best_ms(lambda: MQMAnnotation.model_validate_json(text), args.runs),
+            salvage_ms,
+            best_ms(lambda: conversation_handler.get_annotation(message), args.runs),
+        )
+        print(f"{n_errors:>8}" + "".join(f"{timing:>12.3f}" for timing in timings))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,6 +14,11 @@ except OSError:
 
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None  # e.g. a local stand-in server
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))  # seconds
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_MAX_BACKOFF = float(os.getenv("OPENAI_MAX_BACKOFF", "60"))  # seconds
 DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant."
 
 MQM_BASE_PROMPT = """\
@@ -24,6 +29,8 @@ MQM_SOURCE_TEXT = """{src_lang} source: "{source}"\n\n"""
 MQM_TARGET_TEXT = """{tgt_lang} translation: "{translation}"\n\n"""
 MQM_REF_TEXT = """{tgt_lang} reference: "{reference}"\n\n"""
 
+# Every scenario starts with MQM_BASE_PROMPT unchanged and ends with its variable blocks, so that
+# the shared prefix can be served from the provider's prompt cache, once it is long enough
 MQM_S_T_PROMPT = MQM_BASE_PROMPT + MQM_SOURCE_TEXT + MQM_TARGET_TEXT
 MQM_R_T_PROMPT = MQM_BASE_PROMPT + MQM_REF_TEXT + MQM_TARGET_TEXT
 MQM_S_R_T_PROMPT = MQM_BASE_PROMPT + MQM_SOURCE_TEXT + MQM_REF_TEXT + MQM_TARGET_TEXT
@@ -33,3 +40,65 @@ MQM_PROMPTS = {
     "R-T": MQM_R_T_PROMPT,
     "S-R-T": MQM_S_R_T_PROMPT,
 }
+
+MQM_USER_PROMPT = "Identify the errors in the translation."
+
+# The provider only caches shared prefixes of at least this many tokens. The base prompt and the
+# response schema alone stay below it, so only longer prefixes, e.g. chat history, are cached
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", ".cache/responses.sqlite3")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_AGE = int(os.getenv("RESPONSE_CACHE_MAX_AGE", str(30 * 24 * 60 * 60)))  # seconds
+
+# Fraction of each model's RPM/TPM limits that the scheduler lets through
+RATE_LIMIT_HEADROOM = float(os.getenv("RATE_LIMIT_HEADROOM", "0.9"))
+EXPECTED_OUTPUT_TOKENS = int(os.getenv("EXPECTED_OUTPUT_TOKENS", "1024"))
+
+# Conversation history sent with each turn
+CONTEXT_BUDGET_RATIO = float(os.getenv("CONTEXT_BUDGET_RATIO", "0.5"))  # of the context window
+CONTEXT_WINDOW_MESSAGES = int(os.getenv("CONTEXT_WINDOW_MESSAGES", "20"))
+CONTEXT_SUMMARY_PROMPT = (
+    "Summarize the following conversation between a user and a translation evaluator. "
+    "Keep every evaluated segment, every identified error and every instruction the user gave."
+)
+
+# Pre-flight cost estimates
+ESTIMATOR_THREADS = int(os.getenv("ESTIMATOR_THREADS", str(os.cpu_count() or 4)))
+ESTIMATOR_CHUNK_SIZE = 2_000  # segments per thread pool task
+DEFAULT_OUTPUT_RATIO = float(os.getenv("DEFAULT_OUTPUT_RATIO", "0.25"))  # output/input tokens
+# Cached responses of a scenario needed before their output/input ratio replaces the default
+OUTPUT_RATIO_MIN_SAMPLES = int(os.getenv("OUTPUT_RATIO_MIN_SAMPLES", "20"))
+
+CHAT_PAGE_SIZE = 20  # messages rendered per page of chat history
+
+CONVERSATION_STORE_PATH = os.getenv("CONVERSATION_STORE_PATH", ".cache/conversations.sqlite3")
+RESUME_MESSAGES = max(CHAT_PAGE_SIZE, CONTEXT_WINDOW_MESSAGES)  # loaded when resuming a session
+
+# MQM penalty per error, by severity
+MQM_SEVERITY_WEIGHTS = {"neutral": 0.0, "minor": 1.0, "major": 5.0, "critical": 10.0}
+
+# Longer source/reference/translation texts are split into chunks that are evaluated in parallel
+SEGMENT_MAX_CHARS = int(os.getenv("SEGMENT_MAX_CHARS", "2000"))
+
+# Timing, tokens and cost of every LLM request
+METRICS_STORE_PATH = os.getenv("METRICS_STORE_PATH", ".cache/metrics.sqlite3")
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", str(7 * 24 * 60 * 60)))  # seconds shown on Cost
+
+# Previously evaluated segments, reused for exact repeats and suggested for near-identical ones
+TRANSLATION_MEMORY_PATH = os.getenv("TRANSLATION_MEMORY_PATH", ".cache/translation_memory.sqlite3")
+TRANSLATION_MEMORY_SIMILARITY = float(os.getenv("TRANSLATION_MEMORY_SIMILARITY", "0.8"))
+
+# Hard spend ceilings in USD per budget period, per session, per API key and per process;
+# 0 disables a ceiling. Spend is kept in the metrics store, so every process sharing it
+# counts against the same session and key budgets, across restarts
+BUDGET_PERIOD = int(os.getenv("BUDGET_PERIOD", str(24 * 60 * 60)))  # seconds
+BUDGET_SESSION_USD = float(os.getenv("BUDGET_SESSION_USD", "0"))
+BUDGET_KEY_USD = float(os.getenv("BUDGET_KEY_USD", "0"))
+BUDGET_PROCESS_USD = float(os.getenv("BUDGET_PROCESS_USD", "0"))
+BUDGET_QUEUE_TIMEOUT = float(os.getenv("BUDGET_QUEUE_TIMEOUT", "30"))  # seconds
+# Seconds after which the reservation of a request whose process died no longer counts
+BUDGET_RESERVATION_TTL = float(os.getenv("BUDGET_RESERVATION_TTL", "600"))
+BUDGET_DOWNGRADE = os.getenv("BUDGET_DOWNGRADE", "true").lower() in ("1", "true", "yes")
@@ -0,0 +1,82 @@
+"""
+Headless MQM evaluation of a file of segments, for CI and scheduled runs.
+
+Rows are streamed from a JSONL or CSV file with `source`/`reference`/`translation` columns
+(and optionally `src_lang`/`tgt_lang`), evaluated with the same prompts, schema, cache and
+rate limits as the app, and written to JSONL or to a Parquet dataset chunk by chunk. Run the
+same command again to resume an interrupted run, and add `--retry-failed` to evaluate again
+the rows that failed, e.g. during an API outage:
+
+    python evaluate.py segments.jsonl results.jsonl --scenario S-T --model _4_1
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from config import BATCH_CONCURRENCY, MQM_PROMPTS, OPENAI_API_KEY, OPENAI_MODEL
+from modules.batch import BatchEvaluator
+from modules.cache import get_response_cache
+from modules.models import GPT
+from modules.pipeline import EvaluationPipeline
+from modules.translation_memory import get_translation_memory
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("input", type=Path, help="JSONL or CSV file of segments")
+    parser.add_argument("output", type=Path, help="JSONL file, or a directory ending in .parquet")
+    parser.add_argument("--scenario", choices=list(MQM_PROMPTS), default="S-T")
+    parser.add_argument("--model", choices=list(GPT.__members__), default=OPENAI_MODEL)
+    parser.add_argument("--src-lang", default="EL")
+    parser.add_argument("--tgt-lang", default="DE")
+    parser.add_argument("--temperature", type=float, default=0.1)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--chunk-size", type=int, default=256, help="rows per checkpoint")
+    parser.add_argument("--prompt-file", type=Path, help="a custom MQM prompt template")
+    parser.add_argument("--limit", type=int, help="stop after this many rows in total")
+    parser.add_argument("--bypass-cache", action="store_true", help="and the translation memory")
+    parser.add_argument("--restart", action="store_true", help="ignore and overwrite a checkpoint")
+    parser.add_argument(
+        "--retry-failed", action="store_true", help="evaluate again the rows that failed"
+    )
+    args = parser.parse_args()
+
+    if not OPENAI_API_KEY:
+        parser.error("OPENAI_API_KEY is not set")
+    if not args.model:
+        parser.error("--model is required when OPENAI_MODEL is not set")
+    if args.model not in GPT.__members__:
+        parser.error(f"OPENAI_MODEL {args.model!r} is not one of {', '.join(GPT.__members__)}")
+
+    evaluator = BatchEvaluator(
+        api_key=OPENAI_API_KEY,
+        model=GPT[args.model],
+        scenario=args.scenario,
+        src_lang=args.src_lang.upper(),
+        tgt_lang=args.tgt_lang.upper(),
+        temperature=args.temperature,
+        concurrency=args.concurrency,
+        cache=None if args.bypass_cache else get_response_cache(),
+        prompt=args.prompt_file.read_text(encoding="utf-8") if args.prompt_file else None,
+        memory=None if args.bypass_cache else get_translation_memory(),
+    )
+    pipeline = EvaluationPipeline(evaluator, args.input, args.output, chunk_size=args.chunk_size)
+
+    try:
+        checkpoint = pipeline.run(restart=args.restart, limit=args.limit)
+        if args.retry_failed:
+            checkpoint = pipeline.retry_failed(checkpoint)
+    except KeyboardInterrupt:
+        print(f"Interrupted; run the same command to resume from {pipeline.checkpoint_path}")
+        return 130
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    print(f"Done: {checkpoint.rows} rows, {checkpoint.failures} failures")
+    return 1 if checkpoint.failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import bisect
+import functools
+from collections import defaultdict
+from enum import Enum
+
+import regex
+
+from modules.mqm import MQMError
+
+WORD_PATTERN = regex.compile(r"\w+(?:[-'’]\w+)*")
+
+TokenInfo = MQMError.TokenInfo
+
+
+class SpanStatus(str, Enum):
+    VALID = "valid"
+    CORRECTED = "corrected"
+    NOT_FOUND = "not_found"
+    EMPTY = "empty"  # no token, e.g. an omission on this side
+    UNCHECKED = "unchecked"  # no text to check against
+
+
+class TextIndex:
+    """
+    Word offsets of a text, to check the spans an LLM reports and to find the right ones.
+
+    Checking a span is a slice comparison and a binary search; finding a token starts from the
+    occurrences of its first word that are closest to where the LLM placed it.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.starts: list[int] = []
+        self.ends: list[int] = []
+        self.words: list[str] = []
+        self.positions: dict[str, list[int]] = defaultdict(list)
+
+        for idx, match in enumerate(WORD_PATTERN.finditer(text)):
+            word = match.group().casefold()
+            self.starts.append(match.start())
+            self.ends.append(match.end())
+            self.words.append(word)
+            self.positions[word].append(idx)
+
+    def get_token_index(self, start: int, end: int) -> list[int]:
+        """Indexes of the words that overlap the character span `[start, end)`."""
+        first = bisect.bisect_right(self.ends, start)
+        last = bisect.bisect_left(self.starts, end)
+        return list(range(first, last))
+
+    def get_character_span(self, token_index: list[int]) -> list[int]:
+        return [self.starts[token_index[0]], self.ends[token_index[-1]]]
+
+    def find(self, token: str, near: int) -> list[int] | None:
+        """Character span of the occurrence of `token` closest to character offset `near`."""
+        words = [word.casefold() for word in WORD_PATTERN.findall(token)]
+        if not words:
+            return self.find_substring(token, near)
+
+        candidates = self.positions.get(words[0], [])
+        anchor = bisect.bisect_right(self.starts, near) - 1
+        right = bisect.bisect_left(candidates, anchor)
+        left = right - 1
+
+        # Walk outwards from the anchor, so the first match is the nearest one
+        while left >= 0 or right < len(candidates):
+            left_distance = anchor - candidates[left] if left >= 0 else len(self.words)
+            right_distance = (
+                candidates[right] - anchor if right < len(candidates) else len(self.words)
+            )
+            if left_distance < right_distance:
+                idx, left = candidates[left], left - 1
+            else:
+                idx, right = candidates[right], right + 1
+
+            if self.words[idx : idx + len(words)] == words:
+                return self.get_character_span(list(range(idx, idx + len(words))))
+
+        return self.find_substring(token, near)
+
+    def find_substring(self, token: str, near: int) -> list[int] | None:
+        # Tokens that are not whole words, e.g. punctuation or part of a word
+        nearest = None
+        start = self.text.find(token)
+        while start >= 0:
+            if nearest is None or abs(start - near) < abs(nearest - near):
+                nearest = start
+            elif start > near:
+                break
+            start = self.text.find(token, start + 1)
+        return None if nearest is None else [nearest, nearest + len(token)]
+
+    def verify(self, info: TokenInfo) -> tuple[TokenInfo, SpanStatus]:
+        """Check a reported span against the text, and correct it if it is wrong."""
+        token = info.token
+        if not token:
+            return info, SpanStatus.EMPTY
+
+        span = info.character_span
+        if span and len(span) == 2 and self.text[span[0] : span[1]] == token:
+            token_index = self.get_token_index(*span)
+            if info.token_index == token_index:
+                return info, SpanStatus.VALID
+            return info.model_copy(update={"token_index": token_index}), SpanStatus.CORRECTED
+
+        near = 0
+        if span:
+            near = span[0]
+        elif info.token_index and info.token_index[0] < len(self.starts):
+            near = self.starts[info.token_index[0]]
+
+        found = self.find(token, near)
+        if found is None:
+            return info, SpanStatus.NOT_FOUND
+
+        corrected = TokenInfo(
+            token=self.text[found[0] : found[1]],
+            token_index=self.get_token_index(*found),
+            character_span=found,
+        )
+        if corrected == info:
+            return info, SpanStatus.VALID
+        return corrected, SpanStatus.CORRECTED
+
+
+@functools.lru_cache(maxsize=256)
+def get_text_index(text: str) -> TextIndex:
+    return TextIndex(text)
+
+
+def align_error(
+    err: MQMError, source_text: str | None, target_text: str | None
+) -> tuple[MQMError, SpanStatus, SpanStatus]:
+    """`err` with its source and target spans checked against the texts, and their statuses."""
+    update = {}
+    statuses = []
+    for field, text in (("in_source", source_text), ("in_target", target_text)):
+        info = getattr(err, field)
+        if not isinstance(text, str) or not text:
+            statuses.append(SpanStatus.UNCHECKED)
+            continue
+
+        aligned, status = get_text_index(text).verify(info)
+        statuses.append(status)
+        if aligned is not info:
+            update[field] = aligned
+
+    source_status, target_status = statuses
+    return (err.model_copy(update=update) if update else err), source_status, target_status
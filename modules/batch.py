@@ -0,0 +1,407 @@
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterable, Iterator
+from typing import IO
+from uuid import uuid4
+
+import pandas as pd
+from openai import AsyncOpenAI, OpenAIError
+from pydantic import BaseModel, ValidationError
+
+from config import BATCH_CONCURRENCY, MQM_PROMPTS, MQM_USER_PROMPT
+from modules.alignment import align_error
+from modules.budget import BudgetExceededError
+from modules.cache import ResponseCache
+from modules.client import get_async_openai_client
+from modules.llm import LLMRequest, LLMResponse, acreate_response
+from modules.models import GPT
+from modules.mqm import MQMAnnotation
+from modules.scoring import MQMScorer
+from modules.segmentation import merge_annotations, segment_documents
+from modules.templates import get_prefix_hash, get_template_registry
+from modules.translation_memory import MemoryScope, TranslationMemory
+
+BATCH_API_URL = "/v1/responses"
+
+SCENARIO_COLUMNS: dict[str, tuple[str, ...]] = {
+    "S-T": ("source", "translation"),
+    "R-T": ("reference", "translation"),
+    "S-R-T": ("source", "reference", "translation"),
+}
+LANG_COLUMNS = ("src_lang", "tgt_lang")  # optional per-row languages
+
+
+def read_segments(file: IO[bytes], file_name: str) -> pd.DataFrame:
+    if file_name.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(file, dtype=str)
+    else:
+        df = pd.read_csv(file, dtype=str)
+
+    df.columns = [str(col).strip().lower() for col in df.columns]
+    return df.fillna("").reset_index(drop=True)
+
+
+def missing_columns(df: pd.DataFrame, scenario: str) -> list[str]:
+    return [col for col in SCENARIO_COLUMNS[scenario] if col not in df.columns]
+
+
+class BatchResult(BaseModel):
+    row: int
+    annotation: MQMAnnotation | None = None
+    error: str | None = None
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+    memory: str | None = None  # "exact", "similar" or "repeat" of an earlier row of the run
+    similarity: float | None = None  # of the nearest segment in the translation memory
+
+
+class BatchEvaluator:
+    def __init__(
+        self,
+        api_key: str,
+        model: GPT,
+        scenario: str,
+        src_lang: str,
+        tgt_lang: str,
+        temperature: float = 0.1,
+        concurrency: int = BATCH_CONCURRENCY,
+        cache: ResponseCache | None = None,
+        prompt: str | None = None,
+        memory: TranslationMemory | None = None,
+        session_id: str | None = None,
+    ) -> None:
+        self.api_key = api_key
+        self.model = model
+        self.scenario = scenario
+        self.src_lang = src_lang
+        self.tgt_lang = tgt_lang
+        self.temperature = temperature
+        self.concurrency = max(1, concurrency)
+        self.cache = cache
+        self.memory = memory
+        self.session_id = session_id  # whose budget the requests count against
+        # A custom prompt, e.g. one edited in the main view, replaces the scenario's
+        self.template = get_template_registry().get(
+            prompt or MQM_PROMPTS[scenario].strip(), model.value.tokenizer_model
+        )
+
+    def build_request(self, row: dict[str, str]) -> LLMRequest:
+        # Per-row language columns take precedence over the batch-wide ones
+        placeholders = {"src_lang": self.src_lang, "tgt_lang": self.tgt_lang, **row}
+        return LLMRequest.from_system_prompt(
+            model=self.model,
+            system_prompt=self.template.render(placeholders),
+            history=[{"role": "user", "content": MQM_USER_PROMPT}],
+            temperature=self.temperature,
+            structured_output=True,
+            scenario=self.scenario,
+            session_id=self.session_id,
+        )
+
+    def get_texts(self, row: dict[str, str]) -> dict[str, str]:
+        return {col: row[col] for col in SCENARIO_COLUMNS[self.scenario]}
+
+    def get_scope(self, row: dict[str, str]) -> MemoryScope:
+        return MemoryScope(
+            scenario=self.scenario,
+            model=self.model.name,
+            src_lang=row.get("src_lang") or self.src_lang,
+            tgt_lang=row.get("tgt_lang") or self.tgt_lang,
+            prompt_hash=get_prefix_hash(self.template.template),
+        )
+
+    async def evaluate_row(
+        self,
+        client: AsyncOpenAI,
+        semaphore: asyncio.Semaphore,
+        index: int,
+        row: dict[str, str],
+    ) -> BatchResult:
+        match = None
+        if self.memory is not None:
+            match = self.memory.lookup(self.get_scope(row), self.get_texts(row))
+            if match is not None and match.exact:
+                return BatchResult(
+                    row=index, annotation=match.annotation, memory="exact", similarity=1.0
+                )
+
+        async with semaphore:
+            try:
+                response = await acreate_response(client, self.build_request(row), cache=self.cache)
+                annotation = MQMAnnotation.model_validate_json(response.output_text)
+            except (OpenAIError, ValidationError, BudgetExceededError) as e:
+                return BatchResult(row=index, error=str(e))
+
+        if self.memory is not None:
+            self.memory.add(self.get_scope(row), self.get_texts(row), annotation)
+
+        # A near match is only a suggestion; its spans point into different texts
+        return BatchResult(
+            row=index,
+            annotation=annotation,
+            input_tokens=response.input_tokens,
+            cached_tokens=response.cached_tokens,
+            output_tokens=response.output_tokens,
+            memory=None if match is None else "similar",
+            similarity=None if match is None else match.similarity,
+        )
+
+    async def evaluate(
+        self,
+        df: pd.DataFrame,
+        on_result: Callable[[BatchResult, int, int], None] | None = None,
+    ) -> list[BatchResult]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results: list[BatchResult] = []
+        rows = df.to_dict("records")
+
+        # Rows repeated within the run are evaluated once, with their first occurrence
+        first_rows: dict[tuple, int] = {}
+        repeats: dict[int, list[int]] = defaultdict(list)
+        for index, row in enumerate(rows):
+            key = tuple(row.get(col) for col in (*SCENARIO_COLUMNS[self.scenario], *LANG_COLUMNS))
+            if key in first_rows:
+                repeats[first_rows[key]].append(index)
+            else:
+                first_rows[key] = index
+
+        async with get_async_openai_client(self.api_key) as client:
+            tasks = [
+                asyncio.create_task(self.evaluate_row(client, semaphore, index, rows[index]))
+                for index in first_rows.values()
+            ]
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                for repeat in (result, *self.copy_result(result, repeats[result.row])):
+                    results.append(repeat)
+                    if on_result is not None:
+                        on_result(repeat, len(results), len(rows))
+
+        return sorted(results, key=lambda result: result.row)
+
+    @staticmethod
+    def copy_result(result: BatchResult, rows: list[int]) -> list[BatchResult]:
+        # Only the first occurrence used any tokens
+        return [
+            BatchResult(row=row, annotation=result.annotation, error=result.error, memory="repeat")
+            for row in rows
+        ]
+
+    def run(
+        self,
+        df: pd.DataFrame,
+        on_result: Callable[[BatchResult, int, int], None] | None = None,
+    ) -> list[BatchResult]:
+        return asyncio.run(self.evaluate(df, on_result))
+
+    def run_document(
+        self,
+        documents: dict[str, str],
+        on_result: Callable[[BatchResult, int, int], None] | None = None,
+    ) -> tuple[MQMAnnotation, list[BatchResult]]:
+        """
+        Evaluate long documents as aligned chunks in parallel, and merge the chunks' annotations
+        into one with document-level spans.
+        """
+        chunks = segment_documents(
+            {name: documents[name] for name in SCENARIO_COLUMNS[self.scenario]}
+        )
+        results = self.run(pd.DataFrame([chunk.texts for chunk in chunks]), on_result)
+        annotations = {result.row: result.annotation for result in results}
+        annotation = merge_annotations(
+            chunks,
+            [annotations.get(idx) for idx in range(len(chunks))],
+            source_name="source" if "S-" in self.scenario else "reference",
+        )
+        return annotation, results
+
+    def to_batch_requests(self, df: pd.DataFrame) -> Iterator[str]:
+        """Serialize every row as a line of a Batch API request file."""
+        for index, row in enumerate(df.to_dict("records")):
+            yield json.dumps(
+                {
+                    "custom_id": f"row-{index}",
+                    "method": "POST",
+                    "url": BATCH_API_URL,
+                    "body": self.build_request(row).to_kwargs(),
+                },
+                ensure_ascii=False,
+            )
+
+    def from_batch_results(self, lines: Iterable[str | bytes]) -> list[BatchResult]:
+        """Parse the lines of a Batch API result file back into per-row results."""
+        results = []
+        for line in lines:
+            if not line.strip():
+                continue
+
+            item = json.loads(line)
+            index = int(item["custom_id"].removeprefix("row-"))
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                error = item.get("error") or response.get("body", {}).get("error")
+                results.append(BatchResult(row=index, error=json.dumps(error)))
+                continue
+
+            llm_response = LLMResponse.from_body(response["body"])
+            try:
+                annotation = MQMAnnotation.model_validate_json(llm_response.output_text)
+            except ValidationError as e:
+                results.append(BatchResult(row=index, error=str(e)))
+                continue
+
+            results.append(
+                BatchResult(
+                    row=index,
+                    annotation=annotation,
+                    input_tokens=llm_response.input_tokens,
+                    cached_tokens=llm_response.cached_tokens,
+                    output_tokens=llm_response.output_tokens,
+                )
+            )
+
+        return sorted(results, key=lambda result: result.row)
+
+    def results_to_summary(self, df: pd.DataFrame, results: list[BatchResult]) -> pd.DataFrame:
+        summary = pd.DataFrame(
+            {
+                "row": [result.row for result in results],
+                "errors": [
+                    len(result.annotation.errors) if result.annotation else None
+                    for result in results
+                ],
+                "input_tokens": [result.input_tokens for result in results],
+                "cached_tokens": [result.cached_tokens for result in results],
+                "output_tokens": [result.output_tokens for result in results],
+                "memory": [result.memory for result in results],
+                "similarity": [result.similarity for result in results],
+                "failure": [result.error for result in results],
+            }
+        )
+        columns = list(SCENARIO_COLUMNS[self.scenario])
+        return df.loc[summary["row"], columns].reset_index(drop=True).join(summary)
+
+    def results_to_table(self, df: pd.DataFrame, results: list[BatchResult]) -> pd.DataFrame:
+        rows = []
+        for result in results:
+            if result.annotation is None:
+                continue
+
+            segment = df.iloc[result.row]
+            test_id = uuid4().hex
+            # Without a source, the reference is what `in_source` points into
+            source_text = segment.get("source" if "S-" in self.scenario else "reference")
+            for err, source_status, target_status in (
+                align_error(err, source_text, segment.get("translation"))
+                for err in result.annotation.errors
+            ):
+                rows.append(
+                    {
+                        "test_id": test_id,
+                        "test_scenario": self.scenario,
+                        "row": result.row,
+                        "source_language": segment.get("src_lang", self.src_lang),
+                        "target_language": segment.get("tgt_lang", self.tgt_lang),
+                        "source_text": segment.get("source"),
+                        "target_text": segment.get("translation"),
+                        "reference_text": segment.get("reference"),
+                        "error_category": err.category.value,
+                        "severity": err.severity.value,
+                        "source_tokens": err.in_source.token,
+                        "source_tokens_index": err.in_source.token_index,
+                        "source_character_span": err.in_source.character_span,
+                        "target_tokens": err.in_target.token,
+                        "target_tokens_index": err.in_target.token_index,
+                        "target_character_span": err.in_target.character_span,
+                        "source_span_status": source_status.value,
+                        "target_span_status": target_status.value,
+                    }
+                )
+        return pd.DataFrame(rows)
+
+    def add_to_scorer(
+        self, scorer: MQMScorer, df: pd.DataFrame, results: list[BatchResult]
+    ) -> None:
+        annotated = [
+            (result.row, result.annotation) for result in results if result.annotation is not None
+        ]
+        rows = [row for row, _ in annotated]
+        segments = df.iloc[rows]
+
+        def language(column: str, default: str) -> pd.Series | str:
+            # Per-row language columns take precedence over the batch-wide ones
+            return segments[column].to_numpy() if column in segments else default
+
+        scorer.add(
+            pd.DataFrame(
+                {
+                    "row": rows,
+                    "scenario": self.scenario,
+                    "model": self.model.name,
+                    "source_language": language("src_lang", self.src_lang),
+                    "target_language": language("tgt_lang", self.tgt_lang),
+                    "target_text": segments["translation"].to_numpy(),
+                }
+            ),
+            pd.DataFrame(
+                [
+                    (row, err.category.value, err.severity.value)
+                    for row, annotation in annotated
+                    for err in annotation.errors
+                ],
+                columns=["row", "error_category", "severity"],
+            ),
+            key="row",
+        )
+
+
+def simulate_batch(request_lines: Iterable[str | bytes]) -> Iterator[str]:
+    """
+    Local stand-in for the Batch API: answer every request with an empty, schema-valid MQM
+    annotation, in the same result format the API returns.
+    """
+    for line in request_lines:
+        if not line.strip():
+            continue
+
+        request = json.loads(line)
+        output_text = MQMAnnotation().model_dump_json()
+        body = {
+            "id": f"resp_{uuid4().hex}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "status": "completed",
+            "model": request["body"]["model"],
+            "output": [
+                {
+                    "type": "message",
+                    "id": f"msg_{uuid4().hex}",
+                    "status": "completed",
+                    "role": "assistant",
+                    "content": [{"type": "output_text", "text": output_text, "annotations": []}],
+                }
+            ],
+            "usage": {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0},
+        }
+        yield json.dumps(
+            {
+                "id": f"batch_req_{uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid4().hex, "body": body},
+                "error": None,
+            },
+            ensure_ascii=False,
+        )
+
+
+if __name__ == "__main__":
+    # python -m modules.batch requests.jsonl results.jsonl
+    requests_path, results_path = sys.argv[1:3]
+    with open(requests_path, encoding="utf-8") as requests_file:
+        with open(results_path, "w", encoding="utf-8") as results_file:
+            for result_line in simulate_batch(requests_file):
+                results_file.write(result_line + "\n")
@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+from uuid import uuid4
+
+import streamlit as st
+
+from config import (
+    BUDGET_DOWNGRADE,
+    BUDGET_KEY_USD,
+    BUDGET_PERIOD,
+    BUDGET_PROCESS_USD,
+    BUDGET_QUEUE_TIMEOUT,
+    BUDGET_RESERVATION_TTL,
+    BUDGET_SESSION_USD,
+    EXPECTED_OUTPUT_TOKENS,
+    METRICS_STORE_PATH,
+)
+from modules.models import GPT
+
+if TYPE_CHECKING:
+    from modules.llm import LLMRequest
+
+
+class BudgetExceededError(RuntimeError):
+    pass
+
+
+def estimate_cost(
+    model: GPT, estimated_tokens: int, expected_output_tokens: int = EXPECTED_OUTPUT_TOKENS
+) -> float:
+    """Pre-flight cost of a request, from the same estimate the rate limiter reserves."""
+    output_tokens = min(expected_output_tokens, estimated_tokens)
+    return model.value.calculate_cost(estimated_tokens - output_tokens, 0, output_tokens)
+
+
+def get_key_id(api_key: str) -> str:
+    # Budgets are kept per key without keeping the key itself
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class Budget:
+    def __init__(
+        self, scope: str, name: str, limit: float, spent: float = 0.0, reserved: float = 0.0
+    ) -> None:
+        self.scope = scope
+        self.name = name
+        self.limit = limit  # USD per period, 0 for no ceiling
+        self.spent = spent
+        self.reserved = reserved  # estimates of the requests in flight, in every process
+
+    def fits(self, cost: float) -> bool:
+        return not self.limit or self.spent + self.reserved + cost <= self.limit
+
+    def fits_once_settled(self, cost: float) -> bool:
+        return not self.limit or self.spent + cost <= self.limit
+
+
+class Reservation:
+    def __init__(
+        self, request: "LLMRequest", budgets: list[Budget], cost: float, period_start: float
+    ) -> None:
+        self.id = uuid4().hex
+        self.request = request  # with a cheaper model, if it had to be downgraded
+        self.budgets = budgets
+        self.cost = cost
+        self.period_start = period_start
+
+
+class SpendStore:
+    """SQLite record of the spend and the reservations in flight of every budget."""
+
+    def __init__(self, path: str = METRICS_STORE_PATH) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS budget_spend (
+                scope TEXT NOT NULL,
+                name TEXT NOT NULL,
+                period_start REAL NOT NULL,
+                spent REAL NOT NULL,
+                PRIMARY KEY (scope, name, period_start)
+            );
+            CREATE TABLE IF NOT EXISTS budget_reservations (
+                reservation_id TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                name TEXT NOT NULL,
+                cost REAL NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS budget_reservations_id
+                ON budget_reservations (reservation_id);
+            CREATE INDEX IF NOT EXISTS budget_reservations_budget
+                ON budget_reservations (scope, name);
+            """
+        )
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        # Taking the write lock up front makes a check and the reservation that follows it
+        # atomic across processes
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def get_totals(self, scope: str, name: str, period_start: float) -> tuple[float, float]:
+        """What a budget has spent in the period, and what is reserved against it."""
+        with self._lock:
+            spent = self._conn.execute(
+                "SELECT spent FROM budget_spend WHERE scope = ? AND name = ? AND period_start = ?",
+                (scope, name, period_start),
+            ).fetchone()
+            (reserved,) = self._conn.execute(
+                "SELECT COALESCE(SUM(cost), 0) FROM budget_reservations "
+                "WHERE scope = ? AND name = ? AND expires_at > ?",
+                (scope, name, time.time()),
+            ).fetchone()
+        return (spent[0] if spent else 0.0), reserved
+
+    def reserve(self, reservation: Reservation, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM budget_reservations WHERE expires_at <= ?", (now,))
+            self._conn.executemany(
+                "INSERT INTO budget_reservations VALUES (?, ?, ?, ?, ?)",
+                [
+                    (reservation.id, budget.scope, budget.name, reservation.cost, now + ttl)
+                    for budget in reservation.budgets
+                ],
+            )
+
+    def settle(self, reservation: Reservation, actual_cost: float) -> None:
+        with self.transaction():
+            self._conn.execute(
+                "DELETE FROM budget_reservations WHERE reservation_id = ?", (reservation.id,)
+            )
+            if actual_cost:
+                self._conn.executemany(
+                    "INSERT INTO budget_spend VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (scope, name, period_start) "
+                    "DO UPDATE SET spent = spent + excluded.spent",
+                    [
+                        (budget.scope, budget.name, reservation.period_start, actual_cost)
+                        for budget in reservation.budgets
+                    ],
+                )
+
+
+class BudgetController:
+    """
+    Admission control of API spend against ceilings per session, per API key and per process.
+
+    Every request reserves its estimated cost in each of its budgets before it is sent, and
+    settles the reservation with its actual cost once answered. A request that does not fit
+    waits for the requests in flight if their settling could make room for it, then, if the
+    request allows it, falls back to the most capable cheaper model that fits, and is rejected
+    otherwise. Spend and reservations are kept in SQLite, so the session and key ceilings hold
+    across Streamlit workers, batch processes and restarts; admission is one short transaction,
+    so it adds no perceptible latency.
+    """
+
+    def __init__(
+        self,
+        session_limit: float = BUDGET_SESSION_USD,
+        key_limit: float = BUDGET_KEY_USD,
+        process_limit: float = BUDGET_PROCESS_USD,
+        period: int = BUDGET_PERIOD,
+        queue_timeout: float = BUDGET_QUEUE_TIMEOUT,
+        downgrade: bool = BUDGET_DOWNGRADE,
+        store: SpendStore | None = None,
+    ) -> None:
+        self.limits = {"session": session_limit, "key": key_limit, "process": process_limit}
+        self.period = period
+        self.queue_timeout = queue_timeout
+        self.downgrade = downgrade
+        self.store = store or SpendStore()
+        self.process_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._condition = threading.Condition()
+
+    def get_period_start(self) -> float:
+        # Spend is counted per period, e.g. per day, and starts from zero in the next one
+        return time.time() // self.period * self.period
+
+    def get_budgets(
+        self, session_id: str | None, key_id: str | None, period_start: float
+    ) -> list[Budget]:
+        scopes = [("process", self.process_id)]
+        if key_id:
+            scopes.append(("key", key_id))
+        if session_id:
+            scopes.append(("session", session_id))
+        return [
+            Budget(
+                scope, name, self.limits[scope], *self.store.get_totals(scope, name, period_start)
+            )
+            for scope, name in scopes
+        ]
+
+    def try_admit(
+        self,
+        request: "LLMRequest",
+        estimated_tokens: int,
+        key_id: str | None,
+        can_wait: bool,
+    ) -> Reservation | None:
+        """A reservation, or None if the request should wait; must hold the condition."""
+        with self.store.transaction():
+            period_start = self.get_period_start()
+            budgets = self.get_budgets(request.session_id, key_id, period_start)
+            cost = estimate_cost(request.model, estimated_tokens)
+            if all(budget.fits(cost) for budget in budgets):
+                return self.reserve(Reservation(request, budgets, cost, period_start))
+
+            # The requests in flight usually settle below their estimates
+            if can_wait and all(budget.fits_once_settled(cost) for budget in budgets):
+                return None
+
+            if self.downgrade and request.allow_downgrade:
+                costs = {model: estimate_cost(model, estimated_tokens) for model in GPT}
+                cheaper = sorted(
+                    (model for model in GPT if costs[model] < cost), key=lambda m: costs[m]
+                )
+                for model in reversed(cheaper):
+                    if all(budget.fits(costs[model]) for budget in budgets):
+                        print(f"BUDGET: {request.model.name} downgraded to {model.name}")
+                        downgraded = request.model_copy(update={"model": model})
+                        return self.reserve(
+                            Reservation(downgraded, budgets, costs[model], period_start)
+                        )
+
+        exceeded = next(budget for budget in budgets if not budget.fits(cost))
+        raise BudgetExceededError(
+            f"The {exceeded.scope} budget of ${exceeded.limit:.4f} would be exceeded "
+            f"(${exceeded.spent:.4f} spent, ${exceeded.reserved:.4f} in flight, "
+            f"${cost:.4f} requested)"
+        )
+
+    def reserve(self, reservation: Reservation) -> Reservation:
+        self.store.reserve(reservation, BUDGET_RESERVATION_TTL)
+        return reservation
+
+    def admit(
+        self, request: "LLMRequest", estimated_tokens: int, key_id: str | None = None
+    ) -> Reservation:
+        deadline = time.monotonic() + self.queue_timeout
+        with self._condition:
+            while True:
+                remaining = deadline - time.monotonic()
+                reservation = self.try_admit(request, estimated_tokens, key_id, remaining > 0)
+                if reservation is not None:
+                    return reservation
+                # Woken by this process's requests, and polled for those of the others
+                self._condition.wait(min(0.05, remaining))
+
+    async def aadmit(
+        self, request: "LLMRequest", estimated_tokens: int, key_id: str | None = None
+    ) -> Reservation:
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            with self._condition:
+                reservation = self.try_admit(request, estimated_tokens, key_id, remaining > 0)
+            if reservation is not None:
+                return reservation
+            # Polled, since the event loop must not block on the condition
+            await asyncio.sleep(min(0.05, remaining))
+
+    def settle(self, reservation: Reservation, actual_cost: float = 0.0) -> None:
+        """Replace a reservation with what the request actually cost, 0 if it failed."""
+        with self._condition:
+            try:
+                self.store.settle(reservation, actual_cost)
+            except sqlite3.Error as e:
+                # The reservation expires on its own; the request must not fail for it
+                print("BUDGET NOT SETTLED:", e)
+            self._condition.notify_all()
+
+    def get_spend(self, session_id: str | None = None) -> dict[str, float]:
+        """Spend of the current period per scope, for display."""
+        with self._condition:
+            budgets = self.get_budgets(session_id, None, self.get_period_start())
+        return {budget.scope: budget.spent for budget in budgets}
+
+
+@st.cache_resource
+def get_budget_controller() -> BudgetController:
+    """One controller per process, shared by every session and batch job."""
+    return BudgetController()
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import streamlit as st
+
+from config import (
+    OUTPUT_RATIO_MIN_SAMPLES,
+    RESPONSE_CACHE_MAX_AGE,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_PATH,
+)
+
+if TYPE_CHECKING:
+    from modules.llm import LLMRequest, LLMResponse
+
+
+class ResponseCache:
+    """Disk-backed LRU cache of LLM responses, keyed on the full request payload."""
+
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        max_age: int = RESPONSE_CACHE_MAX_AGE,
+    ) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Per process, across every session that uses it
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                model TEXT,
+                scenario TEXT
+            )
+            """
+        )
+        # Caches created before responses were tagged with their model and scenario
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(responses)")}
+        for column in ("model", "scenario"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE responses ADD COLUMN {column} TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+
+    @staticmethod
+    def make_key(request: "LLMRequest") -> str:
+        payload = json.dumps(request.to_kwargs(), ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, request: "LLMRequest") -> "LLMResponse | None":
+        from modules.llm import LLMResponse
+
+        key = self.make_key(request)
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND created_at >= ?",
+                (key, now - self.max_age),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+
+        response = LLMResponse.model_validate_json(row[0])
+        response.from_cache = True
+        return response
+
+    def set(self, request: "LLMRequest", response: "LLMResponse") -> None:
+        value = response.model_dump_json(exclude={"from_cache"})
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO responses
+                    (key, value, size, created_at, accessed_at, model, scenario)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    self.make_key(request),
+                    value,
+                    len(value),
+                    now,
+                    now,
+                    request.model.name,
+                    request.scenario,
+                ),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age,))
+
+        (total,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+
+        # Least recently used first, until the cache fits again
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def get_output_ratio(
+        self,
+        scenario: str | None = None,
+        model: str | None = None,
+        min_samples: int = OUTPUT_RATIO_MIN_SAMPLES,
+    ) -> float | None:
+        """
+        Historical output/input token ratio of the cached responses of a scenario and model.
+
+        Chat answers and MQM annotations differ widely in length, so the ratio is only taken over
+        responses like the ones being estimated, and only once there are `min_samples` of them.
+        """
+        with self._lock:
+            count, input_tokens, output_tokens = self._conn.execute(
+                """
+                SELECT
+                    COUNT(*),
+                    SUM(json_extract(value, '$.input_tokens')),
+                    SUM(json_extract(value, '$.output_tokens'))
+                FROM responses
+                WHERE (scenario = ?1 OR ?1 IS NULL) AND (model = ?2 OR ?2 IS NULL)
+                """,
+                (scenario, model),
+            ).fetchone()
+        if count < max(1, min_samples) or not input_tokens:
+            return None
+        return output_tokens / input_tokens
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    return ResponseCache()
@@ -0,0 +1,118 @@
+import asyncio
+import random
+import time
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+import streamlit as st
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, OpenAI
+
+from config import (
+    OPENAI_BASE_URL,
+    OPENAI_MAX_BACKOFF,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_RETRIES,
+    OPENAI_TIMEOUT,
+)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def get_http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        keepalive_expiry=60,
+    )
+
+
+@st.cache_resource
+def get_openai_client(api_key: str) -> OpenAI:
+    """One client per API key per process, so that connections and TLS sessions are reused."""
+    return OpenAI(
+        api_key=api_key,
+        base_url=OPENAI_BASE_URL,
+        max_retries=0,  # retried by `with_retries` instead
+        http_client=httpx.Client(limits=get_http_limits(), timeout=OPENAI_TIMEOUT),
+    )
+
+
+def get_async_openai_client(api_key: str) -> AsyncOpenAI:
+    # Async connections are bound to the event loop that opened them, so these are pooled per
+    # batch run rather than per process
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=OPENAI_BASE_URL,
+        max_retries=0,
+        http_client=httpx.AsyncClient(limits=get_http_limits(), timeout=OPENAI_TIMEOUT),
+    )
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, APIConnectionError)
+
+
+def parse_retry_after(headers: httpx.Headers) -> float | None:
+    if retry_after_ms := headers.get("retry-after-ms"):
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    if retry_after := headers.get("retry-after"):
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+            return (retry_at - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            pass
+
+    return None
+
+
+def get_retry_delay(error: Exception, attempt: int) -> float:
+    """Seconds to wait before retry `attempt`, preferring the server's retry-after headers."""
+    if isinstance(error, APIStatusError):
+        retry_after = parse_retry_after(error.response.headers)
+        if retry_after is not None:
+            return min(max(retry_after, 0), OPENAI_MAX_BACKOFF)
+
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(OPENAI_MAX_BACKOFF, 0.5 * 2**attempt))
+
+
+def with_retries[T](call: Callable[[], T], max_retries: int = OPENAI_MAX_RETRIES) -> T:
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except (APIStatusError, APIConnectionError) as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = get_retry_delay(e, attempt)
+            print(f"Retrying in {delay:.2f}s after {type(e).__name__}")
+            time.sleep(delay)
+            attempt += 1
+
+
+async def awith_retries[T](
+    call: Callable[[], Awaitable[T]], max_retries: int = OPENAI_MAX_RETRIES
+) -> T:
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except (APIStatusError, APIConnectionError) as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = get_retry_delay(e, attempt)
+            print(f"Retrying in {delay:.2f}s after {type(e).__name__}")
+            await asyncio.sleep(delay)
+            attempt += 1
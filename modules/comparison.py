@@ -0,0 +1,159 @@
+import asyncio
+import time
+from collections.abc import Callable
+
+import pandas as pd
+from openai import AsyncOpenAI, OpenAIError
+from pydantic import BaseModel
+
+from modules.batch import BatchEvaluator, BatchResult
+from modules.budget import BudgetExceededError
+from modules.cache import ResponseCache
+from modules.client import get_async_openai_client
+from modules.llm import acreate_response
+from modules.models import GPT
+from modules.mqm import MQMAnnotation, parse_annotation
+from modules.scoring import MQMScorer
+
+
+class ModelResult(BaseModel):
+    model: GPT
+    output_text: str = ""
+    annotation: MQMAnnotation | None = None
+    salvaged: bool = False
+    error: str | None = None
+    latency: float = 0  # seconds, from sending the request to the parsed answer
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+    from_cache: bool = False
+
+    @property
+    def cost(self) -> float:
+        # As in `LLMResponse.get_cost`, a cached answer costs nothing again
+        if self.from_cache:
+            return 0.0
+        return self.model.value.calculate_cost(
+            self.input_tokens, self.cached_tokens, self.output_tokens
+        )
+
+
+class ModelComparison:
+    """
+    Send the same segment to several models at once, so the wait is that of the slowest model
+    rather than the sum of all of them.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        models: list[GPT],
+        scenario: str,
+        src_lang: str,
+        tgt_lang: str,
+        temperature: float = 0.1,
+        cache: ResponseCache | None = None,
+        prompt: str | None = None,
+        session_id: str | None = None,
+    ) -> None:
+        self.api_key = api_key
+        self.scenario = scenario
+        self.cache = cache
+        # Each model renders the prompt with its own tokenizer
+        self.evaluators = [
+            BatchEvaluator(
+                api_key=api_key,
+                model=model,
+                scenario=scenario,
+                src_lang=src_lang,
+                tgt_lang=tgt_lang,
+                temperature=temperature,
+                cache=cache,
+                prompt=prompt,
+                session_id=session_id,
+            )
+            for model in models
+        ]
+
+    async def evaluate_model(
+        self, client: AsyncOpenAI, evaluator: BatchEvaluator, row: dict[str, str]
+    ) -> ModelResult:
+        started_at = time.perf_counter()
+        try:
+            response = await acreate_response(client, evaluator.build_request(row), self.cache)
+        except (OpenAIError, BudgetExceededError) as e:
+            return ModelResult(
+                model=evaluator.model, error=str(e), latency=time.perf_counter() - started_at
+            )
+
+        annotation, salvaged = parse_annotation(response.output_text, lenient=True)
+        return ModelResult(
+            model=evaluator.model,
+            output_text=response.output_text,
+            annotation=annotation,
+            salvaged=salvaged,
+            latency=time.perf_counter() - started_at,
+            input_tokens=response.input_tokens,
+            cached_tokens=response.cached_tokens,
+            output_tokens=response.output_tokens,
+            from_cache=response.from_cache,
+        )
+
+    async def evaluate(
+        self,
+        row: dict[str, str],
+        on_result: Callable[[ModelResult, int, int], None] | None = None,
+    ) -> list[ModelResult]:
+        results: list[ModelResult] = []
+
+        async with get_async_openai_client(self.api_key) as client:
+            tasks = [
+                asyncio.create_task(self.evaluate_model(client, evaluator, row))
+                for evaluator in self.evaluators
+            ]
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                results.append(result)
+                if on_result is not None:
+                    on_result(result, len(results), len(tasks))
+
+        # Back in the order the models were chosen
+        order = [evaluator.model for evaluator in self.evaluators]
+        return sorted(results, key=lambda result: order.index(result.model))
+
+    def run(
+        self,
+        row: dict[str, str],
+        on_result: Callable[[ModelResult, int, int], None] | None = None,
+    ) -> list[ModelResult]:
+        return asyncio.run(self.evaluate(row, on_result))
+
+    def results_to_summary(self, row: dict[str, str], results: list[ModelResult]) -> pd.DataFrame:
+        """One row per model: latency, tokens, cost, and its MQM errors and score."""
+        segments = pd.DataFrame([row])
+        scorer = MQMScorer()
+        for evaluator, result in zip(self.evaluators, results):
+            if result.annotation is None:
+                continue
+            evaluator.add_to_scorer(
+                scorer, segments, [BatchResult(row=0, annotation=result.annotation)]
+            )
+        scores = scorer.scores(by=("model",))
+
+        summary = pd.DataFrame(
+            [
+                {
+                    "model": result.model.name,
+                    "latency_s": result.latency,
+                    "input_tokens": result.input_tokens,
+                    "cached_tokens": result.cached_tokens,
+                    "output_tokens": result.output_tokens,
+                    "cost_usd": result.cost,
+                    "from_cache": result.from_cache,
+                    "salvaged": result.salvaged,
+                    "error": result.error,
+                }
+                for result in results
+            ]
+        )
+        return summary.join(scores.drop(columns=["segments"]), on="model")
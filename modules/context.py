@@ -0,0 +1,127 @@
+from collections.abc import Callable
+
+from openai import OpenAI
+from pydantic import BaseModel, Field
+
+from config import (
+    CONTEXT_BUDGET_RATIO,
+    CONTEXT_SUMMARY_PROMPT,
+    CONTEXT_WINDOW_MESSAGES,
+    EXPECTED_OUTPUT_TOKENS,
+)
+from modules.llm import LLMRequest, create_response
+from modules.models import GPT
+from modules.tokens import count_message_tokens
+
+type Message = dict[str, str]
+type Summarizer = Callable[[list[Message]], str]
+
+PINNED_ROLES = ("system", "developer")
+
+
+class ContextReport(BaseModel):
+    original_tokens: int = 0
+    final_tokens: int = 0
+    # Tokens removed by each strategy; the summary's entry is negative, since it adds tokens back
+    saved: dict[str, int] = Field(default_factory=dict)
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.final_tokens
+
+
+class ContextManager:
+    """
+    Fit a conversation history into a per-model token budget.
+
+    System and developer messages and the latest user message are always kept. The remaining
+    messages are limited to a sliding window of the most recent ones, then dropped oldest first
+    until the budget is met. Dropped messages can optionally be replaced by a summary.
+    """
+
+    def __init__(
+        self,
+        model: GPT,
+        max_tokens: int | None = None,
+        window: int | None = CONTEXT_WINDOW_MESSAGES,
+        summarizer: Summarizer | None = None,
+    ) -> None:
+        self.model = model
+        self.max_tokens = max_tokens or (
+            int(model.value.context_window * CONTEXT_BUDGET_RATIO) - EXPECTED_OUTPUT_TOKENS
+        )
+        self.window = window
+        self.summarizer = summarizer
+        self._summaries: dict[tuple[str, ...], str] = {}
+
+    def count(self, message: Message) -> int:
+        return count_message_tokens(message["content"], self.model.value.tokenizer_model)
+
+    def get_pinned(self, history: list[Message]) -> set[int]:
+        pinned = {idx for idx, msg in enumerate(history) if msg["role"] in PINNED_ROLES}
+        for idx in range(len(history) - 1, -1, -1):
+            if history[idx]["role"] == "user":
+                pinned.add(idx)
+                break
+        return pinned
+
+    def fit(self, history: list[Message]) -> tuple[list[Message], ContextReport]:
+        counts = [self.count(msg) for msg in history]
+        pinned = self.get_pinned(history)
+        keep = set(range(len(history)))
+        report = ContextReport(original_tokens=sum(counts), saved={"window": 0, "budget": 0})
+
+        if self.window is not None:
+            unpinned = [idx for idx in range(len(history)) if idx not in pinned]
+            for idx in unpinned[: max(0, len(unpinned) - self.window)]:
+                keep.discard(idx)
+                report.saved["window"] += counts[idx]
+
+        total = sum(counts[idx] for idx in keep)
+        for idx in sorted(keep - pinned):
+            if total <= self.max_tokens:
+                break
+            keep.discard(idx)
+            total -= counts[idx]
+            report.saved["budget"] += counts[idx]
+
+        messages = [history[idx] for idx in sorted(keep)]
+        dropped = [history[idx] for idx in range(len(history)) if idx not in keep]
+
+        if dropped and self.summarizer is not None:
+            summary = {"role": "developer", "content": self.summarize(dropped, self.summarizer)}
+            summary_tokens = self.count(summary)
+            # Only worth it if the summary still fits and is shorter than what it replaces
+            dropped_tokens = report.saved["window"] + report.saved["budget"]
+            if total + summary_tokens <= self.max_tokens and summary_tokens < dropped_tokens:
+                n_leading = next(
+                    (idx for idx, msg in enumerate(messages) if msg["role"] not in PINNED_ROLES),
+                    len(messages),
+                )
+                messages.insert(n_leading, summary)
+                total += summary_tokens
+                report.saved["summary"] = -summary_tokens
+
+        report.final_tokens = total
+        return messages, report
+
+    def summarize(self, messages: list[Message], summarizer: Summarizer) -> str:
+        # Reuse the last summary for as long as the dropped messages stay the same
+        key = tuple(msg["content"] for msg in messages)
+        if key not in self._summaries:
+            self._summaries = {key: summarizer(messages)}
+        return self._summaries[key]
+
+
+def get_llm_summarizer(client: OpenAI, model: GPT) -> Summarizer:
+    def summarize(messages: list[Message]) -> str:
+        transcript = "\n\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        request = LLMRequest(
+            model=model,
+            instructions=CONTEXT_SUMMARY_PROMPT,
+            messages=[{"role": "user", "content": transcript}],
+        )
+        summary = create_response(client, request).output_text
+        return f"Summary of the earlier conversation:\n{summary}"
+
+    return summarize
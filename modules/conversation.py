@@ -1,40 +1,267 @@
-import json
+import math
+import os
+import tempfile
+from collections.abc import Iterable, Iterator, Sequence
 from io import BytesIO
+from typing import TYPE_CHECKING, Any
 from uuid import uuid4
 
-import numpy as np
-import pandas as pd
 import streamlit as st
 
+from config import RESUME_MESSAGES
+from modules.alignment import SpanStatus, align_error
 from modules.models import GPT
+from modules.mqm import (
+    ErrorCategory,
+    MQMAnnotation,
+    MQMError,
+    MQMParseError,
+    Severity,
+    parse_annotation,
+)
+from modules.store import get_conversation_store
+from modules.tokens import STATIC_ROLES, TokenLedger
 
-type Message = dict[str, str]
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from modules.context import ContextManager, ContextReport, Summarizer
+    from modules.llm import LLMResponse
+
+# Assistant messages can also carry their parsed "annotation", see `get_annotation`
+type Message = dict[str, Any]
+
+EXPORT_MIME_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+    "csv": "text/csv",
+}
+
+TABLE_COLUMNS = (
+    "test_id",
+    "test_scenario",
+    "error_id",
+    "source_language",
+    "target_language",
+    "reference_language",
+    "source_text",
+    "target_text",
+    "reference_text",
+    "error_category",
+    "severity",
+    "source_tokens",
+    "source_tokens_index",
+    "source_character_span",
+    "target_tokens",
+    "target_tokens_index",
+    "target_character_span",
+    "source_span_status",
+    "target_span_status",
+)
+BOLD_COLUMNS = {"test_scenario", "error_category", "severity"}
+
+
+def to_cell(value: Any) -> Any:
+    """Convert a table value into something xlsxwriter can write, as `DataFrame.to_excel` does."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, (list, tuple)):
+        return str(value)
+    return value
 
 
 class ConversationHandler:
     def __init__(self) -> None:
         st.session_state.messages = []
+        self.ledger = TokenLedger()
+        self.context_manager: "ContextManager | None" = None
+        self.store = get_conversation_store()
+        # Older messages of a resumed session that have not been read from the store yet
+        self.n_unloaded = 0
+        self._first_loaded_seq: int | None = None
+        # Messages of a turn that has not been admitted yet, with their token counts and settings
+        self.pending: list[tuple[Message, int]] = []
+        self.pending_settings: dict[str, Any] | None = None
+
+        if session_id := st.session_state.get("session_id"):
+            self.resume(session_id)
 
-    def add_message(self, message: Message) -> None:
+    def add_message(self, message: Message, persist: bool = True) -> None:
+        """
+        Add a message to the conversation and the store. With `persist=False` it is only kept
+        in memory until the next persisted message, or until `discard_pending` drops it.
+        """
         st.session_state.messages.append(message)
 
+        n_tokens = 0
+        model = st.session_state.get("model_options", {}).get("openai_model")
+        if model is not None:
+            n_tokens = self.ledger.record(message["role"], message["content"], model)
+
+        if persist:
+            self.persist_pending()
+            self.append_to_store(message, n_tokens)
+        else:
+            self.pending.append((message, n_tokens))
+
+    def append_to_store(self, message: Message, n_tokens: int) -> None:
+        self.store.append(
+            st.session_state["session_id"], message, n_tokens, st.session_state.get("client_id")
+        )
+
+    def persist_pending(self) -> None:
+        for message, n_tokens in self.pending:
+            self.append_to_store(message, n_tokens)
+        if self.pending_settings is not None:
+            self.store.set_settings(st.session_state["session_id"], self.pending_settings)
+        self.pending.clear()
+        self.pending_settings = None
+
+    def discard_pending(self) -> None:
+        """Drop a turn whose request was rejected, so that it is neither stored nor resent."""
+        for message, _ in reversed(self.pending):
+            st.session_state.messages.pop()
+            if message["role"] not in STATIC_ROLES:
+                self.ledger.remove_last()
+        self.pending.clear()
+        self.pending_settings = None
+
+    def save_settings(self, system_prompt: str) -> None:
+        """Keep the prompt settings of the session, so that resuming it restores them."""
+        settings = {
+            "structured_output": st.session_state.get("structured_output", False),
+            "scenario": st.session_state.get("scenario"),
+            "system_prompt": system_prompt,
+            "prompt_placeholders": dict(st.session_state.get("prompt_placeholders") or {}),
+        }
+        # Saved together with the turn they were sent with
+        if self.pending:
+            self.pending_settings = settings
+        else:
+            self.store.set_settings(st.session_state["session_id"], settings)
+
+    def restore_settings(self, settings: dict[str, Any]) -> None:
+        # Set before the sidebar widgets are created, so that they start from these values
+        st.session_state["structured_output"] = settings.get("structured_output", False)
+        if settings.get("scenario"):
+            st.session_state["scenario"] = settings["scenario"]
+        st.session_state["restored_system_prompt"] = settings.get("system_prompt")
+
+        placeholders = settings.get("prompt_placeholders") or {}
+        st.session_state.prompt_placeholders = dict(placeholders)
+        for name in placeholders:
+            # A leftover widget value would take precedence over the restored one
+            st.session_state.pop(f"input_{name}", None)
+
+    def resume(self, session_id: str, n_messages: int = RESUME_MESSAGES) -> None:
+        """Load a stored session's system prompt and latest messages; older ones load on demand."""
+        session = self.store.get_session(session_id)
+        if session is None:
+            return
+
+        if session.settings:
+            self.restore_settings(session.settings)
+
+        system = self.store.get_messages(session_id, roles=("system",))
+        recent = self.store.get_messages(session_id, limit=n_messages, roles=("user", "assistant"))
+        st.session_state.messages = [msg.to_message() for msg in system + recent]
+        self._first_loaded_seq = recent[0].seq if recent else None
+        self.n_unloaded = session.n_messages - len(system) - len(recent)
+
+        # Totals cover the whole session, including the messages not loaded yet
+        for role, n_tokens in self.store.get_role_tokens(session_id).items():
+            if role not in STATIC_ROLES:
+                self.ledger.totals[role] = n_tokens
+
+    def load_older(self, limit: int | None = None) -> None:
+        """Prepend up to `limit` older messages of a resumed session, or all of them."""
+        if not self.n_unloaded or limit == 0:
+            return
+
+        older = self.store.get_messages(
+            st.session_state["session_id"],
+            before=self._first_loaded_seq,
+            limit=limit,
+            roles=("user", "assistant"),
+        )
+        if not older:
+            self.n_unloaded = 0
+            return
+
+        n_system = sum(msg["role"] == "system" for msg in st.session_state.messages)
+        st.session_state.messages[n_system:n_system] = [msg.to_message() for msg in older]
+        self._first_loaded_seq = older[0].seq
+        self.n_unloaded = max(0, self.n_unloaded - len(older))
+
+    def record_usage(self, response: "LLMResponse") -> None:
+        if not response.from_cache:
+            self.ledger.record_usage(
+                response.input_tokens, response.cached_tokens, response.output_tokens
+            )
+
+    def calculate_effective_input_cost(self, model: GPT) -> float:
+        """Cost of the input tokens actually sent, with prompt-cache hits at their discount."""
+        cached_tokens = self.ledger.usage["cached"]
+        return self.calculate_cost(
+            self.ledger.usage["input"] - cached_tokens, model, type="input"
+        ) + self.calculate_cost(cached_tokens, model, type="cached_input")
+
+    @property
+    def system_tokens(self) -> int:
+        return self.ledger.get("system")
+
+    @property
+    def json_tokens(self) -> int:
+        return self.ledger.get("json")
+
+    @property
+    def user_tokens(self) -> int:
+        return self.ledger.get("user")
+
+    @property
+    def input_tokens(self) -> int:
+        return self.system_tokens + self.json_tokens + self.user_tokens
+
+    @property
+    def output_tokens(self) -> int:
+        return self.ledger.get("assistant")
+
     def get_system_prompt(self) -> str:
         return st.session_state.messages[0]["content"]
 
     def get_history(self) -> list[Message]:
         return st.session_state.messages
 
+    def get_context(
+        self, model: GPT, window: int | None, summarizer: "Summarizer | None" = None
+    ) -> tuple[list[Message], "ContextReport"]:
+        """The history to send with the next turn, fitted into the model's token budget."""
+        from modules.context import ContextManager
+
+        if self.context_manager is None or self.context_manager.model != model:
+            self.context_manager = ContextManager(model)
+        self.context_manager.window = window
+        self.context_manager.summarizer = summarizer
+        return self.context_manager.fit(self.get_history())
+
     def clear_prompt_placeholders(self) -> None:
         st.session_state.prompt_placeholders = []
 
-    def export_conversation(self) -> tuple[bytes, str, str]:
+    def export_conversation(self, file_format: str = "xlsx") -> tuple[bytes, str, str]:
+        self.load_older()
+
         if st.session_state.structured_output:
-            print("Exporting Excel file...")
+            print(f"Exporting {file_format} file...")
             print(f"{st.session_state.prompt_placeholders=}")
-            df = self.get_conversation_table()
-            data = self.to_excel(df)  # type: ignore
-            file_type = "xlsx"
-            mime_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            file_type = file_format
+            if file_format == "parquet":
+                data = self.to_parquet(self.get_conversation_table())
+            elif file_format == "csv":
+                data = self.get_conversation_table().to_csv(index=False).encode("utf-8")
+            else:
+                data = self.to_excel_stream(self.iter_conversation_rows())
+                file_type = "xlsx"
+            mime_type = EXPORT_MIME_TYPES[file_type]
         else:
             print("Exporting plain text file...")
             data = "\n\n".join(
@@ -44,99 +271,202 @@ class ConversationHandler:
 
         return data, file_type, mime_type
 
-    def get_conversation_table(self):
-        prompt_placeholders: dict[str, str] = st.session_state.get("prompt_placeholders", [])
-
-        if prompt_placeholders is None:
-            st.error("Provide prompt placeholders to export the conversation.")
-
+    def get_scenario(self) -> str:
         system_prompt = self.get_system_prompt()
-        print(f"Got {system_prompt=}")
 
         scenario = "S-T"
         if "reference:" in system_prompt:
             scenario = (
                 "S-R-T" if "source:" in system_prompt and "translation:" in system_prompt else "R-T"
             )
-        print(f"Got {scenario=}")
+        return scenario
+
+    def get_annotation(self, message: Message, lenient: bool = False) -> MQMAnnotation:
+        """The message's typed annotation, parsed once and then kept alongside it."""
+        if "annotation" not in message:
+            message["annotation"], message["salvaged"] = parse_annotation(
+                message["content"], lenient=True
+            )
+        if message["salvaged"] and not lenient:
+            # Raises the strict error, which a salvaged annotation would hide
+            parse_annotation(message["content"])
+        return message["annotation"]
 
-        for msg in st.session_state.messages:
+    def iter_annotations(self, lenient: bool = True) -> Iterator[MQMAnnotation]:
+        for idx, msg in enumerate(st.session_state.messages):
             if msg["role"] != "assistant":
                 continue
 
             try:
-                data = json.loads(msg["content"].strip())
-            except json.JSONDecodeError:
-                raise ValueError("There is something wrong with the history. Try again later.")
+                yield self.get_annotation(msg, lenient=lenient)
+            except MQMParseError as e:
+                raise MQMParseError(f"Assistant message {idx}: {e}") from e.__cause__
+
+    def get_segment_columns(self, scenario: str) -> dict[str, str | float]:
+        prompt_placeholders: dict[str, str] = st.session_state.get("prompt_placeholders") or {}
+
+        if not prompt_placeholders:
+            st.error("Provide prompt placeholders to export the conversation.")
+
+        def placeholder(name: str, present: bool) -> str | float:
+            return prompt_placeholders.get(name, math.nan) if present else math.nan
+
+        return {
+            "source_language": placeholder("src_lang", "S-" in scenario),
+            "target_language": placeholder("tgt_lang", "-T" in scenario),
+            "reference_language": placeholder("tgt_lang", "R-" in scenario),
+            "source_text": placeholder("source", "S-" in scenario),
+            "target_text": placeholder("translation", "-T" in scenario),
+            "reference_text": placeholder("reference", "R-" in scenario),
+        }
+
+    def align_errors(
+        self, errors: Iterable[MQMError], scenario: str, segment: dict[str, str | float]
+    ) -> list[tuple[MQMError, SpanStatus, SpanStatus]]:
+        """Errors with their spans checked, and corrected, against the segment's texts."""
+        # Without a source, the reference is what `in_source` points into
+        source_text = segment["source_text"] if "S-" in scenario else segment["reference_text"]
+        target_text = segment["target_text"]
+        # Missing texts are NaN, as in the table's cells
+        return [
+            align_error(
+                err,
+                source_text if isinstance(source_text, str) else None,
+                target_text if isinstance(target_text, str) else None,
+            )
+            for err in errors
+        ]
+
+    def get_conversation_table(self) -> "pd.DataFrame":
+        import numpy as np
+        import pandas as pd
 
+        scenario = self.get_scenario()
+        print(f"Got {scenario=}")
+
+        annotations = list(self.iter_annotations())
+        segment = self.get_segment_columns(scenario)
+        aligned = self.align_errors(
+            (err for annotation in annotations for err in annotation.errors), scenario, segment
+        )
+        errors = [err for err, _, _ in aligned]
+        n_errors = len(errors)
+
+        # One test per assistant turn, one random id per error, all generated in bulk
+        test_ids = [uuid4().hex for _ in annotations]
+        error_ids = os.urandom(16 * n_errors).hex()
+
+        columns = {
+            "test_id": np.repeat(test_ids, [len(annotation.errors) for annotation in annotations]),
+            "test_scenario": scenario,
+            "error_id": [error_ids[i : i + 32] for i in range(0, 32 * n_errors, 32)],
+            **segment,
+            "error_category": pd.Categorical(
+                [err.category.value for err in errors],
+                categories=[category.value for category in ErrorCategory],
+            ),
+            "severity": pd.Categorical(
+                [err.severity.value for err in errors],
+                categories=[severity.value for severity in Severity],
+            ),
+            "source_tokens": [err.in_source.token for err in errors],
+            "source_tokens_index": [err.in_source.token_index for err in errors],
+            "source_character_span": [err.in_source.character_span for err in errors],
+            "target_tokens": [err.in_target.token for err in errors],
+            "target_tokens_index": [err.in_target.token_index for err in errors],
+            "target_character_span": [err.in_target.character_span for err in errors],
+            "source_span_status": pd.Categorical(
+                [source_status.value for _, source_status, _ in aligned],
+                categories=[status.value for status in SpanStatus],
+            ),
+            "target_span_status": pd.Categorical(
+                [target_status.value for _, _, target_status in aligned],
+                categories=[status.value for status in SpanStatus],
+            ),
+        }
+        return pd.DataFrame(columns, index=pd.RangeIndex(n_errors))
+
+    def iter_conversation_rows(self) -> Iterator[tuple[Any, ...]]:
+        """Yield the rows of `get_conversation_table` one error at a time."""
+        scenario = self.get_scenario()
+        segment = self.get_segment_columns(scenario)
+        segment_values = tuple(segment.values())
+
+        for annotation in self.iter_annotations():
             test_id = uuid4().hex
-            rows = []
-            print('About to iterate over data["errors"]')
-            for err in data["errors"]:
-                row = {
-                    "test_id": test_id,
-                    "test_scenario": scenario,
-                    "error_id": uuid4().hex,
-                    "source_language": (
-                        prompt_placeholders["src_lang"] if "S-" in scenario else np.nan
-                    ),
-                    "target_language": (
-                        prompt_placeholders["tgt_lang"] if "-T" in scenario else np.nan
-                    ),
-                    "reference_language": (
-                        prompt_placeholders["tgt_lang"] if "R-" in scenario else np.nan
-                    ),
-                    "source_text": (prompt_placeholders["source"] if "S-" in scenario else np.nan),
-                    "target_text": (
-                        prompt_placeholders["translation"] if "-T" in scenario else np.nan
-                    ),
-                    "reference_text": (
-                        prompt_placeholders["reference"] if "R-" in scenario else np.nan
-                    ),
-                    "error_category": err["category"],
-                    "severity": err["severity"],
-                    "source_tokens": err["in_source"]["token"],
-                    "source_tokens_index": err["in_source"]["token_index"],
-                    "source_character_span": err["in_source"]["character_span"],
-                    "target_tokens": err["in_target"]["token"],
-                    "target_tokens_index": err["in_target"]["token_index"],
-                    "target_character_span": err["in_target"]["character_span"],
-                }
-                rows.append(row)
-                print(f"{rows=}")
-            return pd.DataFrame(rows).reset_index(drop=True)
-
-    def to_excel(self, df: pd.DataFrame) -> bytes:
+            for err, source_status, target_status in self.align_errors(
+                annotation.errors, scenario, segment
+            ):
+                yield (
+                    test_id,
+                    scenario,
+                    uuid4().hex,
+                    *segment_values,
+                    err.category.value,
+                    err.severity.value,
+                    err.in_source.token,
+                    err.in_source.token_index,
+                    err.in_source.character_span,
+                    err.in_target.token,
+                    err.in_target.token_index,
+                    err.in_target.character_span,
+                    source_status.value,
+                    target_status.value,
+                )
+
+    def to_parquet(self, df: "pd.DataFrame") -> bytes:
         output = BytesIO()
-        writer = pd.ExcelWriter(output, engine="xlsxwriter")
-        df.to_excel(writer, index=False)
+        df.to_parquet(output, index=False)
+        return output.getvalue()
 
-        worksheet = writer.sheets["Sheet1"]
-        worksheet.freeze_panes(1, 0)
+    def to_excel(self, df: "pd.DataFrame") -> bytes:
+        return self.to_excel_stream(df.itertuples(index=False, name=None), list(df.columns))
 
-        # 2. Text wrap and width for "_text" columns
-        text_wrap_format = writer.book.add_format({"text_wrap": True})
-        for idx, col in enumerate(df.columns):
-            if "_text" in col:
-                worksheet.set_column(idx, idx, 69, text_wrap_format)
-            else:
-                # 4. Autofit for other columns
-                max_len = max([len(str(x)) for x in df[col].astype(str)] + [len(col)])
-                worksheet.set_column(idx, idx, max_len + 2)
-
-        # 3. Bold important columns
-        for col_name in {"test_scenario", "error_category", "severity"}:
-            if col_name in df.columns:
-                col_idx = df.columns.get_loc(col_name)
-                bold_format = writer.book.add_format({"bold": True})
-                worksheet.set_column(col_idx, col_idx, None, bold_format)
-
-        writer.close()
-        return output.getvalue()
+    def to_excel_stream(
+        self, rows: Iterable[Sequence[Any]], columns: Sequence[str] = TABLE_COLUMNS
+    ) -> bytes:
+        import xlsxwriter
+
+        # Rows are flushed to disk as they are written and the workbook is spooled to a temp
+        # file, so only the finished file is ever held in memory
+        with tempfile.TemporaryFile() as output:
+            workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+            worksheet = workbook.add_worksheet("Sheet1")
+            header_format = workbook.add_format({"bold": True, "border": 1})
+            text_wrap_format = workbook.add_format({"text_wrap": True})
+            bold_format = workbook.add_format({"bold": True})
+
+            worksheet.write_row(0, 0, columns, header_format)
+            worksheet.freeze_panes(1, 0)
+
+            # Running max of each column's width, except for the wrapped "_text" columns
+            widths = [len(col) for col in columns]
+            autofit = [idx for idx, col in enumerate(columns) if "_text" not in col]
+
+            for row_idx, row in enumerate(rows, start=1):
+                values = [to_cell(value) for value in row]
+                worksheet.write_row(row_idx, 0, values)
+                for idx in autofit:
+                    if values[idx] is not None:
+                        widths[idx] = max(widths[idx], len(str(values[idx])))
+
+            for idx, col in enumerate(columns):
+                if "_text" in col:
+                    worksheet.set_column(idx, idx, 69, text_wrap_format)
+                elif col in BOLD_COLUMNS:
+                    worksheet.set_column(idx, idx, widths[idx] + 2, bold_format)
+                else:
+                    worksheet.set_column(idx, idx, widths[idx] + 2)
+
+            workbook.close()
+            output.seek(0)
+            return output.read()
 
     def calculate_cost(self, n_tokens: int, model: GPT, type: str = "input") -> float:
         if type == "input":
             cost_per_million = model.value.input_tokens_cost
+        elif type == "cached_input":
+            cost_per_million = model.value.cached_input_tokens_cost
         else:
             cost_per_million = model.value.output_tokens_cost
         return n_tokens * (cost_per_million / 1_000_000)
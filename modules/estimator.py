@@ -0,0 +1,85 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from config import (
+    ESTIMATOR_CHUNK_SIZE,
+    ESTIMATOR_THREADS,
+    MQM_PROMPTS,
+    MQM_USER_PROMPT,
+    PROMPT_CACHE_MIN_TOKENS,
+)
+from modules.models import GPT, get_encoding
+from modules.mqm import get_mqm_response_schema
+from modules.templates import split_system_prompt
+
+
+def count_tokens_parallel(texts: list[str], tokenizer_model: str) -> int:
+    """Total token count of `texts`, encoded in chunks across a thread pool."""
+    enc = get_encoding(tokenizer_model)
+
+    # tiktoken releases the GIL while encoding, so the chunks do run in parallel
+    def count_chunk(start: int) -> int:
+        return sum(
+            len(tokens)
+            for tokens in enc.encode_ordinary_batch(
+                texts[start : start + ESTIMATOR_CHUNK_SIZE], num_threads=1
+            )
+        )
+
+    with ThreadPoolExecutor(max_workers=ESTIMATOR_THREADS) as executor:
+        return sum(executor.map(count_chunk, range(0, len(texts), ESTIMATOR_CHUNK_SIZE)))
+
+
+def estimate_run_cost(
+    df: pd.DataFrame, scenario: str, src_lang: str, tgt_lang: str, output_ratio: float
+) -> pd.DataFrame:
+    """Estimated tokens and USD cost of evaluating every segment of `df` with each model."""
+    instructions, variable_template = split_system_prompt(MQM_PROMPTS[scenario].strip())
+    static_text = (
+        instructions + json.dumps(get_mqm_response_schema(), ensure_ascii=False) + MQM_USER_PROMPT
+    )
+    texts = [
+        variable_template.format(**{"src_lang": src_lang, "tgt_lang": tgt_lang, **row})
+        for row in df.to_dict("records")
+    ]
+    n_segments = len(texts)
+
+    token_counts: dict[str, tuple[int, int]] = {}
+    rows = []
+    for model in GPT:
+        meta = model.value
+        if meta.tokenizer_model not in token_counts:
+            token_counts[meta.tokenizer_model] = (
+                len(get_encoding(meta.tokenizer_model).encode_ordinary(static_text)),
+                count_tokens_parallel(texts, meta.tokenizer_model),
+            )
+        static_tokens, variable_tokens = token_counts[meta.tokenizer_model]
+
+        input_tokens = static_tokens * n_segments + variable_tokens
+        output_tokens = round(input_tokens * output_ratio)
+        input_cost = input_tokens * meta.input_tokens_cost / 1_000_000
+        output_cost = output_tokens * meta.output_tokens_cost / 1_000_000
+        # Best case, where every request after the first reads the static prefix from the cache.
+        # Prompts below the provider's minimum are never cached, so only a prefix that reaches it
+        # on its own is sure to be
+        cache_discount = (
+            (static_tokens if static_tokens >= PROMPT_CACHE_MIN_TOKENS else 0)
+            * max(0, n_segments - 1)
+            * (meta.input_tokens_cost - meta.cached_input_tokens_cost)
+            / 1_000_000
+        )
+        rows.append(
+            {
+                "model": model.name,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "input_cost": input_cost,
+                "output_cost": output_cost,
+                "total_cost": input_cost + output_cost,
+                "total_cost_with_prompt_cache": input_cost + output_cost - cache_discount,
+            }
+        )
+
+    return pd.DataFrame(rows).set_index("model")
@@ -0,0 +1,288 @@
+from collections.abc import Iterator
+from typing import TYPE_CHECKING, Any
+
+from openai import AsyncOpenAI, OpenAI
+from openai.types.responses import Response
+from openai.types.responses.response_text_config_param import ResponseTextConfigParam
+from pydantic import BaseModel
+
+from config import EXPECTED_OUTPUT_TOKENS
+from modules.budget import BudgetExceededError, get_budget_controller, get_key_id
+from modules.client import awith_retries, with_retries
+from modules.models import GPT, count_tokens
+from modules.mqm import get_mqm_response_schema
+from modules.scheduler import get_rate_limiter
+from modules.telemetry import RequestTimer
+from modules.templates import get_prefix_hash, split_system_prompt
+
+if TYPE_CHECKING:
+    from modules.cache import ResponseCache
+
+
+def get_response_format(structured_output: bool) -> ResponseTextConfigParam:
+    if structured_output:
+        return {
+            "format": {
+                "type": "json_schema",
+                "name": "mqm_annotation",
+                "strict": True,
+                "schema": get_mqm_response_schema(),
+            }
+        }
+    return {"format": {"type": "text"}}
+
+
+class LLMRequest(BaseModel):
+    model: GPT
+    instructions: str
+    messages: list[dict[str, str]]
+    temperature: float = 0
+    structured_output: bool = False
+    prompt_cache_key: str | None = None
+    scenario: str | None = None  # MQM scenario, for telemetry only; not sent
+    session_id: str | None = None  # for the session's budget; not sent
+    # Whether the budget may swap in a cheaper model, which would mix models in a batch
+    allow_downgrade: bool = False
+
+    def to_kwargs(self) -> dict[str, Any]:
+        kwargs = {
+            "model": self.model.value.api_name,
+            "instructions": self.instructions,
+            "input": self.messages,
+            "temperature": self.temperature,
+            "text": get_response_format(self.structured_output),
+        }
+        if self.prompt_cache_key is not None:
+            kwargs["prompt_cache_key"] = self.prompt_cache_key
+        return kwargs
+
+    @classmethod
+    def from_system_prompt(
+        cls,
+        model: GPT,
+        system_prompt: str,
+        history: list[dict[str, str]],
+        temperature: float = 0,
+        structured_output: bool = False,
+        scenario: str | None = None,
+        session_id: str | None = None,
+        allow_downgrade: bool = False,
+    ) -> "LLMRequest":
+        """Put the static prefix first and the variable source/reference/translation last."""
+        instructions, variable_prompt = split_system_prompt(system_prompt)
+        messages = [{"role": "developer", "content": variable_prompt}] if variable_prompt else []
+        # Only role and content are sent, not e.g. an assistant message's parsed annotation
+        messages += [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in history
+            if msg["role"] != "system"
+        ]
+        return cls(
+            model=model,
+            instructions=instructions,
+            messages=messages,
+            temperature=temperature,
+            structured_output=structured_output,
+            # Routes requests that share the prefix to the same prompt cache
+            prompt_cache_key=get_prefix_hash(instructions),
+            scenario=scenario,
+            session_id=session_id,
+            allow_downgrade=allow_downgrade,
+        )
+
+    def estimate_tokens(self, expected_output_tokens: int = EXPECTED_OUTPUT_TOKENS) -> int:
+        """Pre-flight estimate of the tokens this request counts against the TPM limit."""
+        text = self.instructions + "".join(msg["content"] for msg in self.messages)
+        return count_tokens(text, self.model) + expected_output_tokens
+
+
+class LLMResponse(BaseModel):
+    output_text: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0  # input tokens served from the provider's prompt cache
+    from_cache: bool = False
+
+    def get_cost(self, model: GPT) -> float:
+        # A cached response costs nothing again
+        if self.from_cache:
+            return 0.0
+        return model.value.calculate_cost(self.input_tokens, self.cached_tokens, self.output_tokens)
+
+    @classmethod
+    def from_response(cls, response: Response) -> "LLMResponse":
+        usage = response.usage
+        return cls(
+            output_text=response.output_text,
+            input_tokens=usage.input_tokens if usage else 0,
+            output_tokens=usage.output_tokens if usage else 0,
+            cached_tokens=usage.input_tokens_details.cached_tokens if usage else 0,
+        )
+
+    @classmethod
+    def from_body(cls, body: dict[str, Any]) -> "LLMResponse":
+        """Build from a raw Responses API JSON body, e.g. a line of a Batch API result file."""
+        output_text = "".join(
+            content["text"]
+            for item in body.get("output", [])
+            if item.get("type") == "message"
+            for content in item.get("content", [])
+            if content.get("type") == "output_text"
+        )
+        usage = body.get("usage") or {}
+        return cls(
+            output_text=output_text,
+            input_tokens=usage.get("input_tokens", 0),
+            output_tokens=usage.get("output_tokens", 0),
+            cached_tokens=(usage.get("input_tokens_details") or {}).get("cached_tokens", 0),
+        )
+
+
+def create_response(
+    client: OpenAI, request: LLMRequest, cache: "ResponseCache | None" = None
+) -> LLMResponse:
+    timer = RequestTimer(request)
+    if cache is not None and (cached := cache.get(request)) is not None:
+        timer.record(cached)
+        return cached
+
+    estimated_tokens = request.estimate_tokens()
+    try:
+        reservation = get_budget_controller().admit(
+            request, estimated_tokens, get_key_id(client.api_key)
+        )
+    except BudgetExceededError as e:
+        timer.record(error=type(e).__name__)
+        raise
+    request = timer.request = reservation.request
+
+    rate_limiter = get_rate_limiter(request.model.name)
+    rate_limiter.acquire(estimated_tokens)
+
+    timer.sent()
+    try:
+        response = LLMResponse.from_response(
+            with_retries(lambda: client.responses.create(**request.to_kwargs()))
+        )
+    except Exception as e:
+        get_budget_controller().settle(reservation)
+        timer.record(error=type(e).__name__)
+        raise
+    timer.record(response)
+    get_budget_controller().settle(reservation, response.get_cost(request.model))
+    rate_limiter.settle(estimated_tokens, response.input_tokens + response.output_tokens)
+
+    if cache is not None:
+        cache.set(request, response)
+    return response
+
+
+async def acreate_response(
+    client: AsyncOpenAI, request: LLMRequest, cache: "ResponseCache | None" = None
+) -> LLMResponse:
+    timer = RequestTimer(request)
+    if cache is not None and (cached := cache.get(request)) is not None:
+        timer.record(cached)
+        return cached
+
+    estimated_tokens = request.estimate_tokens()
+    try:
+        reservation = await get_budget_controller().aadmit(
+            request, estimated_tokens, get_key_id(client.api_key)
+        )
+    except BudgetExceededError as e:
+        timer.record(error=type(e).__name__)
+        raise
+    request = timer.request = reservation.request
+
+    rate_limiter = get_rate_limiter(request.model.name)
+    await rate_limiter.aacquire(estimated_tokens)
+
+    timer.sent()
+    try:
+        response = LLMResponse.from_response(
+            await awith_retries(lambda: client.responses.create(**request.to_kwargs()))
+        )
+    except Exception as e:
+        get_budget_controller().settle(reservation)
+        timer.record(error=type(e).__name__)
+        raise
+    timer.record(response)
+    get_budget_controller().settle(reservation, response.get_cost(request.model))
+    rate_limiter.settle(estimated_tokens, response.input_tokens + response.output_tokens)
+
+    if cache is not None:
+        cache.set(request, response)
+    return response
+
+
+class ResponseStream:
+    """Iterates over the text deltas of a streamed response.
+
+    `response` is only set once the stream has been consumed.
+    """
+
+    def __init__(
+        self, client: OpenAI, request: LLMRequest, cache: "ResponseCache | None" = None
+    ) -> None:
+        self.client = client
+        self.request = request
+        self.cache = cache
+        self.response: LLMResponse | None = None
+
+    def __iter__(self) -> Iterator[str]:
+        timer = RequestTimer(self.request)
+        if self.cache is not None and (cached := self.cache.get(self.request)) is not None:
+            self.response = cached
+            timer.record(cached)
+            yield cached.output_text
+            return
+
+        estimated_tokens = self.request.estimate_tokens()
+        try:
+            reservation = get_budget_controller().admit(
+                self.request, estimated_tokens, get_key_id(self.client.api_key)
+            )
+        except BudgetExceededError as e:
+            timer.record(error=type(e).__name__)
+            raise
+        # The request that is actually sent, e.g. with a cheaper model
+        self.request = timer.request = reservation.request
+
+        rate_limiter = get_rate_limiter(self.request.model.name)
+        rate_limiter.acquire(estimated_tokens)
+
+        timer.sent()
+        try:
+            # Only opening the stream is retried; a failure halfway through surfaces as is
+            events = with_retries(
+                lambda: self.client.responses.create(**self.request.to_kwargs(), stream=True)
+            )
+            for event in events:
+                if event.type == "response.output_text.delta":
+                    timer.first_token()
+                    yield event.delta
+                elif event.type == "response.completed":
+                    self.response = LLMResponse.from_response(event.response)
+        except GeneratorExit:
+            # Abandoned halfway through, so the estimate stands
+            get_budget_controller().settle(reservation, reservation.cost)
+            timer.record(error="Abandoned", cost=reservation.cost)
+            raise
+        except Exception as e:
+            get_budget_controller().settle(reservation)
+            timer.record(error=type(e).__name__)
+            raise
+        # Without a completed response its cost is unknown, so the estimate stands
+        actual_cost = reservation.cost
+        if self.response is not None:
+            actual_cost = self.response.get_cost(self.request.model)
+        timer.record(self.response, cost=actual_cost)
+        get_budget_controller().settle(reservation, actual_cost)
+
+        if self.response is not None:
+            rate_limiter.settle(
+                estimated_tokens, self.response.input_tokens + self.response.output_tokens
+            )
+        if self.cache is not None and self.response is not None:
+            self.cache.set(self.request, self.response)
@@ -1,32 +1,51 @@
 import enum
+import functools
 from collections.abc import Sequence
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-import pandas as pd
-import tiktoken
 from pydantic import BaseModel
 
+if TYPE_CHECKING:
+    import pandas as pd
+    import tiktoken
+
 
 class ModelMeta(BaseModel):
     api_name: str
     tokenizer_model: str
     input_tokens_cost: float  # USD per 1m tokens
+    cached_input_tokens_cost: float  # USD per 1m tokens served from the prompt cache
     output_tokens_cost: float  # USD per 1m tokens
     latency: str  # e.g. "low", "medium", "high"
+    context_window: int  # tokens
+    requests_per_minute: int
+    tokens_per_minute: int
     input_types: tuple[str, ...]
     output_types: tuple[str, ...]
 
     class Config:
         model_config = {"frozen": True}
 
+    def calculate_cost(self, input_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+        """USD for one request, with prompt-cache hits at their discount."""
+        return (
+            (input_tokens - cached_tokens) * self.input_tokens_cost
+            + cached_tokens * self.cached_input_tokens_cost
+            + output_tokens * self.output_tokens_cost
+        ) / 1_000_000
+
 
 class GPT(enum.Enum):
     _4_1 = ModelMeta(
         api_name="gpt-4.1-2025-04-14",
         tokenizer_model="o200k_base",
         input_tokens_cost=2,
+        cached_input_tokens_cost=0.5,
         output_tokens_cost=0.5,
         latency="high",
+        context_window=1_047_576,
+        requests_per_minute=500,
+        tokens_per_minute=30_000,
         input_types=("text", "image"),
         output_types=("text",),
     )
@@ -34,8 +53,12 @@ class GPT(enum.Enum):
         api_name="gpt-4o-2024-08-06",
         tokenizer_model="o200k_base",
         input_tokens_cost=2.5,
+        cached_input_tokens_cost=1.25,
         output_tokens_cost=10,
         latency="medium",
+        context_window=128_000,
+        requests_per_minute=500,
+        tokens_per_minute=30_000,
         input_types=("text",),
         output_types=("text",),
     )
@@ -43,14 +66,20 @@ class GPT(enum.Enum):
         api_name="gpt-4o-2024-11-20",
         tokenizer_model="o200k_base",
         input_tokens_cost=2.5,
+        cached_input_tokens_cost=1.25,
         output_tokens_cost=10,
         latency="low",
+        context_window=128_000,
+        requests_per_minute=500,
+        tokens_per_minute=30_000,
         input_types=("text", "code"),
         output_types=("text", "code"),
     )
 
 
-def gpt_models_to_df() -> pd.DataFrame:
+def gpt_models_to_df() -> "pd.DataFrame":
+    import pandas as pd
+
     def sanitize_values(model_metadata: ModelMeta) -> dict[str, Any]:
         sanitized = {}
 
@@ -72,7 +101,15 @@ def gpt_models_to_df() -> pd.DataFrame:
     return df
 
 
+@functools.cache
+def get_encoding(tokenizer_model: str) -> "tiktoken.Encoding":
+    import tiktoken
+
+    # One encoder per tokenizer per process; building one means loading its BPE ranks
+    return tiktoken.get_encoding(tokenizer_model)
+
+
 def count_tokens(text: str, model: GPT) -> int:
-    enc = tiktoken.get_encoding(model.value.tokenizer_model)
+    enc = get_encoding(model.value.tokenizer_model)
     tokens = enc.encode(text=text)
     return len(tokens)
@@ -1,8 +1,10 @@
+import functools
 import json
+import re
 from enum import Enum
 from typing import Any, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, NonNegativeInt, ValidationError
 
 
 # ============================================================================
@@ -43,9 +45,8 @@ class MQMError(BaseModel):
     severity: Severity = Field()  # description="Error severity: neutral/minor/major/critical")
 
     class TokenInfo(BaseModel):
-        token_index: Optional[list[int]] = Field(
+        token_index: Optional[list[NonNegativeInt]] = Field(
             None,
-            ge=0,
             description="The position of a single or adjacent words in the text (word offset, 0-indexed)",
         )
         character_span: Optional[list[int]] = Field(
@@ -77,6 +78,100 @@ class MQMAnnotation(BaseModel):
     }
 
 
+# A whole JSON string, up to its closing quote if that has arrived yet, or a brace
+JSON_TOKENS = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*("?)|[{}]', re.DOTALL)
+
+
+class MQMStreamParser:
+    """
+    Incrementally parse a streamed `MQMAnnotation` JSON document.
+
+    Every object that opens directly inside the root object's `errors` array is parsed into an
+    `MQMError` as soon as its closing brace arrives, so errors can be shown before the full
+    response is complete. In lenient mode, objects that are not valid errors are skipped and
+    counted instead of raising.
+    """
+
+    def __init__(self, lenient: bool = False) -> None:
+        self.lenient = lenient
+        self.n_invalid = 0
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._start = -1
+
+    def feed(self, chunk: str) -> list[MQMError]:
+        completed = (self.validate(start, end) for start, end in self.scan(chunk))
+        return [err for err in completed if err is not None]
+
+    def scan(self, chunk: str) -> list[tuple[int, int]]:
+        """Append `chunk` and return the spans of the error objects it completes."""
+        self.text += chunk
+        spans: list[tuple[int, int]] = []
+
+        # Strings are matched whole, so braces inside them are never visited
+        for match in JSON_TOKENS.finditer(self.text, self._pos):
+            pos = match.start()
+            char = self.text[pos]
+            if char == '"':
+                if not match.group(1):
+                    # Not closed yet, so it is scanned again once the next chunk arrives
+                    self._pos = pos
+                    return spans
+            elif char == "{":
+                self._depth += 1
+                if self._depth == 2:
+                    self._start = pos
+            elif char == "}":
+                if self._depth == 2 and self._start >= 0:
+                    spans.append((self._start, pos + 1))
+                    self._start = -1
+                self._depth -= 1
+
+        self._pos = len(self.text)
+        return spans
+
+    def validate(self, start: int, end: int) -> MQMError | None:
+        try:
+            return MQMError.model_validate_json(self.text[start:end])
+        except ValidationError:
+            if not self.lenient:
+                raise
+            self.n_invalid += 1
+            return None
+
+
+class MQMParseError(ValueError):
+    pass
+
+
+def parse_annotation(text: str, lenient: bool = False) -> tuple[MQMAnnotation, bool]:
+    """
+    Parse a response into an `MQMAnnotation`, and whether it had to be salvaged.
+
+    In lenient mode a malformed or truncated response still yields every complete and valid
+    entry of its `errors` array, instead of raising `MQMParseError`.
+    """
+    try:
+        return MQMAnnotation.model_validate_json(text), False
+    except ValidationError as e:
+        if not lenient:
+            raise MQMParseError(
+                f"Not a valid MQM annotation ({e.error_count()} validation errors)"
+            ) from e
+
+    parser = MQMStreamParser(lenient=True)
+    spans = parser.scan(text)
+    try:
+        # The complete entries are validated together, and one by one only if some are invalid
+        errors = MQMAnnotation.model_validate_json(
+            '{"errors": [' + ",".join(text[start:end] for start, end in spans) + "]}"
+        ).errors
+    except ValidationError:
+        errors = [err for err in (parser.validate(*span) for span in spans) if err is not None]
+    return MQMAnnotation(errors=errors), True
+
+
 def get_openai_schema(model_class: type[BaseModel]) -> dict[str, Any]:
     """
     Convert a Pydantic model into a OpenAI-compliant JSON Schema suitable for `response_format` by:
@@ -125,6 +220,12 @@ def get_openai_schema(model_class: type[BaseModel]) -> dict[str, Any]:
     return schema
 
 
+@functools.cache
+def get_mqm_response_schema() -> dict[str, Any]:
+    # Generated on first use rather than at import time
+    return get_openai_schema(MQMAnnotation)
+
+
 if __name__ == "__main__":
     mqm = MQMAnnotation()
-    print(json.dumps(get_openai_schema(MQMAnnotation), ensure_ascii=False, indent=2))
+    print(json.dumps(get_mqm_response_schema(), ensure_ascii=False, indent=2))
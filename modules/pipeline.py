@@ -0,0 +1,271 @@
+import csv
+import itertools
+import json
+import os
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+from pydantic import BaseModel
+
+from modules.batch import BatchEvaluator, BatchResult, missing_columns
+
+# Columns that are empty in one chunk must still have the type they have in the others
+RECORD_DTYPES = {
+    "errors": "Int64",
+    "memory": "string",
+    "similarity": "float64",
+    "failure": "string",
+    "annotation": "string",
+}
+
+
+class Checkpoint(BaseModel):
+    """How far a run has got: every row before `rows` is written to the output."""
+
+    input_path: str
+    scenario: str
+    output_format: str
+    rows: int = 0
+    output_bytes: int = 0  # JSONL output size after the last complete chunk
+    parts: int = 0  # Parquet part files written
+    failures: int = 0
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+
+    @classmethod
+    def load(cls, path: Path) -> "Checkpoint | None":
+        return cls.model_validate_json(path.read_text()) if path.exists() else None
+
+    def save(self, path: Path) -> None:
+        # Written aside and renamed, so an interrupted save never leaves a broken checkpoint
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(self.model_dump_json(indent=2))
+        os.replace(tmp_path, path)
+
+
+def iter_rows(path: Path) -> Iterator[dict[str, str]]:
+    """Rows of a JSONL or CSV file, one at a time, with lower-case column names."""
+    rows: Iterator[dict[str, Any]]
+    with path.open(encoding="utf-8", newline="") as file:
+        if path.suffix.lower() == ".jsonl":
+            rows = (json.loads(line) for line in file if line.strip())
+        elif path.suffix.lower() == ".csv":
+            rows = csv.DictReader(file)
+        else:
+            raise ValueError(f"Unsupported input format: {path.suffix} (JSONL or CSV)")
+
+        for row in rows:
+            yield {
+                str(key).strip().lower(): "" if value is None else str(value)
+                for key, value in row.items()
+            }
+
+
+def iter_chunks(rows: Iterator[dict[str, str]], size: int) -> Iterator[list[dict[str, str]]]:
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+class EvaluationPipeline:
+    """
+    Evaluate a file of segments in chunks, and write each chunk's results before the next
+    one is read.
+
+    Only one chunk is held in memory, whatever the size of the input. After every chunk the
+    checkpoint is saved, so an interrupted run resumes from the first unwritten row.
+    """
+
+    def __init__(
+        self,
+        evaluator: BatchEvaluator,
+        input_path: Path,
+        output_path: Path,
+        chunk_size: int = 256,
+    ) -> None:
+        self.evaluator = evaluator
+        self.input_path = input_path
+        self.output_path = output_path
+        self.chunk_size = chunk_size
+        self.output_format = "parquet" if output_path.suffix.lower() == ".parquet" else "jsonl"
+        self.checkpoint_path = output_path.with_name(output_path.name + ".checkpoint.json")
+
+    def load_checkpoint(self, restart: bool = False) -> Checkpoint:
+        checkpoint = None if restart else Checkpoint.load(self.checkpoint_path)
+        new_checkpoint = Checkpoint(
+            input_path=str(self.input_path.resolve()),
+            scenario=self.evaluator.scenario,
+            output_format=self.output_format,
+        )
+        if checkpoint is None:
+            return new_checkpoint
+
+        if (checkpoint.input_path, checkpoint.scenario, checkpoint.output_format) != (
+            new_checkpoint.input_path,
+            new_checkpoint.scenario,
+            new_checkpoint.output_format,
+        ):
+            raise ValueError(
+                f"{self.checkpoint_path} belongs to another run "
+                f"({checkpoint.input_path}, {checkpoint.scenario}); restart to overwrite it"
+            )
+        return checkpoint
+
+    def get_records(
+        self, chunk: pd.DataFrame, results: list[BatchResult], first_row: int
+    ) -> pd.DataFrame:
+        summary = self.evaluator.results_to_summary(chunk, results)
+        summary["row"] += first_row
+        summary["annotation"] = [
+            result.annotation.model_dump_json() if result.annotation else None for result in results
+        ]
+        return summary.astype(RECORD_DTYPES)
+
+    def write(self, records: pd.DataFrame, checkpoint: Checkpoint) -> None:
+        if self.output_format == "parquet":
+            # Parquet files cannot be appended to, so every chunk is a part of a dataset
+            self.output_path.mkdir(parents=True, exist_ok=True)
+            records.to_parquet(
+                self.output_path / f"part-{checkpoint.parts:06d}.parquet", index=False
+            )
+            checkpoint.parts += 1
+            return
+
+        with self.output_path.open("ab") as file:
+            # Drops whatever a run interrupted after its last checkpoint had appended
+            file.truncate(checkpoint.output_bytes)
+            file.write(records.to_json(orient="records", lines=True, force_ascii=False).encode())
+            file.flush()
+            os.fsync(file.fileno())
+            checkpoint.output_bytes = file.tell()
+
+    def run(self, restart: bool = False, limit: int | None = None) -> Checkpoint:
+        checkpoint = self.load_checkpoint(restart)
+        if restart and self.output_format == "parquet":
+            for part in self.output_path.glob("part-*.parquet"):
+                part.unlink()
+        elif restart:
+            self.output_path.unlink(missing_ok=True)
+
+        rows = itertools.islice(iter_rows(self.input_path), checkpoint.rows, None)
+        if limit is not None:
+            rows = itertools.islice(rows, max(0, limit - checkpoint.rows))
+
+        for chunk_rows in iter_chunks(rows, self.chunk_size):
+            started_at = time.perf_counter()
+            chunk = pd.DataFrame(chunk_rows)
+            if missing := missing_columns(chunk, self.evaluator.scenario):
+                raise ValueError(f"Missing columns for {self.evaluator.scenario}: {missing}")
+            results = self.evaluator.run(chunk)
+            self.write(self.get_records(chunk, results, checkpoint.rows), checkpoint)
+
+            checkpoint.rows += len(chunk_rows)
+            checkpoint.failures += sum(result.error is not None for result in results)
+            checkpoint.input_tokens += sum(result.input_tokens for result in results)
+            checkpoint.cached_tokens += sum(result.cached_tokens for result in results)
+            checkpoint.output_tokens += sum(result.output_tokens for result in results)
+            checkpoint.save(self.checkpoint_path)
+
+            elapsed = time.perf_counter() - started_at
+            print(
+                f"{checkpoint.rows} rows ({len(chunk_rows) / elapsed:.1f}/s), "
+                f"{checkpoint.failures} failures, "
+                f"{checkpoint.input_tokens} input / {checkpoint.output_tokens} output tokens",
+                flush=True,
+            )
+
+        return checkpoint
+
+    def get_failed_rows(self, checkpoint: Checkpoint) -> dict[int, int]:
+        """Every failed row number, with the part file or the output line that holds it."""
+        failed: dict[int, int] = {}
+        if self.output_format == "parquet":
+            for part in range(checkpoint.parts):
+                path = self.output_path / f"part-{part:06d}.parquet"
+                records = pd.read_parquet(path, columns=["row", "failure"])
+                failed.update(
+                    dict.fromkeys(records.loc[records["failure"].notna(), "row"].tolist(), part)
+                )
+            return failed
+
+        with self.output_path.open(encoding="utf-8") as file:
+            for line_number, line in enumerate(itertools.islice(file, checkpoint.rows)):
+                record = json.loads(line)
+                if record["failure"]:
+                    failed[record["row"]] = line_number
+        return failed
+
+    def retry_rows(self, row_numbers: set[int], checkpoint: Checkpoint) -> pd.DataFrame:
+        """Evaluate again the rows at `row_numbers`, taken from one ordered scan of the input."""
+        inputs = (
+            (index, row)
+            for index, row in enumerate(iter_rows(self.input_path))
+            if index in row_numbers
+        )
+        retried = []
+        while chunk_rows := list(itertools.islice(inputs, self.chunk_size)):
+            chunk = pd.DataFrame([row for _, row in chunk_rows])
+            results = self.evaluator.run(chunk)
+            records = self.get_records(chunk, results, 0)
+            # Results come back in completion order, with the row's position in the chunk
+            records["row"] = [chunk_rows[position][0] for position in records["row"]]
+            retried.append(records)
+
+            checkpoint.failures += sum(result.error is not None for result in results)
+            checkpoint.input_tokens += sum(result.input_tokens for result in results)
+            checkpoint.cached_tokens += sum(result.cached_tokens for result in results)
+            checkpoint.output_tokens += sum(result.output_tokens for result in results)
+
+        checkpoint.failures -= len(row_numbers)
+        return pd.concat(retried, ignore_index=True)
+
+    def retry_failed(self, checkpoint: Checkpoint) -> Checkpoint:
+        """
+        Evaluate again the written rows that failed, e.g. during an outage, and replace their
+        records in the output. Each output file is rewritten aside and renamed.
+
+        Records are not in row order, and chunks may differ between runs, so all failed rows
+        are collected first, and only their new records are held in memory.
+        """
+        failed = self.get_failed_rows(checkpoint)
+        if not failed:
+            return checkpoint
+
+        retried = self.retry_rows(set(failed), checkpoint)
+        if self.output_format == "parquet":
+            for part in sorted(set(failed.values())):
+                part_path = self.output_path / f"part-{part:06d}.parquet"
+                records = pd.read_parquet(part_path)
+                replaced = records["row"].isin(retried["row"])
+                records = pd.concat(
+                    [records[~replaced], retried[retried["row"].isin(records["row"])]]
+                )
+                tmp_path = part_path.with_suffix(".tmp")
+                records.sort_values("row").astype(RECORD_DTYPES).to_parquet(tmp_path, index=False)
+                os.replace(tmp_path, part_path)
+        else:
+            # By the output line they replace
+            retried_lines = dict(
+                zip(
+                    [failed[row] for row in retried["row"]],
+                    retried.to_json(orient="records", lines=True, force_ascii=False).splitlines(
+                        keepends=True
+                    ),
+                    strict=True,
+                )
+            )
+            tmp_path = self.output_path.with_name(self.output_path.name + ".tmp")
+            with self.output_path.open(encoding="utf-8") as file, tmp_path.open("wb") as out:
+                for line_number, line in enumerate(itertools.islice(file, checkpoint.rows)):
+                    out.write(retried_lines.get(line_number, line).encode())
+                out.flush()
+                os.fsync(out.fileno())
+                checkpoint.output_bytes = out.tell()
+            os.replace(tmp_path, self.output_path)
+        checkpoint.save(self.checkpoint_path)
+
+        print(f"Retried failed rows: {checkpoint.failures} failures remain", flush=True)
+        return checkpoint
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import time
+
+import streamlit as st
+
+from config import RATE_LIMIT_HEADROOM
+from modules.models import GPT
+
+
+class TokenBucket:
+    """
+    A token bucket that hands out reservations instead of blocking.
+
+    Reserving more than is available puts the bucket into debt and returns how long the caller
+    has to wait for the debt to be refilled, so callers are served in reservation order.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float) -> None:
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second
+        )
+        self.updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.refill_per_second)
+
+    def refund(self, amount: float) -> None:
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    def __init__(self, model: GPT, headroom: float = RATE_LIMIT_HEADROOM) -> None:
+        rpm = model.value.requests_per_minute * headroom
+        tpm = model.value.tokens_per_minute * headroom
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+
+    def reserve(self, n_tokens: int) -> float:
+        return max(self.requests.reserve(1), self.tokens.reserve(n_tokens))
+
+    def acquire(self, n_tokens: int) -> None:
+        if delay := self.reserve(n_tokens):
+            time.sleep(delay)
+
+    async def aacquire(self, n_tokens: int) -> None:
+        if delay := self.reserve(n_tokens):
+            await asyncio.sleep(delay)
+
+    def settle(self, estimated_tokens: int, used_tokens: int) -> None:
+        """Give back what the pre-flight estimate over-reserved (or take what it missed)."""
+        self.tokens.refund(estimated_tokens - used_tokens)
+
+
+@st.cache_resource
+def get_rate_limiter(model_name: str) -> RateLimiter:
+    """One limiter per model per process, shared by every session and batch job."""
+    return RateLimiter(GPT[model_name])
@@ -0,0 +1,117 @@
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+
+from config import MQM_SEVERITY_WEIGHTS
+from modules.mqm import ErrorCategory, Severity
+
+DIMENSIONS = ("scenario", "model", "language_pair")
+SEVERITIES = [severity.value for severity in Severity]
+CATEGORIES = [category.value for category in ErrorCategory]
+
+
+def count_words(texts: pd.Series) -> pd.Series:
+    return texts.fillna("").astype(str).str.count(r"\w+")
+
+
+class MQMScorer:
+    """
+    Running MQM scores, grouped by scenario, model, language pair and error category.
+
+    Only totals are kept: words per group, and error counts per group, category and severity.
+    Adding annotations therefore costs as much as the new rows, and every aggregate is a sum
+    over these totals, so the severity weights can still change after the fact.
+    """
+
+    def __init__(self, weights: dict[str, float] = MQM_SEVERITY_WEIGHTS) -> None:
+        self.weights = pd.Series(weights, dtype=float).reindex(SEVERITIES, fill_value=0.0)
+        self.words = pd.DataFrame(
+            columns=["segments", "words"],
+            index=pd.MultiIndex.from_tuples([], names=DIMENSIONS),
+            dtype="int64",
+        )
+        self.counts = pd.DataFrame(
+            columns=SEVERITIES,
+            index=pd.MultiIndex.from_tuples([], names=[*DIMENSIONS, "category"]),
+            dtype="int64",
+        )
+
+    def add(self, segments: pd.DataFrame, errors: pd.DataFrame, key: str = "test_id") -> None:
+        """
+        Add evaluated segments and their errors.
+
+        `segments` has one row per segment, with `key`, "scenario", "model", "source_language",
+        "target_language" and either "words" or the "target_text" to count them in. `errors` has
+        one row per error, with `key`, "error_category" and "severity".
+        """
+        if "words" not in segments:
+            segments = segments.assign(words=count_words(segments["target_text"]))
+        segments = segments.assign(
+            language_pair=segments["source_language"].astype(str)
+            + "-"
+            + segments["target_language"].astype(str)
+        )
+        grouped = segments.groupby(list(DIMENSIONS), observed=True, sort=False)
+        words = grouped.agg(segments=(key, "size"), words=("words", "sum"))
+        self.words = words.add(self.words, fill_value=0).astype("int64")
+
+        # Everything below works on integer codes: each error's group comes from its segment,
+        # and a single bincount over (group, category, severity) does the counting
+        group_ids = grouped.ngroup().to_numpy()
+        positions = pd.Index(segments[key]).get_indexer(errors[key])
+        category_codes = pd.Categorical(errors["error_category"], categories=CATEGORIES).codes
+        severity_codes = pd.Categorical(errors["severity"], categories=SEVERITIES).codes
+        # Errors without a known segment, category or severity are dropped
+        known = (positions >= 0) & (category_codes >= 0) & (severity_codes >= 0)
+
+        n_groups = len(words)
+        cells = group_ids[positions[known]] * len(CATEGORIES) + category_codes[known]
+        codes = cells * len(SEVERITIES) + severity_codes[known]
+        counts = np.bincount(codes, minlength=n_groups * len(CATEGORIES) * len(SEVERITIES))
+        counts = pd.DataFrame(
+            counts.reshape(n_groups * len(CATEGORIES), len(SEVERITIES)),
+            index=pd.MultiIndex.from_tuples(
+                [(*group, category) for group in words.index for category in CATEGORIES],
+                names=[*DIMENSIONS, "category"],
+            ),
+            columns=SEVERITIES,
+        )
+        counts = counts[counts.to_numpy().any(axis=1)]
+        self.counts = counts.add(self.counts, fill_value=0).astype("int64")
+
+    def scores(self, by: Sequence[str] = ("model",)) -> pd.DataFrame:
+        """
+        Errors, penalty and score per group of `by`, any of `DIMENSIONS` and "category".
+
+        The penalty is the severity-weighted error count, and the score is
+        `100 * (1 - penalty / words)`. By category, each category's penalty is taken over all
+        the words of its group.
+        """
+        by = list(by)
+        word_dims = [dim for dim in by if dim in DIMENSIONS]
+
+        counts = self.counts.groupby(by or (lambda _: "all"), observed=True).sum()
+        table = pd.DataFrame(
+            {
+                "errors": counts.sum(axis=1),
+                **{severity: counts[severity] for severity in SEVERITIES},
+                "penalty": counts @ self.weights,
+            }
+        )
+        if word_dims:
+            words = self.words.groupby(word_dims).sum()
+            # Groups without any error still have words, and a perfect score
+            table = table.reset_index().merge(words.reset_index(), on=word_dims, how="outer")
+            table = table.fillna({col: 0 for col in ["errors", *SEVERITIES, "penalty"]})
+            table = table.set_index(by)
+        else:
+            table = table.assign(
+                segments=self.words["segments"].sum(), words=self.words["words"].sum()
+            )
+        if "category" in by:
+            table = table[table.index.get_level_values("category").notna()]
+
+        table["penalty_per_word"] = table["penalty"] / table["words"].where(table["words"] > 0)
+        table["score"] = 100 * (1 - table["penalty_per_word"])
+        return table
@@ -0,0 +1,161 @@
+import bisect
+
+import regex
+from pydantic import BaseModel
+
+from config import SEGMENT_MAX_CHARS
+from modules.alignment import get_text_index
+from modules.mqm import MQMAnnotation, MQMError
+
+# Paragraphs first, then sentences, for paragraphs that are still too long
+PARAGRAPH_BREAK = regex.compile(r"\n\s*")
+# Greek uses ";" as its question mark
+SENTENCE_BREAK = regex.compile(r"(?<=[.!?;;·])\s+(?=[\p{Lu}\d«\"(])")
+LEVELS = (PARAGRAPH_BREAK, SENTENCE_BREAK)
+
+type Spans = dict[str, tuple[int, int]]
+
+
+class Chunk(BaseModel):
+    texts: dict[str, str]
+    # Where each text starts in its document, in characters and in words
+    char_offsets: dict[str, int]
+    word_offsets: dict[str, int]
+
+
+def get_unit_starts(text: str, start: int, end: int, level: int) -> list[int]:
+    return [start] + [
+        match.end() for match in LEVELS[level].finditer(text, start, end) if match.end() < end
+    ]
+
+
+def get_aligned_cuts(bounds: dict[str, list[int]], max_chars: int) -> list[int]:
+    """Unit indexes to cut at, so that no text of a chunk is longer than `max_chars`."""
+    n_units = len(next(iter(bounds.values()))) - 1
+    cuts, first = [0], 0
+    for idx in range(1, n_units):
+        if any(units[idx + 1] - units[first] > max_chars for units in bounds.values()):
+            cuts.append(idx)
+            first = idx
+    return cuts + [n_units]
+
+
+def get_proportional_cuts(
+    documents: dict[str, str], spans: Spans, starts: dict[str, list[int]], max_chars: int
+) -> dict[str, list[int]]:
+    """
+    Cut positions when the texts do not have the same number of sentences.
+
+    The first text is cut greedily at sentence boundaries, and every other text at its sentence
+    boundary closest to the same fraction of its length.
+    """
+    primary, *others = documents
+    start, end = spans[primary]
+    primary_cuts = [start]
+    for pos, next_pos in zip(starts[primary], starts[primary][1:] + [end]):
+        if next_pos - primary_cuts[-1] > max_chars and pos > primary_cuts[-1]:
+            primary_cuts.append(pos)
+
+    cuts = {name: [spans[name][0]] for name in documents}
+    for pos in primary_cuts[1:]:
+        fraction = (pos - start) / (end - start)
+        candidate = {primary: pos}
+        for name in others:
+            other_start, other_end = spans[name]
+            target = other_start + fraction * (other_end - other_start)
+            idx = bisect.bisect_left(starts[name], target)
+            candidate[name] = min(
+                starts[name][max(0, idx - 1) : idx + 1], key=lambda c: abs(c - target)
+            )
+        # Only cut where every text moves forward, or the chunks would not line up
+        if all(candidate[name] > cuts[name][-1] for name in documents):
+            for name in documents:
+                cuts[name].append(candidate[name])
+
+    for name in documents:
+        cuts[name].append(spans[name][1])
+    return cuts
+
+
+def split_spans(documents: dict[str, str], spans: Spans, max_chars: int, level: int) -> list[Spans]:
+    if level == len(LEVELS) or all(end - start <= max_chars for start, end in spans.values()):
+        return [spans]
+
+    starts = {name: get_unit_starts(documents[name], *spans[name], level) for name in documents}
+    if len({len(units) for units in starts.values()}) == 1:
+        bounds = {name: units + [spans[name][1]] for name, units in starts.items()}
+        unit_cuts = get_aligned_cuts(bounds, max_chars)
+        cuts = {name: [bounds[name][idx] for idx in unit_cuts] for name in documents}
+    elif level + 1 < len(LEVELS):
+        return split_spans(documents, spans, max_chars, level + 1)
+    else:
+        cuts = get_proportional_cuts(documents, spans, starts, max_chars)
+
+    chunks = []
+    for idx in range(len(cuts[next(iter(documents))]) - 1):
+        chunk_spans = {name: (cuts[name][idx], cuts[name][idx + 1]) for name in documents}
+        # A single unit that is still too long is split at the next level
+        chunks.extend(split_spans(documents, chunk_spans, max_chars, level + 1))
+    return chunks
+
+
+def segment_documents(documents: dict[str, str], max_chars: int = SEGMENT_MAX_CHARS) -> list[Chunk]:
+    """
+    Split aligned documents, e.g. a source and its translation, into aligned chunks.
+
+    Texts are cut at paragraphs where they all have the same number of paragraphs, otherwise at
+    sentences, and proportionally to their length when even those do not match.
+    """
+    spans = {name: (0, len(text)) for name, text in documents.items()}
+    chunks = []
+    for chunk_spans in split_spans(documents, spans, max_chars, level=0):
+        texts, char_offsets, word_offsets = {}, {}, {}
+        for name, (start, end) in chunk_spans.items():
+            text = documents[name][start:end]
+            start += len(text) - len(text.lstrip())
+            texts[name] = text.strip()
+            char_offsets[name] = start
+            word_offsets[name] = bisect.bisect_left(get_text_index(documents[name]).starts, start)
+        chunks.append(Chunk(texts=texts, char_offsets=char_offsets, word_offsets=word_offsets))
+    return chunks
+
+
+def shift_token_info(info: MQMError.TokenInfo, chunk: Chunk, name: str) -> MQMError.TokenInfo:
+    if name not in chunk.texts:
+        return info
+
+    char_offset, word_offset = chunk.char_offsets[name], chunk.word_offsets[name]
+    return info.model_copy(
+        update={
+            "character_span": (
+                [pos + char_offset for pos in info.character_span]
+                if info.character_span
+                else info.character_span
+            ),
+            "token_index": (
+                [idx + word_offset for idx in info.token_index]
+                if info.token_index
+                else info.token_index
+            ),
+        }
+    )
+
+
+def merge_annotations(
+    chunks: list[Chunk], annotations: list[MQMAnnotation | None], source_name: str = "source"
+) -> MQMAnnotation:
+    """One document-level annotation, with every span mapped back to document coordinates."""
+    errors = []
+    for chunk, annotation in zip(chunks, annotations):
+        if annotation is None:
+            continue
+        for err in annotation.errors:
+            errors.append(
+                err.model_copy(
+                    update={
+                        "in_source": shift_token_info(err.in_source, chunk, source_name),
+                        "in_target": shift_token_info(err.in_target, chunk, "translation"),
+                    }
+                )
+            )
+    return MQMAnnotation(errors=errors)
@@ -5,8 +5,18 @@ import streamlit as st
 
 class SessionHandler:
     def __init__(self):
-        st.session_state["session_id"] = str(uuid4())
+        # An id in the URL is a stored conversation to resume, e.g. after a refresh
+        st.session_state["session_id"] = st.query_params.get("session") or str(uuid4())
+        # There are no user accounts, so the history of a browser is scoped to an id of its own
+        st.session_state["client_id"] = st.query_params.get("client") or str(uuid4())
+
+    def switch_session(self, session_id: str) -> None:
+        st.session_state["session_id"] = session_id
+        # Recreated by the main page, which then resumes the session from the store
+        st.session_state.pop("conversation_handler", None)
+        st.session_state.pop("chat_history_size", None)
 
     def clear_state(self):
         st.session_state.clear()
+        st.query_params.clear()
         st.rerun()
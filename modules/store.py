@@ -0,0 +1,203 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+import streamlit as st
+from pydantic import BaseModel
+
+from config import CONVERSATION_STORE_PATH
+
+type Message = dict[str, str]
+
+# Explicit, since columns added to an existing store come after the original ones
+SESSION_COLUMNS = "session_id, title, n_messages, tokens, created_at, updated_at, owner, settings"
+
+
+class StoredMessage(BaseModel):
+    seq: int
+    role: str
+    content: str
+    tokens: int
+    created_at: float
+
+    def to_message(self) -> Message:
+        return {"role": self.role, "content": self.content}
+
+
+class SessionSummary(BaseModel):
+    session_id: str
+    title: str | None
+    n_messages: int
+    tokens: int
+    created_at: float
+    updated_at: float
+    owner: str | None = None  # the browser that started the session
+    settings: dict[str, Any] | None = None  # prompt settings to restore on resume
+
+
+class ConversationStore:
+    """Append-only SQLite store of every conversation message, by session."""
+
+    def __init__(self, path: str = CONVERSATION_STORE_PATH) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode this only risks the last few commits on power loss, not corruption,
+        # and keeps an append to a single write without an fsync
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                title TEXT,
+                n_messages INTEGER NOT NULL DEFAULT 0,
+                tokens INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+
+            CREATE TABLE IF NOT EXISTS messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            );
+            CREATE INDEX IF NOT EXISTS messages_created_at ON messages (session_id, created_at);
+            """
+        )
+        # Stores created before sessions kept their owner and prompt settings
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        for column in ("owner", "settings"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE sessions ADD COLUMN {column} TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_owner ON sessions (owner, updated_at)"
+        )
+
+    def append(
+        self, session_id: str, message: Message, tokens: int = 0, owner: str | None = None
+    ) -> int:
+        """Append a message to a session, creating the session if needed, and return its seq."""
+        content = message["content"]
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        title = content[:80] if message["role"] == "user" else None
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                (seq,) = self._conn.execute(
+                    """
+                    INSERT INTO sessions (session_id, title, n_messages, tokens, created_at,
+                        updated_at, owner)
+                    VALUES (?, ?, 1, ?, ?, ?, ?)
+                    ON CONFLICT (session_id) DO UPDATE SET
+                        title = COALESCE(title, excluded.title),
+                        n_messages = n_messages + 1,
+                        tokens = tokens + excluded.tokens,
+                        updated_at = excluded.updated_at
+                    RETURNING n_messages - 1
+                    """,
+                    (session_id, title, tokens, now, now, owner),
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+                    (session_id, seq, message["role"], content, tokens, now),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return seq
+
+    def set_settings(self, session_id: str, settings: dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE sessions SET settings = ? WHERE session_id = ?",
+                (json.dumps(settings, ensure_ascii=False), session_id),
+            )
+
+    def get_session(self, session_id: str) -> SessionSummary | None:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {SESSION_COLUMNS} FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return None if row is None else self._to_session(row)
+
+    def list_sessions(self, owner: str, limit: int = 50, offset: int = 0) -> list[SessionSummary]:
+        """Sessions started by `owner`, most recently updated first."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT {SESSION_COLUMNS} FROM sessions WHERE owner = ?
+                ORDER BY updated_at DESC LIMIT ? OFFSET ?
+                """,
+                (owner, limit, offset),
+            ).fetchall()
+        return [self._to_session(row) for row in rows]
+
+    def get_messages(
+        self,
+        session_id: str,
+        before: int | None = None,
+        limit: int | None = None,
+        roles: tuple[str, ...] | None = None,
+    ) -> list[StoredMessage]:
+        """
+        The latest `limit` messages of a session with a seq below `before`, oldest first.
+
+        Pages through a long history without reading all of it, e.g. on resume.
+        """
+        query = "SELECT seq, role, content, tokens, created_at FROM messages WHERE session_id = ?"
+        params: list[str | int] = [session_id]
+        if before is not None:
+            query += " AND seq < ?"
+            params.append(before)
+        if roles is not None:
+            query += f" AND role IN ({', '.join('?' * len(roles))})"
+            params.extend(roles)
+        query += " ORDER BY seq DESC LIMIT ?"
+        params.append(-1 if limit is None else limit)
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            StoredMessage(seq=seq, role=role, content=content, tokens=tokens, created_at=created_at)
+            for seq, role, content, tokens, created_at in reversed(rows)
+        ]
+
+    def get_role_tokens(self, session_id: str) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, SUM(tokens) FROM messages WHERE session_id = ? GROUP BY role",
+                (session_id,),
+            ).fetchall()
+        return dict(rows)
+
+    @staticmethod
+    def _to_session(row: tuple) -> SessionSummary:
+        session_id, title, n_messages, tokens, created_at, updated_at, owner, settings = row
+        return SessionSummary(
+            session_id=session_id,
+            title=title,
+            n_messages=n_messages,
+            tokens=tokens,
+            created_at=created_at,
+            updated_at=updated_at,
+            owner=owner,
+            settings=None if settings is None else json.loads(settings),
+        )
+
+
+@st.cache_resource
+def get_conversation_store() -> ConversationStore:
+    return ConversationStore()
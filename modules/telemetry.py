@@ -0,0 +1,248 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import streamlit as st
+from pydantic import BaseModel, Field
+
+from config import METRICS_STORE_PATH
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from modules.llm import LLMRequest, LLMResponse
+
+METRICS_PREFIX = "lawcode"
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RequestMetrics(BaseModel):
+    model: str
+    scenario: str | None = None
+    queue_ms: float = 0  # waiting for the rate limiter
+    ttft_ms: float | None = None  # time to first token, of streamed responses only
+    total_ms: float = 0  # from sending the request to its last token, retries included
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0  # USD
+    from_cache: bool = False
+    error: str | None = None
+    created_at: float = Field(default_factory=time.time)
+
+
+class MetricsStore:
+    """Append-only SQLite log of every LLM request's timing, token usage and cost."""
+
+    def __init__(self, path: str = METRICS_STORE_PATH) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS requests (
+                model TEXT NOT NULL,
+                scenario TEXT,
+                queue_ms REAL NOT NULL,
+                ttft_ms REAL,
+                total_ms REAL NOT NULL,
+                input_tokens INTEGER NOT NULL,
+                cached_tokens INTEGER NOT NULL,
+                output_tokens INTEGER NOT NULL,
+                cost REAL NOT NULL,
+                from_cache INTEGER NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS requests_created_at ON requests (created_at);
+            """
+        )
+
+    def record(self, metrics: RequestMetrics) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO requests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                tuple(metrics.model_dump().values()),
+            )
+
+    def get_requests(self, since: float | None = None) -> "pd.DataFrame":
+        import pandas as pd
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT * FROM requests WHERE created_at >= ? ORDER BY created_at",
+                (since or 0,),
+            )
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        # Without any streamed request, the time-to-first-token column would be all `None`
+        return pd.DataFrame(rows, columns=columns).astype({"ttft_ms": float, "from_cache": bool})
+
+
+@st.cache_resource
+def get_metrics_store() -> MetricsStore:
+    return MetricsStore()
+
+
+class RequestTimer:
+    """Times the stages of one request, and records them once it has finished or failed."""
+
+    def __init__(self, request: "LLMRequest") -> None:
+        self.request = request
+        self.started_at = time.perf_counter()
+        self.sent_at: float | None = None
+        self.first_token_at: float | None = None
+
+    def sent(self) -> None:
+        self.sent_at = time.perf_counter()
+
+    def first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def record(
+        self,
+        response: "LLMResponse | None" = None,
+        error: str | None = None,
+        cost: float = 0.0,
+    ) -> None:
+        """`cost` is what a request without a response was charged, e.g. an abandoned stream."""
+        finished_at = time.perf_counter()
+        sent_at = self.sent_at or finished_at
+        metrics = RequestMetrics(
+            model=self.request.model.name,
+            scenario=self.request.scenario,
+            queue_ms=(sent_at - self.started_at) * 1000,
+            ttft_ms=None if self.first_token_at is None else (self.first_token_at - sent_at) * 1000,
+            total_ms=(finished_at - sent_at) * 1000,
+            cost=cost,
+            error=error,
+        )
+        if response is not None:
+            metrics.input_tokens = response.input_tokens
+            metrics.cached_tokens = response.cached_tokens
+            metrics.output_tokens = response.output_tokens
+            metrics.from_cache = response.from_cache
+            metrics.cost = response.get_cost(self.request.model)
+
+        # Telemetry must never fail the request it measures
+        try:
+            get_metrics_store().record(metrics)
+        except sqlite3.Error as e:
+            print("METRICS NOT RECORDED:", e)
+
+
+def get_latency_stats(
+    requests: "pd.DataFrame", by: tuple[str, ...] = ("model", "scenario")
+) -> "pd.DataFrame":
+    """
+    Measured latency percentiles and throughput per group of `by`.
+
+    Percentiles and throughput are over the requests that reached the API, so neither cache
+    hits nor failures skew them.
+    """
+    import pandas as pd
+
+    columns = list(by)
+    requests = requests.assign(scenario=requests["scenario"].fillna("—"))
+    groups = requests.groupby(columns)
+    served = requests[~requests["from_cache"] & requests["error"].isna()]
+    served_groups = served.groupby(columns)
+
+    def percentiles(column: str, quantiles: tuple[float, ...]) -> pd.DataFrame:
+        table = served_groups[column].quantile(list(quantiles)).unstack()
+        prefix = column.removesuffix("_ms")
+        return table.set_axis([f"{prefix}_p{round(q * 100)}_ms" for q in quantiles], axis=1)
+
+    return pd.concat(
+        [
+            groups.size().rename("requests"),
+            groups["from_cache"].sum().rename("cache_hits"),
+            groups["error"].count().rename("errors"),
+            percentiles("total_ms", QUANTILES),
+            percentiles("ttft_ms", QUANTILES[:2]),
+            percentiles("queue_ms", QUANTILES[1:2]),
+            # Generation throughput of the requests themselves, not of the app as a whole
+            (
+                served_groups["output_tokens"].sum() / (served_groups["total_ms"].sum() / 1000)
+            ).rename("output_tokens_per_s"),
+            groups["cost"].sum().rename("cost_usd"),
+        ],
+        axis=1,
+    ).fillna({"cache_hits": 0, "errors": 0})
+
+
+def to_prometheus(requests: "pd.DataFrame") -> str:
+    """The requests as Prometheus text exposition: latency summaries and running totals."""
+    requests = requests.assign(
+        scenario=requests["scenario"].fillna(""),
+        outcome=requests["error"]
+        .notna()
+        .map({True: "error", False: "ok"})
+        .where(~requests["from_cache"], "cache"),
+    )
+    served = requests[requests["outcome"] == "ok"]
+    lines = []
+
+    def labels(**values: str) -> str:
+        return "{" + ",".join(f'{key}="{value}"' for key, value in values.items()) + "}"
+
+    def summary(name: str, column: str, help_text: str) -> None:
+        lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} summary")
+        for (model, scenario), seconds in served.groupby(["model", "scenario"])[column]:
+            seconds = seconds.dropna() / 1000
+            for quantile in QUANTILES:
+                lines.append(
+                    f"{METRICS_PREFIX}_{name}"
+                    f"{labels(model=model, scenario=scenario, quantile=str(quantile))} "
+                    f"{seconds.quantile(quantile) if len(seconds) else float('nan')}"
+                )
+            lines.append(
+                f"{METRICS_PREFIX}_{name}_sum{labels(model=model, scenario=scenario)} "
+                f"{seconds.sum()}"
+            )
+            lines.append(
+                f"{METRICS_PREFIX}_{name}_count{labels(model=model, scenario=scenario)} "
+                f"{len(seconds)}"
+            )
+
+    def counter(name: str, totals: "pd.Series", help_text: str) -> None:
+        lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} counter")
+        for keys, value in totals.items():
+            lines.append(
+                f"{METRICS_PREFIX}_{name}{labels(**dict(zip(totals.index.names, keys)))} {value}"
+            )
+
+    summary("request_duration_seconds", "total_ms", "Time from a request to its last token.")
+    summary("time_to_first_token_seconds", "ttft_ms", "Time to the first token of a stream.")
+    summary("queue_seconds", "queue_ms", "Time spent waiting for the rate limiter.")
+
+    counter(
+        "requests_total",
+        requests.groupby(["model", "scenario", "outcome"]).size(),
+        "LLM requests by outcome.",
+    )
+    tokens = (
+        served.melt(
+            id_vars=["model", "scenario"],
+            value_vars=["input_tokens", "cached_tokens", "output_tokens"],
+            var_name="type",
+        )
+        .assign(type=lambda df: df["type"].str.removesuffix("_tokens"))
+        .groupby(["model", "scenario", "type"])["value"]
+        .sum()
+    )
+    counter("tokens_total", tokens, "Tokens billed, by type.")
+    counter(
+        "cost_usd_total",
+        # Abandoned streams are charged their estimate, so failures count too
+        requests.groupby(["model", "scenario"])["cost"].sum(),
+        "Cost of the requests in USD.",
+    )
+    return "\n".join(lines) + "\n"
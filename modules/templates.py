@@ -0,0 +1,120 @@
+import hashlib
+import json
+import threading
+from collections import Counter, OrderedDict
+from functools import cache, cached_property
+
+import regex
+import streamlit as st
+from pydantic import BaseModel
+
+from config import MQM_BASE_PROMPT, MQM_PROMPTS
+from modules.models import get_encoding
+from modules.mqm import get_mqm_response_schema
+from modules.tokens import count_message_tokens
+
+PLACEHOLDER_PATTERN = regex.compile(r"\{([a-zA-Z_][a-zA-Z0-9_]*)\}")
+MAX_CUSTOM_TEMPLATES = 256
+
+
+def split_system_prompt(system_prompt: str) -> tuple[str, str]:
+    """
+    Split a system prompt into its static prefix and its variable remainder.
+
+    MQM prompts share `MQM_BASE_PROMPT` byte for byte, so sending only that as `instructions`
+    keeps the prefix identical across every scenario and segment. The provider only caches a
+    shared prefix of at least `PROMPT_CACHE_MIN_TOKENS`, though, which the base prompt and the
+    schema alone do not reach; hits then come from longer prefixes, e.g. a chat's history.
+    """
+    if system_prompt.startswith(MQM_BASE_PROMPT):
+        return MQM_BASE_PROMPT, system_prompt[len(MQM_BASE_PROMPT) :]
+    return system_prompt, ""
+
+
+def get_prefix_hash(static_prefix: str) -> str:
+    return hashlib.sha256(static_prefix.encode("utf-8")).hexdigest()[:16]
+
+
+@cache
+def get_schema_tokens(tokenizer_model: str) -> int:
+    schema = json.dumps(get_mqm_response_schema(), ensure_ascii=False, indent=2)
+    return len(get_encoding(tokenizer_model).encode(schema))
+
+
+class CompiledPrompt(BaseModel):
+    template: str
+    tokenizer_model: str
+    placeholders: tuple[str, ...]  # unique, in order of appearance
+    placeholder_counts: dict[str, int]
+    static_prefix: str
+    prefix_hash: str
+    static_text: str  # the template without its placeholders
+
+    # Tokenized on first use, so that compiling a template never loads the tokenizer
+    @cached_property
+    def static_tokens(self) -> int:
+        return len(get_encoding(self.tokenizer_model).encode(self.static_text))
+
+    @cached_property
+    def schema_tokens(self) -> int:
+        """Tokens of the MQM response schema, as shown in the cost columns."""
+        return get_schema_tokens(self.tokenizer_model)
+
+    def render(self, values: dict[str, str]) -> str:
+        return self.template.format(**values)
+
+    def count_tokens(self, values: dict[str, str]) -> int:
+        """Approximate tokens of the rendered prompt, tokenizing only the placeholder values."""
+        return self.static_tokens + sum(
+            count_message_tokens(values.get(placeholder, ""), self.tokenizer_model) * n
+            for placeholder, n in self.placeholder_counts.items()
+        )
+
+
+class TemplateRegistry:
+    """
+    Compiled prompt templates, so that reruns never re-scan or re-tokenize a template.
+
+    Templates are compiled on first use, per template and tokenizer. The MQM prompts are kept
+    for good; custom prompts only while they are among the most recent ones.
+    """
+
+    def __init__(self) -> None:
+        self._compiled: OrderedDict[tuple[str, str], CompiledPrompt] = OrderedDict()
+        self._pinned = {template.strip() for template in MQM_PROMPTS.values()}
+        self._lock = threading.Lock()
+
+    def get(self, template: str, tokenizer_model: str) -> CompiledPrompt:
+        key = (template, tokenizer_model)
+        with self._lock:
+            if key in self._compiled:
+                self._compiled.move_to_end(key)
+                return self._compiled[key]
+
+            compiled = self.compile(template, tokenizer_model)
+            self._compiled[key] = compiled
+
+            # Custom prompts are compiled on the fly, so keep only the most recent ones
+            unpinned = [k for k in self._compiled if k[0] not in self._pinned]
+            for stale in unpinned[: max(0, len(unpinned) - MAX_CUSTOM_TEMPLATES)]:
+                del self._compiled[stale]
+            return compiled
+
+    @staticmethod
+    def compile(template: str, tokenizer_model: str) -> CompiledPrompt:
+        placeholder_counts = Counter(PLACEHOLDER_PATTERN.findall(template))
+        static_prefix, _ = split_system_prompt(template)
+        return CompiledPrompt(
+            template=template,
+            tokenizer_model=tokenizer_model,
+            placeholders=tuple(placeholder_counts),
+            placeholder_counts=dict(placeholder_counts),
+            static_prefix=static_prefix,
+            prefix_hash=get_prefix_hash(static_prefix),
+            static_text=PLACEHOLDER_PATTERN.sub("", template),
+        )
+
+
+@st.cache_resource
+def get_template_registry() -> TemplateRegistry:
+    return TemplateRegistry()
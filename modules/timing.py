@@ -0,0 +1,43 @@
+import functools
+import statistics
+import time
+from collections import deque
+from collections.abc import Callable
+
+import streamlit as st
+
+RENDER_TIMINGS_KEY = "render_timings"
+MAX_TIMINGS = 50  # per fragment
+
+
+def timed[**P, R](name: str) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """Record how long each render of the decorated view or fragment takes, in milliseconds."""
+
+    def decorator(func: Callable[P, R]) -> Callable[P, R]:
+        @functools.wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            started_at = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings = st.session_state.setdefault(RENDER_TIMINGS_KEY, {})
+                timings.setdefault(name, deque(maxlen=MAX_TIMINGS)).append(
+                    (time.perf_counter() - started_at) * 1000
+                )
+
+        return wrapper
+
+    return decorator
+
+
+def get_render_timings() -> list[dict[str, float | str | int]]:
+    return [
+        {
+            "fragment": name,
+            "renders": len(timings),
+            "last_ms": round(timings[-1], 1),
+            "median_ms": round(statistics.median(timings), 1),
+            "max_ms": round(max(timings), 1),
+        }
+        for name, timings in st.session_state.get(RENDER_TIMINGS_KEY, {}).items()
+    ]
@@ -0,0 +1,72 @@
+import functools
+from collections import defaultdict
+
+from modules.models import GPT, count_tokens, get_encoding
+
+# Roles whose text is replaced rather than appended, e.g. an edited system prompt
+STATIC_ROLES = ("system", "json")
+
+
+@functools.lru_cache(maxsize=4096)
+def count_message_tokens(text: str, tokenizer_model: str) -> int:
+    """Token count of a message's text, memoized for histories that are re-checked every turn."""
+    return len(get_encoding(tokenizer_model).encode(text))
+
+
+class TokenLedger:
+    """Running token totals per role, tokenizing every text only once."""
+
+    def __init__(self) -> None:
+        self.message_tokens: list[tuple[str, int]] = []
+        self.totals: dict[str, int] = defaultdict(int)
+        self.static: dict[str, tuple[str, str, int]] = {}
+        # Usage as reported by the API, which is what is actually billed
+        self.usage: dict[str, int] = defaultdict(int)
+
+    def record(self, role: str, text: str, model: GPT) -> int:
+        if role in STATIC_ROLES:
+            return self.set_static(role, text, model)
+
+        n_tokens = count_tokens(text, model)
+        self.message_tokens.append((role, n_tokens))
+        self.totals[role] += n_tokens
+        return n_tokens
+
+    def remove_last(self) -> None:
+        """Forget the last recorded message, e.g. of a turn that was never sent."""
+        role, n_tokens = self.message_tokens.pop()
+        self.totals[role] -= n_tokens
+
+    def set_static(self, role: str, text: str, model: GPT) -> int:
+        tokenizer_model = model.value.tokenizer_model
+        cached = self.static.get(role)
+        if cached is not None and cached[0] == tokenizer_model and cached[1] == text:
+            return cached[2]
+
+        n_tokens = count_tokens(text, model) if text else 0
+        self.static[role] = (tokenizer_model, text, n_tokens)
+        self.totals[role] = n_tokens
+        return n_tokens
+
+    def set_count(self, role: str, n_tokens: int) -> None:
+        """Set a static role's count that was computed elsewhere, e.g. from a compiled prompt."""
+        self.static.pop(role, None)
+        self.totals[role] = n_tokens
+
+    def record_usage(self, input_tokens: int, cached_tokens: int, output_tokens: int) -> None:
+        self.usage["input"] += input_tokens
+        self.usage["cached"] += cached_tokens
+        self.usage["output"] += output_tokens
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        return self.usage["cached"] / self.usage["input"] if self.usage["input"] else 0.0
+
+    def get(self, role: str) -> int:
+        return self.totals.get(role, 0)
+
+    def reset(self) -> None:
+        self.message_tokens.clear()
+        self.totals.clear()
+        self.static.clear()
+        self.usage.clear()
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+import regex
+import streamlit as st
+from pydantic import BaseModel
+
+from config import TRANSLATION_MEMORY_PATH, TRANSLATION_MEMORY_SIMILARITY
+from modules.mqm import MQMAnnotation
+
+# MinHash signatures of character shingles, split into LSH bands: two texts share a band, and
+# so become candidates, with a probability that rises steeply around a Jaccard similarity of
+# (1 / BANDS) ** (1 / ROWS), about 0.7
+SHINGLE_SIZE = 5
+BANDS = 16
+ROWS = 8
+MERSENNE_PRIME = (1 << 31) - 1
+
+_rng = np.random.default_rng(seed=20251)
+_a = _rng.integers(1, MERSENNE_PRIME, size=BANDS * ROWS, dtype=np.uint64)
+_b = _rng.integers(0, MERSENNE_PRIME, size=BANDS * ROWS, dtype=np.uint64)
+
+WHITESPACE = regex.compile(r"\s+")
+
+
+class MemoryScope(BaseModel):
+    """What an annotation depends on besides the texts; it is only reused within its scope."""
+
+    scenario: str
+    model: str
+    src_lang: str
+    tgt_lang: str
+    prompt_hash: str  # of the prompt template, which a custom prompt replaces
+
+    @property
+    def key(self) -> str:
+        # Without a source text the source language plays no part, however it was set
+        src_lang = self.src_lang if self.scenario.startswith("S-") else ""
+        return f"{self.scenario}|{self.model}|{src_lang}|{self.tgt_lang}|{self.prompt_hash}"
+
+
+class MemoryMatch(BaseModel):
+    entry_id: int
+    exact: bool
+    similarity: float  # estimated Jaccard similarity of the texts' shingles, 1 if exact
+    texts: dict[str, str]
+    annotation: MQMAnnotation
+    model: str | None = None
+
+
+def get_key(scope: MemoryScope, texts: dict[str, str]) -> str:
+    payload = json.dumps([scope.key, sorted(texts.items())], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_signature(texts: dict[str, str]) -> np.ndarray:
+    """MinHash signature of the character shingles of all the texts together."""
+    shingles: set[str] = set()
+    for name, text in sorted(texts.items()):
+        # Shingles are tagged with their column, so a source never matches a translation
+        text = f"{name}:" + WHITESPACE.sub(" ", text.casefold()).strip()
+        shingles.update(
+            text[idx : idx + SHINGLE_SIZE] for idx in range(max(1, len(text) - SHINGLE_SIZE + 1))
+        )
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    return ((_a[:, None] * hashes[None, :] + _b[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+
+def get_band_keys(scope: MemoryScope, signature: np.ndarray) -> list[int]:
+    keys = []
+    for band, rows in enumerate(signature.reshape(BANDS, ROWS)):
+        digest = hashlib.blake2b(
+            f"{scope.key}:{band}:".encode() + rows.tobytes(), digest_size=8
+        ).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+
+class TranslationMemory:
+    """
+    Previously evaluated segments and their annotations, by scope.
+
+    An annotation is only reused under the scenario, model, language pair and prompt that
+    produced it. An exact match, the same texts in the same scope, is found by hash.
+    Near-identical segments, e.g. provisions that differ by an article number, are found through
+    locality sensitive hashing of their MinHash signatures, without comparing against every entry.
+    """
+
+    def __init__(
+        self, path: str = TRANSLATION_MEMORY_PATH, threshold: float = TRANSLATION_MEMORY_SIMILARITY
+    ) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.threshold = threshold
+        self.hits = 0
+        self.near_hits = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                entry_id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL UNIQUE,
+                scenario TEXT NOT NULL,
+                texts TEXT NOT NULL,
+                annotation TEXT NOT NULL,
+                model TEXT,
+                signature BLOB NOT NULL,
+                created_at REAL NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS bands (
+                band_key INTEGER NOT NULL,
+                entry_id INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS bands_band_key ON bands (band_key);
+            """
+        )
+
+    def add(self, scope: MemoryScope, texts: dict[str, str], annotation: MQMAnnotation) -> None:
+        """Store an evaluation, replacing the annotation of the same texts if there is one."""
+        signature = get_signature(texts)
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                (entry_id,) = self._conn.execute(
+                    """
+                    INSERT INTO entries (key, scenario, texts, annotation, model, signature,
+                        created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET
+                        annotation = excluded.annotation,
+                        model = excluded.model,
+                        created_at = excluded.created_at
+                    RETURNING entry_id
+                    """,
+                    (
+                        get_key(scope, texts),
+                        scope.scenario,
+                        json.dumps(texts, ensure_ascii=False),
+                        annotation.model_dump_json(),
+                        scope.model,
+                        signature.tobytes(),
+                        time.time(),
+                    ),
+                ).fetchone()
+                self._conn.execute("DELETE FROM bands WHERE entry_id = ?", (entry_id,))
+                self._conn.executemany(
+                    "INSERT INTO bands VALUES (?, ?)",
+                    [(band_key, entry_id) for band_key in get_band_keys(scope, signature)],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def lookup(self, scope: MemoryScope, texts: dict[str, str]) -> MemoryMatch | None:
+        """The exact match of the texts if there is one, or else the most similar near match."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT entry_id, texts, annotation, model FROM entries WHERE key = ?",
+                (get_key(scope, texts),),
+            ).fetchone()
+        if row is not None:
+            self.hits += 1
+            return self._to_match(row, exact=True, similarity=1.0)
+
+        signature = get_signature(texts)
+        band_keys = get_band_keys(scope, signature)
+        with self._lock:
+            candidates = self._conn.execute(
+                f"""
+                SELECT entry_id, texts, annotation, model, signature FROM entries
+                WHERE entry_id IN (
+                    SELECT entry_id FROM bands WHERE band_key IN ({", ".join("?" * BANDS)})
+                )
+                """,
+                band_keys,
+            ).fetchall()
+
+        best, best_similarity = None, self.threshold
+        for *row, candidate_signature in candidates:
+            similarity = float(
+                np.mean(signature == np.frombuffer(candidate_signature, dtype=np.uint64))
+            )
+            if similarity >= best_similarity:
+                best, best_similarity = row, similarity
+        if best is None:
+            return None
+
+        self.near_hits += 1
+        return self._to_match(best, exact=False, similarity=best_similarity)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM bands")
+            self._conn.execute("DELETE FROM entries")
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        return count
+
+    @staticmethod
+    def _to_match(row: tuple, exact: bool, similarity: float) -> MemoryMatch:
+        entry_id, texts, annotation, model = row
+        return MemoryMatch(
+            entry_id=entry_id,
+            exact=exact,
+            similarity=similarity,
+            texts=json.loads(texts),
+            annotation=MQMAnnotation.model_validate_json(annotation),
+            model=model,
+        )
+
+
+@st.cache_resource
+def get_translation_memory() -> TranslationMemory:
+    return TranslationMemory()
@@ -1,23 +1,42 @@
-import json
 from datetime import datetime
+from typing import TYPE_CHECKING, Any
 from zoneinfo import ZoneInfo
 
-import regex
 import streamlit as st
-from openai import OpenAI
-from openai.types.responses.response_text_config_param import ResponseTextConfigParam
 
-from config import DEFAULT_SYSTEM_PROMPT, ENV, MQM_PROMPTS
+from config import (
+    BUDGET_SESSION_USD,
+    CHAT_PAGE_SIZE,
+    CONTEXT_WINDOW_MESSAGES,
+    DEFAULT_SYSTEM_PROMPT,
+    ENV,
+    MQM_PROMPTS,
+    PROMPT_CACHE_MIN_TOKENS,
+    SEGMENT_MAX_CHARS,
+)
+from modules.budget import get_budget_controller
+from modules.cache import get_response_cache
+from modules.conversation import EXPORT_MIME_TYPES
 from modules.models import GPT
-from modules.mqm import MQMAnnotation, get_openai_schema
+from modules.mqm import MQMAnnotation, MQMStreamParser, parse_annotation
+from modules.templates import CompiledPrompt, get_prefix_hash, get_template_registry
+from modules.timing import get_render_timings, timed
 
-MQM_RESPONSE_SCHEMA = get_openai_schema(MQMAnnotation)
+if TYPE_CHECKING:
+    from modules.llm import ResponseStream
+    from modules.translation_memory import MemoryMatch, MemoryScope
+
+SALVAGED_WARNING = "Η απάντηση δεν ήταν έγκυρο JSON, ανακτήθηκαν μόνο τα πλήρη σφάλματα."
 
 
 class ViewsManager:
     def __init__(self) -> None:
         self.system_prompt = DEFAULT_SYSTEM_PROMPT
+        self.prompt_template: CompiledPrompt = get_template_registry().get(
+            DEFAULT_SYSTEM_PROMPT, list(GPT)[0].value.tokenizer_model
+        )
 
+    @timed("app")
     def get_main_view(self) -> None:
         with st.sidebar:
             self.get_sidebar()
@@ -25,12 +44,26 @@ class ViewsManager:
         self.get_conversation_section()
 
     def get_sidebar(self) -> None:
+        # Each section is a fragment, so its widgets rerun only that section and not the app
         self.get_model_options()
 
-        st.divider()
-
         self.info_box = st.empty()
 
+        self.get_export_section()
+
+        if ENV == "DEV":
+            st.divider()
+            self.get_debug_section()
+
+    @st.fragment
+    @timed("export")
+    def get_export_section(self) -> None:
+        export_format = "xlsx"
+        if st.session_state.get("structured_output", False):
+            export_format = st.selectbox(
+                "Μορφή αρχείου:", options=list(EXPORT_MIME_TYPES), key="export_format"
+            )
+
         if st.button(
             "Εξαγωγή συνομιλίας",
             type="primary",
@@ -40,7 +73,7 @@ class ViewsManager:
                 st.error("Conversation is empty. Add messages to export it.")
             else:
                 data, file_type, mime_type = (
-                    st.session_state.conversation_handler.export_conversation()
+                    st.session_state.conversation_handler.export_conversation(export_format)
                 )
 
                 now = datetime.now(ZoneInfo("Europe/Athens"))
@@ -51,7 +84,7 @@ class ViewsManager:
                         if st.session_state.structured_output
                         else "Λήψη συνομιλίας"
                     ),
-                    data=data if file_type == "xlsx" else data,
+                    data=data,
                     file_name=f"conversation_{now.strftime('%Y-%m-%d_%H-%M-%S')}.{file_type}",
                     mime=mime_type,
                     on_click="ignore",
@@ -59,17 +92,27 @@ class ViewsManager:
                     icon=":material/download:",
                 )
 
-        if ENV == "DEV":
-            st.divider()
+    @st.fragment
+    def get_debug_section(self) -> None:
+        st.write("Χρόνοι απόδοσης (ms)")
+        st.dataframe(get_render_timings(), hide_index=True, use_container_width=True)
+
+        if st.toggle("Εμφάνιση session state", key="show_session_state"):
             st.write(dict(sorted(st.session_state.to_dict().items())))
 
+    @st.fragment
+    @timed("cost")
     def get_cost_columns(self) -> None:
         input_col, output_col = st.columns(2)
 
-        st.session_state.conversation_handler.count_tokens(
-            text=self.system_prompt,
-            model=st.session_state.model_options["openai_model"],
-            role="system",
+        # Only the placeholder values are tokenized; the template's own count is precompiled
+        st.session_state.conversation_handler.ledger.set_count(
+            "system",
+            self.prompt_template.count_tokens(st.session_state.get("prompt_placeholders") or {}),
+        )
+        st.session_state.conversation_handler.ledger.set_count(
+            "json",
+            self.prompt_template.schema_tokens if st.session_state["structured_output"] else 0,
         )
 
         with input_col:
@@ -87,11 +130,6 @@ class ViewsManager:
                 f"({st.session_state.conversation_handler.system_tokens} συστήματος +  \n "
             )
             if st.session_state["structured_output"]:
-                st.session_state.conversation_handler.count_tokens(
-                    json.dumps(MQM_RESPONSE_SCHEMA, ensure_ascii=False, indent=2),
-                    model=st.session_state.model_options["openai_model"],
-                    role="json",
-                )
                 input_cost_breakdown += (
                     f"{st.session_state.conversation_handler.json_tokens} μοντέλου JSON + \n "
                 )
@@ -100,6 +138,29 @@ class ViewsManager:
                 + f"{st.session_state.conversation_handler.user_tokens} μηνύματος)"
             )
 
+            ledger = st.session_state.conversation_handler.ledger
+            if ledger.usage["input"]:
+                effective_cost = (
+                    st.session_state.conversation_handler.calculate_effective_input_cost(
+                        st.session_state.model_options["openai_model"]
+                    )
+                )
+                st.caption(
+                    f"Prompt cache: {ledger.cache_hit_ratio:.0%} "
+                    f"({ledger.usage['cached']}/{ledger.usage['input']} tokens), "
+                    f"πραγματικό κόστος ${effective_cost:.04f}"
+                )
+                # Reported by the provider; nothing is cached until a shared prefix is long enough
+                if (
+                    self.prompt_template.static_tokens
+                    + st.session_state.conversation_handler.json_tokens
+                    < PROMPT_CACHE_MIN_TOKENS
+                ):
+                    st.caption(
+                        f"Το prompt cache ισχύει μόνο για κοινό πρόθεμα {PROMPT_CACHE_MIN_TOKENS}+ "
+                        "tokens· οι οδηγίες και το σχήμα μόνα τους δεν το φτάνουν."
+                    )
+
         with output_col:
             output_tokens = st.session_state.conversation_handler.output_tokens
             output_cost = st.session_state.conversation_handler.calculate_cost(
@@ -112,23 +173,56 @@ class ViewsManager:
                 output_cost_str = f"{output_cost:.04f}"
             st.write(f"### {output_tokens} (${output_cost_str})")
 
-    def get_system_prompt_area(self):
+        if BUDGET_SESSION_USD:
+            spend = get_budget_controller().get_spend(st.session_state.get("session_id"))
+            spent = spend.get("session", 0.0)
+            st.progress(
+                min(1.0, spent / BUDGET_SESSION_USD),
+                text=f"Όριο συνεδρίας: ${spent:.4f} / ${BUDGET_SESSION_USD:.2f}",
+            )
+
+    def get_cache_options(self) -> None:
+        cache = get_response_cache()
+        st.toggle("Παράκαμψη cache απαντήσεων", key="bypass_cache")
+        # The cache is shared by every session, and so are its counters
+        st.caption(
+            f"Cache (όλες οι συνεδρίες, από την εκκίνηση της εφαρμογής): {cache.hits} hits / "
+            f"{cache.misses} misses ({cache.hit_ratio:.0%})"
+        )
+
+    def get_system_prompt_area(self, openai_model: GPT) -> None:
+        # The prompt of a resumed session; MQM sessions take theirs from the scenario instead
+        restored_system_prompt = st.session_state.pop("restored_system_prompt", None)
+
         if st.session_state.get("structured_output", False):
             scenario = st.radio("Σενάριο MQM:", options=["S-T", "R-T", "S-R-T"], key="scenario")
+            st.toggle(
+                "Τμηματοποίηση μεγάλων κειμένων",
+                value=True,
+                key="segment_documents",
+                help=f"Κείμενα άνω των {SEGMENT_MAX_CHARS} χαρακτήρων αξιολογούνται σε τμήματα.",
+            )
             system_prompt = MQM_PROMPTS[scenario].strip()
+        elif restored_system_prompt:
+            system_prompt = restored_system_prompt
         else:
             if st.session_state.get("prompt_placeholders", []):
                 system_prompt = DEFAULT_SYSTEM_PROMPT
-                st.session_state.conversation_manager.clear_prompt_placeholders()
+                st.session_state.conversation_handler.clear_prompt_placeholders()
             else:
                 system_prompt = self.system_prompt
 
         self.system_prompt = st.text_area("System prompt:", value=system_prompt)
+        self.prompt_template = get_template_registry().get(
+            self.system_prompt, openai_model.value.tokenizer_model
+        )
 
-        if "{" in self.system_prompt and "}" in self.system_prompt:
+        if self.prompt_template.placeholders:
             with st.expander("Μεταβλητές στο system prompt", expanded=True):
                 self.system_prompt = self.get_prompt_with_placeholders()
 
+    @st.fragment
+    @timed("options")
     def get_model_options(self) -> None:
         if ENV in ("DEV", "UAT"):
             from config import OPENAI_API_KEY, OPENAI_MODEL
@@ -141,7 +235,7 @@ class ViewsManager:
 
         st.toggle("Απάντηση για αξιολόγηση με MQM (σε JSON)", key="structured_output")
 
-        self.get_system_prompt_area()
+        self.get_system_prompt_area(openai_model)
 
         temperature = st.number_input(
             "Temperature (μεταξύ 0 και 1)",
@@ -151,13 +245,41 @@ class ViewsManager:
             step=0.1,
         )
 
+        with st.expander("Ιστορικό συνομιλίας"):
+            st.number_input(
+                "Μέγιστα μηνύματα στο ιστορικό",
+                value=CONTEXT_WINDOW_MESSAGES,
+                min_value=1,
+                key="context_window",
+            )
+            st.toggle("Σύνοψη παλαιότερων μηνυμάτων", key="summarize_history")
+
         st.session_state["system_prompt"] = self.system_prompt
         st.session_state["model_options"] = {
             "openai_model": openai_model or None,
             "openai_key": openai_api_key or None,
             "temperature": temperature or 0,
         }
-        st.session_state["tokens"] = {"input": 0, "output": 0}
+        # Running totals of this browser session, so they must survive reruns
+        st.session_state.setdefault("tokens", {"input": 0, "output": 0})
+
+        st.divider()
+
+        self.get_cost_columns()
+
+        self.get_cache_options()
+
+        # The model, the output mode and the prompt change what the main view shows, so they
+        # need a full rerun; everything else here only reruns this fragment
+        main_view_key = (
+            openai_model.name if openai_model else None,
+            st.session_state["structured_output"],
+            self.system_prompt,
+        )
+        previous_key = st.session_state.get("main_view_key")
+        st.session_state["main_view_key"] = main_view_key
+        if previous_key is not None and previous_key != main_view_key:
+            st.rerun(scope="app")
 
     def get_conversation_section(self) -> None:
         openai_model = st.session_state.model_options["openai_model"]
@@ -171,16 +293,7 @@ class ViewsManager:
         if "messages" not in st.session_state:
             st.session_state["messages"] = []
 
-        for msg in st.session_state["messages"]:
-            if msg["role"] == "system":
-                continue
-            elif msg["role"] == "user":
-                st.chat_message(msg["role"]).write(msg["content"])
-            else:
-                if st.session_state.get("structured_output", False):
-                    st.chat_message("assistant").json(msg["content"])
-                else:
-                    st.chat_message("assistant").write(msg)
+        self.get_chat_history()
 
         placeholder_text = "Γράψε μου μήνυμα"
         if st.session_state["structured_output"]:
@@ -191,72 +304,314 @@ class ViewsManager:
                 st.info("Επίλεξε μοντέλο GPT και βάλε το κλειδί για το API.")
                 st.stop()
 
-            client = OpenAI(api_key=openai_api_key)
+            # The OpenAI SDK is only loaded once the first prompt is sent
+            from modules.budget import BudgetExceededError
+            from modules.client import get_openai_client
+            from modules.context import get_llm_summarizer
+            from modules.llm import LLMRequest, ResponseStream
+
+            client = get_openai_client(openai_api_key)
 
+            # Only stored once the request is admitted, together with its answer
             if not len(st.session_state["messages"]):
                 st.session_state.conversation_handler.add_message(
-                    {"role": "system", "content": self.system_prompt}
+                    {"role": "system", "content": self.system_prompt}, persist=False
                 )
                 print("SYSTEM PROMPT ADDED:", f"{st.session_state.messages=}", sep="\n", end="\n\n")
 
-            st.session_state.conversation_handler.add_message({"role": "user", "content": prompt})
+            st.session_state.conversation_handler.add_message(
+                {"role": "user", "content": prompt}, persist=False
+            )
+            st.session_state.conversation_handler.save_settings(self.prompt_template.template)
             print("USER PROMPT ADDED:", f"{st.session_state.messages=}", sep="\n", end="\n\n")
 
             st.chat_message("user").write(prompt)
 
-            if st.session_state["structured_output"]:
-                response_format: ResponseTextConfigParam = {
-                    "format": {
-                        "type": "json_schema",
-                        "name": "mqm_annotation",
-                        "strict": True,
-                        "schema": MQM_RESPONSE_SCHEMA,
-                    }
-                }
-            else:
-                response_format = {"format": {"type": "text"}}
+            if self.should_segment():
+                self.write_segmented_annotation(openai_api_key, openai_model)
+                st.session_state["response_done"] = True
+                return
 
-            response = client.responses.create(
-                model=openai_model.value.api_name,
-                instructions=st.session_state.system_prompt,
-                input=st.session_state.messages,
+            memory_texts = self.get_memory_texts()
+            if memory_texts is not None:
+                from modules.translation_memory import get_translation_memory
+
+                match = get_translation_memory().lookup(
+                    self.get_memory_scope(openai_model), memory_texts
+                )
+                if match is not None and match.exact:
+                    self.write_memory_annotation(match)
+                    st.session_state["response_done"] = True
+                    return
+                if match is not None:
+                    self.show_memory_suggestion(match)
+
+            history, context_report = st.session_state.conversation_handler.get_context(
+                openai_model,
+                window=st.session_state.get("context_window", CONTEXT_WINDOW_MESSAGES),
+                summarizer=(
+                    get_llm_summarizer(client, openai_model)
+                    if st.session_state.get("summarize_history", False)
+                    else None
+                ),
+            )
+
+            request = LLMRequest.from_system_prompt(
+                model=openai_model,
+                system_prompt=st.session_state.system_prompt,
+                history=history,
                 temperature=st.session_state.model_options["temperature"],
-                text=response_format,  # type: ignore
+                structured_output=st.session_state["structured_output"],
+                scenario=(
+                    st.session_state.get("scenario")
+                    if st.session_state["structured_output"]
+                    else None
+                ),
+                session_id=st.session_state.get("session_id"),
+                allow_downgrade=True,
             )
+            cache = None if st.session_state.get("bypass_cache", False) else get_response_cache()
+            stream = ResponseStream(client, request, cache=cache)
+
+            message: dict[str, Any] = {"role": "assistant"}
+            msg: str | list[Any]
+            try:
+                with st.chat_message("assistant"):
+                    if st.session_state.get("structured_output", False):
+                        msg, message["annotation"], message["salvaged"] = (
+                            self.write_annotation_stream(stream)
+                        )
+                    else:
+                        msg = st.write_stream(stream)
+            except BudgetExceededError as e:
+                st.session_state.conversation_handler.discard_pending()
+                st.error(f"Το αίτημα απορρίφθηκε λόγω ορίου κόστους: {e}")
+                st.stop()
 
-            if response.usage:
-                st.session_state.tokens["input"] += response.usage.input_tokens
-                st.session_state.tokens["output"] += response.usage.output_tokens
+            response = stream.response
+            if response is not None:
+                msg = response.output_text
+                st.session_state.tokens["input"] += response.input_tokens
+                st.session_state.tokens["output"] += response.output_tokens
+                st.session_state.conversation_handler.record_usage(response)
                 self.info_box.info(
-                    f"Sent **{response.usage.input_tokens}** and "
-                    f"received **{response.usage.output_tokens}** tokens."
+                    f"Sent **{response.input_tokens}** and "
+                    f"received **{response.output_tokens}** tokens "
+                    f"({response.cached_tokens} cached)"
+                    + (" (from cache)." if response.from_cache else ".")
+                    + (
+                        f" Context trimmed by **{context_report.saved_tokens}** tokens "
+                        f"({', '.join(f'{k}: {v}' for k, v in context_report.saved.items())})."
+                        if context_report.saved_tokens
+                        else ""
+                    )
+                    + (
+                        f" Answered by **{stream.request.model.name}** to stay within budget."
+                        if stream.request.model is not openai_model
+                        else ""
+                    )
                 )
 
-            msg = response.output_text
-            st.session_state.conversation_handler.add_message({"role": "assistant", "content": msg})
+            if (
+                memory_texts is not None
+                and response is not None
+                and message.get("annotation") is not None
+                and not message.get("salvaged")
+            ):
+                # Kept under the model that answered, which the budget may have downgraded
+                get_translation_memory().add(
+                    self.get_memory_scope(stream.request.model), memory_texts, message["annotation"]
+                )
+
+            st.session_state.conversation_handler.add_message({**message, "content": msg})
             print("LLM RESPONSE ADDED:", f"{st.session_state.messages=}", sep="\n", end="\n\n")
 
-            if st.session_state.get("structured_output", False):
-                if isinstance(msg, str):
-                    msg_dict = json.loads(msg)
-                else:
-                    msg_dict = msg
-                st.chat_message("assistant").json(msg_dict)
+            st.session_state["response_done"] = True
+
+    @st.fragment
+    @timed("chat_history")
+    def get_chat_history(self) -> None:
+        messages = [msg for msg in st.session_state["messages"] if msg["role"] != "system"]
+
+        # Only the latest page is rendered; older turns are loaded a page at a time
+        conversation_handler = st.session_state.conversation_handler
+        history_size = st.session_state.get("chat_history_size", CHAT_PAGE_SIZE)
+        n_hidden = max(0, len(messages) - history_size)
+        n_older = n_hidden + conversation_handler.n_unloaded
+        if n_older:
+            st.button(
+                f"Εμφάνιση παλαιότερων μηνυμάτων ({n_older})",
+                on_click=self.show_older_messages,
+                args=(history_size, len(messages)),
+                use_container_width=True,
+            )
+
+        for msg in messages[n_hidden:]:
+            if msg["role"] == "user":
+                st.chat_message(msg["role"]).write(msg["content"])
             else:
-                st.chat_message("assistant").write(msg)
+                if st.session_state.get("structured_output", False):
+                    annotation = conversation_handler.get_annotation(msg, lenient=True)
+                    if msg["salvaged"]:
+                        with st.chat_message("assistant"):
+                            st.warning(SALVAGED_WARNING)
+                            st.json(annotation.model_dump(mode="json"))
+                    else:
+                        # Already validated, so the raw JSON can be rendered as is
+                        st.chat_message("assistant").json(msg["content"])
+                else:
+                    st.chat_message("assistant").write(msg)
 
-            st.session_state["response_done"] = True
+    def show_older_messages(self, history_size: int, n_loaded: int) -> None:
+        st.session_state["chat_history_size"] = history_size + CHAT_PAGE_SIZE
+        # Older turns of a resumed session are only read from the store once they are shown
+        st.session_state.conversation_handler.load_older(
+            max(0, history_size + CHAT_PAGE_SIZE - n_loaded)
+        )
 
-    def get_prompt_with_placeholders(self) -> str:
-        placeholders = regex.findall(r"\{([a-zA-Z_][a-zA-Z0-9_]*)\}", self.system_prompt)
+    def get_memory_texts(self) -> dict[str, str] | None:
+        """The texts to look up in the translation memory, if this turn is their evaluation."""
+        if not st.session_state.get("structured_output", False) or st.session_state.get(
+            "bypass_cache", False
+        ):
+            return None
+        # Only the first answer evaluates the texts; later turns depend on the conversation
+        conversation_handler = st.session_state.conversation_handler
+        if conversation_handler.n_unloaded or any(
+            msg["role"] == "assistant" for msg in st.session_state["messages"]
+        ):
+            return None
+
+        from modules.batch import SCENARIO_COLUMNS
+
+        placeholders = st.session_state.get("prompt_placeholders") or {}
+        scenario = st.session_state.get("scenario", "S-T")
+        if not all(placeholders.get(name) for name in SCENARIO_COLUMNS[scenario]):
+            return None
+        return {name: placeholders[name] for name in SCENARIO_COLUMNS[scenario]}
+
+    def get_memory_scope(self, model: GPT) -> "MemoryScope":
+        from modules.translation_memory import MemoryScope
+
+        placeholders = st.session_state.get("prompt_placeholders") or {}
+        return MemoryScope(
+            scenario=st.session_state.get("scenario", "S-T"),
+            model=model.name,
+            src_lang=placeholders.get("src_lang", ""),
+            tgt_lang=placeholders.get("tgt_lang", ""),
+            prompt_hash=get_prefix_hash(self.prompt_template.template),
+        )
+
+    def write_memory_annotation(self, match: "MemoryMatch") -> None:
+        with st.chat_message("assistant"):
+            st.json(match.annotation.model_dump(mode="json"))
+        self.info_box.info(
+            f"Found in the translation memory (evaluated by {match.model or 'unknown'}), "
+            "no tokens sent."
+        )
+        st.session_state.conversation_handler.add_message(
+            {
+                "role": "assistant",
+                "content": match.annotation.model_dump_json(),
+                "annotation": match.annotation,
+                "salvaged": False,
+            }
+        )
+        print("LLM RESPONSE ADDED:", f"{st.session_state.messages=}", sep="\n", end="\n\n")
+
+    def show_memory_suggestion(self, match: "MemoryMatch") -> None:
+        with st.expander(f"Παρόμοιο τμήμα έχει ήδη αξιολογηθεί (ομοιότητα {match.similarity:.0%})"):
+            for name, text in match.texts.items():
+                st.caption(f"`{name}`: {text}")
+            st.json(match.annotation.model_dump(mode="json"), expanded=False)
+
+    def should_segment(self) -> bool:
+        placeholders = st.session_state.get("prompt_placeholders") or {}
+        if not st.session_state.get("structured_output", False) or not st.session_state.get(
+            "segment_documents", True
+        ):
+            return False
+        if all(len(text) <= SEGMENT_MAX_CHARS for text in placeholders.values()):
+            return False
+
+        from modules.batch import SCENARIO_COLUMNS
+
+        scenario = st.session_state.get("scenario", "S-T")
+        return all(placeholders.get(name) for name in SCENARIO_COLUMNS[scenario])
+
+    def write_segmented_annotation(self, openai_api_key: str, openai_model: GPT) -> None:
+        """Evaluate long placeholder texts as chunks in parallel, as one document-level answer."""
+        from modules.batch import BatchEvaluator, BatchResult
+
+        placeholders = st.session_state.prompt_placeholders
+        evaluator = BatchEvaluator(
+            api_key=openai_api_key,
+            model=openai_model,
+            scenario=st.session_state.get("scenario", "S-T"),
+            src_lang=placeholders.get("src_lang", ""),
+            tgt_lang=placeholders.get("tgt_lang", ""),
+            temperature=st.session_state.model_options["temperature"],
+            cache=None if st.session_state.get("bypass_cache", False) else get_response_cache(),
+            prompt=self.prompt_template.template,
+            session_id=st.session_state.get("session_id"),
+        )
+
+        with st.chat_message("assistant"):
+            progress_bar = st.progress(0.0)
+
+            def show_progress(result: BatchResult, done: int, total: int) -> None:
+                progress_bar.progress(done / total, text=f"{done}/{total} τμήματα")
+
+            annotation, results = evaluator.run_document(placeholders, on_result=show_progress)
+            progress_bar.empty()
+            st.json(annotation.model_dump(mode="json"))
+
+        input_tokens = sum(result.input_tokens for result in results)
+        cached_tokens = sum(result.cached_tokens for result in results)
+        output_tokens = sum(result.output_tokens for result in results)
+        failures = sum(result.error is not None for result in results)
+        st.session_state.tokens["input"] += input_tokens
+        st.session_state.tokens["output"] += output_tokens
+        st.session_state.conversation_handler.ledger.record_usage(
+            input_tokens, cached_tokens, output_tokens
+        )
+        self.info_box.info(
+            f"Evaluated **{len(results)}** chunks in parallel. Sent **{input_tokens}** and "
+            f"received **{output_tokens}** tokens ({cached_tokens} cached)."
+            + (f" **{failures}** chunks failed." if failures else "")
+        )
 
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_placeholders = []
-        for p in placeholders:
-            if p not in seen:
-                seen.add(p)
-                unique_placeholders.append(p)
+        st.session_state.conversation_handler.add_message(
+            {
+                "role": "assistant",
+                "content": annotation.model_dump_json(),
+                "annotation": annotation,
+                "salvaged": False,
+            }
+        )
+        print("LLM RESPONSE ADDED:", f"{st.session_state.messages=}", sep="\n", end="\n\n")
+
+    def write_annotation_stream(self, stream: "ResponseStream") -> tuple[str, MQMAnnotation, bool]:
+        """Show each error as it arrives; the full response is then parsed exactly once."""
+        parser = MQMStreamParser(lenient=True)
+        annotation_area = st.empty()
+
+        with annotation_area.container():
+            for chunk in stream:
+                for err in parser.feed(chunk):
+                    st.json(err.model_dump(mode="json"))
+
+        annotation, salvaged = parse_annotation(parser.text, lenient=True)
+        if salvaged:
+            print(f"SALVAGED {len(annotation.errors)} errors from a malformed annotation")
+        with annotation_area.container():
+            if salvaged:
+                st.warning(SALVAGED_WARNING)
+            st.json(annotation.model_dump(mode="json"))
+        return parser.text, annotation, salvaged
+
+    def get_prompt_with_placeholders(self) -> str:
+        unique_placeholders = self.prompt_template.placeholders
 
         if unique_placeholders:
             if "prompt_placeholders" not in st.session_state:
@@ -284,7 +639,7 @@ class ViewsManager:
             empty_placeholders = list(st.session_state.prompt_placeholders.values()).count("")
             if not empty_placeholders:
                 st.session_state["show_final_prompt"] = True
-                return self.system_prompt.format(**st.session_state.prompt_placeholders)
+                return self.prompt_template.render(st.session_state.prompt_placeholders)
             else:
                 middle = "μεταβλητές δεν έχουν" if empty_placeholders > 1 else "μεταβλητή δεν έχει"
                 st.warning(f"{empty_placeholders} {middle} τιμή")
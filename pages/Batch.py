@@ -0,0 +1,172 @@
+import time
+
+import streamlit as st
+
+from config import APP_NAME, BATCH_CONCURRENCY, ENV, MQM_PROMPTS
+from modules.authentication import AuthenticationManager
+
+st.set_page_config(page_title=f"Μαζική αξιολόγηση | {APP_NAME}", layout="wide")
+
+if "authentication_manager" not in st.session_state:
+    st.session_state.authentication_manager = AuthenticationManager()
+
+# Only needed past the password check, so the login screen renders without loading them
+import pandas as pd  # noqa: E402
+
+from modules.batch import BatchEvaluator, BatchResult, missing_columns, read_segments  # noqa: E402
+from modules.cache import get_response_cache  # noqa: E402
+from modules.models import GPT  # noqa: E402
+from modules.scoring import MQMScorer  # noqa: E402
+from modules.session import SessionHandler  # noqa: E402
+from modules.translation_memory import get_translation_memory  # noqa: E402
+
+
+def run_live(
+    evaluator: BatchEvaluator, segments: pd.DataFrame, scorer: MQMScorer
+) -> list[BatchResult]:
+    progress_bar = st.progress(0.0)
+    scores_table = st.empty()
+    results_table = st.empty()
+    partial_results: list[BatchResult] = []
+    unscored: list[BatchResult] = []
+    started_at = time.perf_counter()
+
+    def show_progress(result: BatchResult, done: int, total: int) -> None:
+        partial_results.append(result)
+        unscored.append(result)
+        elapsed = time.perf_counter() - started_at
+        progress_bar.progress(
+            done / total, text=f"{done}/{total} τμήματα ({done / elapsed:.1f} ανά δευτερόλεπτο)"
+        )
+        # Redrawing the table is O(n), so only do it about a hundred times per run
+        if done == total or done % max(1, total // 100) == 0:
+            # Only the results since the last redraw are scored
+            evaluator.add_to_scorer(scorer, segments, unscored)
+            unscored.clear()
+            scores_table.dataframe(scorer.scores(by=("model", "language_pair")))
+            results_table.dataframe(
+                evaluator.results_to_summary(segments, sorted(partial_results, key=lambda r: r.row))
+            )
+
+    return evaluator.run(segments, on_result=show_progress)
+
+
+if "session_handler" not in st.session_state:
+    st.session_state.session_handler = SessionHandler()
+
+# Requests count against the session's budget, so a refresh must keep the same session
+st.query_params["session"] = st.session_state["session_id"]
+st.query_params["client"] = st.session_state["client_id"]
+
+with st.sidebar:
+    if ENV in ("DEV", "UAT"):
+        from config import OPENAI_API_KEY, OPENAI_MODEL
+
+        openai_api_key = OPENAI_API_KEY
+        openai_model = GPT[OPENAI_MODEL]
+    else:
+        openai_api_key = st.text_input("Κλειδί για το API της OpenAI:")
+        openai_model = st.selectbox("Μοντέλο GPT:", options=list(GPT))
+
+    scenario = st.radio("Σενάριο MQM:", options=list(MQM_PROMPTS), key="batch_scenario")
+    src_lang = st.text_input("`src_lang`:", value="EL").upper()
+    tgt_lang = st.text_input("`tgt_lang`:", value="DE").upper()
+    temperature = st.number_input(
+        "Temperature (μεταξύ 0 και 1)",
+        value=0.1,
+        min_value=float(0),
+        max_value=float(1),
+        step=0.1,
+    )
+    concurrency = st.slider(
+        "Ταυτόχρονα αιτήματα", min_value=1, max_value=64, value=BATCH_CONCURRENCY
+    )
+    bypass_cache = st.toggle(
+        "Παράκαμψη cache απαντήσεων",
+        key="batch_bypass_cache",
+        help="Παρακάμπτει και τη μνήμη μεταφράσεων.",
+    )
+
+uploaded_file = st.file_uploader("Αρχείο τμημάτων (CSV/XLSX)", type=["csv", "xlsx"])
+
+if uploaded_file is None:
+    st.info("Το αρχείο πρέπει να έχει στήλες `source`, `reference` και `translation`.")
+    st.stop()
+
+segments = read_segments(uploaded_file, uploaded_file.name)
+
+if missing := missing_columns(segments, scenario):
+    st.error(f"Λείπουν στήλες για το σενάριο {scenario}: {', '.join(missing)}")
+    st.stop()
+
+st.write(f"{len(segments)} τμήματα")
+
+if not openai_model:
+    st.info("Επίλεξε μοντέλο GPT.")
+    st.stop()
+
+evaluator = BatchEvaluator(
+    api_key=openai_api_key,
+    model=openai_model,
+    scenario=scenario,
+    src_lang=src_lang,
+    tgt_lang=tgt_lang,
+    temperature=temperature,
+    concurrency=concurrency,
+    cache=None if bypass_cache else get_response_cache(),
+    memory=None if bypass_cache else get_translation_memory(),
+    session_id=st.session_state["session_id"],
+)
+
+mode = st.radio("Εκτέλεση:", options=["Άμεση", "Offline (Batch API)"], horizontal=True)
+
+if mode != "Άμεση":
+    st.download_button(
+        "Λήψη αρχείου αιτημάτων",
+        data="\n".join(evaluator.to_batch_requests(segments)).encode("utf-8"),
+        file_name=f"batch_{scenario}_requests.jsonl",
+        mime="application/jsonl",
+        on_click="ignore",
+        icon=":material/download:",
+    )
+
+    results_file = st.file_uploader("Αρχείο αποτελεσμάτων (JSONL)", type=["jsonl"])
+    if results_file is None:
+        st.stop()
+
+    results = evaluator.from_batch_results(results_file)
+    scorer = MQMScorer()
+    evaluator.add_to_scorer(scorer, segments, results)
+    st.dataframe(scorer.scores(by=("model", "language_pair")))
+    st.dataframe(evaluator.results_to_summary(segments, results))
+else:
+    if not st.button("Έναρξη αξιολόγησης", type="primary"):
+        st.stop()
+
+    if not openai_api_key:
+        st.info("Βάλε το κλειδί για το API.")
+        st.stop()
+
+    scorer = MQMScorer()
+    results = run_live(evaluator, segments, scorer)
+
+if failures := sum(result.error is not None for result in results):
+    st.warning(f"{failures} τμήματα απέτυχαν")
+
+if reused := sum(result.memory in ("exact", "repeat") for result in results):
+    st.info(f"{reused} τμήματα χωρίς νέα κλήση, από τη μνήμη μεταφράσεων ή ως επαναλήψεις")
+if similar := sum(result.memory == "similar" for result in results):
+    st.caption(f"{similar} τμήματα μοιάζουν με ήδη αξιολογημένα (στήλη `similarity`)")
+
+with st.expander("Βαθμολογία MQM ανά κατηγορία"):
+    st.dataframe(scorer.scores(by=("category",)))
+
+errors_table = evaluator.results_to_table(segments, results)
+st.download_button(
+    "Λήψη αποτελεσμάτων",
+    data=errors_table.to_csv(index=False).encode("utf-8"),
+    file_name=f"batch_{scenario}.csv",
+    mime="text/csv",
+    on_click="ignore",
+    icon=":material/download:",
+)
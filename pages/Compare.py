@@ -0,0 +1,120 @@
+import time
+
+import streamlit as st
+
+from config import APP_NAME, ENV, MQM_PROMPTS
+from modules.authentication import AuthenticationManager
+
+st.set_page_config(page_title=f"Σύγκριση μοντέλων | {APP_NAME}", layout="wide")
+
+if "authentication_manager" not in st.session_state:
+    st.session_state.authentication_manager = AuthenticationManager()
+
+# Only needed past the password check, so the login screen renders without loading them
+from modules.batch import SCENARIO_COLUMNS  # noqa: E402
+from modules.cache import get_response_cache  # noqa: E402
+from modules.comparison import ModelComparison, ModelResult  # noqa: E402
+from modules.models import GPT  # noqa: E402
+from modules.session import SessionHandler  # noqa: E402
+
+if "session_handler" not in st.session_state:
+    st.session_state.session_handler = SessionHandler()
+
+# Requests count against the session's budget, so a refresh must keep the same session
+st.query_params["session"] = st.session_state["session_id"]
+st.query_params["client"] = st.session_state["client_id"]
+
+with st.sidebar:
+    if ENV in ("DEV", "UAT"):
+        from config import OPENAI_API_KEY
+
+        openai_api_key = OPENAI_API_KEY
+    else:
+        openai_api_key = st.text_input("Κλειδί για το API της OpenAI:")
+
+    models = st.multiselect(
+        "Μοντέλα GPT:", options=list(GPT), default=list(GPT), format_func=lambda model: model.name
+    )
+    scenario = st.radio("Σενάριο MQM:", options=list(MQM_PROMPTS), key="compare_scenario")
+    src_lang = st.text_input("`src_lang`:", value="EL").upper()
+    tgt_lang = st.text_input("`tgt_lang`:", value="DE").upper()
+    temperature = st.number_input(
+        "Temperature (μεταξύ 0 και 1)",
+        value=0.1,
+        min_value=float(0),
+        max_value=float(1),
+        step=0.1,
+    )
+    bypass_cache = st.toggle("Παράκαμψη cache απαντήσεων", key="compare_bypass_cache")
+
+st.write("## Σύγκριση μοντέλων")
+
+row = {
+    column: st.text_area(f"`{column}`:", key=f"compare_{column}")
+    for column in SCENARIO_COLUMNS[scenario]
+}
+
+if not st.button("Σύγκριση", type="primary", disabled=not all(row.values())):
+    st.stop()
+
+if not models:
+    st.info("Επίλεξε τουλάχιστον ένα μοντέλο GPT.")
+    st.stop()
+
+if not openai_api_key:
+    st.info("Βάλε το κλειδί για το API.")
+    st.stop()
+
+comparison = ModelComparison(
+    api_key=openai_api_key,
+    models=models,
+    scenario=scenario,
+    src_lang=src_lang,
+    tgt_lang=tgt_lang,
+    temperature=temperature,
+    cache=None if bypass_cache else get_response_cache(),
+    session_id=st.session_state["session_id"],
+)
+
+summary_table = st.empty()
+placeholders = {}
+for model, column in zip(models, st.columns(len(models))):
+    column.write(f"### {model.name}")
+    placeholders[model] = column.empty()
+    placeholders[model].caption("Αναμονή απάντησης…")
+started_at = time.perf_counter()
+
+
+def show_result(result: ModelResult, done: int, total: int) -> None:
+    # Each model's answer is shown as soon as it arrives
+    with placeholders[result.model].container():
+        st.write(
+            f"{result.latency:.2f}s · {result.input_tokens} → {result.output_tokens} tokens · "
+            f"${result.cost:.4f}" + (" (από cache)" if result.from_cache else "")
+        )
+        if result.error is not None:
+            st.error(result.error)
+            return
+        if result.salvaged:
+            st.warning("Η απάντηση δεν ήταν έγκυρο JSON· ανακτήθηκαν μόνο τα πλήρη σφάλματα.")
+        if result.annotation is not None:
+            st.json(result.annotation.model_dump(mode="json"))
+
+
+results = comparison.run(row, on_result=show_result)
+elapsed = time.perf_counter() - started_at
+
+summary = comparison.results_to_summary(row, results)
+summary_table.dataframe(
+    summary,
+    hide_index=True,
+    column_config={
+        "latency_s": st.column_config.NumberColumn(format="%.2f"),
+        "cost_usd": st.column_config.NumberColumn(format="$%.4f"),
+        "score": st.column_config.NumberColumn(format="%.2f"),
+    },
+)
+st.caption(
+    f"Συνολική αναμονή {elapsed:.2f}s, έναντι {summary['latency_s'].sum():.2f}s "
+    f"αν τα μοντέλα καλούνταν διαδοχικά"
+)
@@ -1,8 +1,104 @@
+import time
+
 import streamlit as st
 
-from App import APP_NAME
-from modules.models import gpt_models_to_df
+from config import (
+    APP_NAME,
+    DEFAULT_OUTPUT_RATIO,
+    METRICS_WINDOW,
+    MQM_PROMPTS,
+    PROMPT_CACHE_MIN_TOKENS,
+)
+from modules.authentication import AuthenticationManager
 
 st.set_page_config(page_title=f"Κόστος | {APP_NAME}")
 
+if "authentication_manager" not in st.session_state:
+    st.session_state.authentication_manager = AuthenticationManager()
+
+# Only needed past the password check, so the login screen renders without loading them
+from modules.batch import missing_columns, read_segments  # noqa: E402
+from modules.cache import get_response_cache  # noqa: E402
+from modules.estimator import estimate_run_cost  # noqa: E402
+from modules.models import gpt_models_to_df  # noqa: E402
+from modules.telemetry import get_latency_stats, get_metrics_store, to_prometheus  # noqa: E402
+
 st.table(gpt_models_to_df(), border=True)
+
+st.write("## Μετρημένη απόδοση")
+
+metrics_store = get_metrics_store()
+requests = metrics_store.get_requests(since=time.time() - METRICS_WINDOW)
+if requests.empty:
+    st.caption("Δεν έχουν καταγραφεί αιτήματα ακόμη.")
+else:
+    by_scenario = st.toggle("Ανά σενάριο", value=True, key="latency_by_scenario")
+    stats = get_latency_stats(requests, by=("model", "scenario") if by_scenario else ("model",))
+    st.dataframe(
+        stats,
+        column_config={
+            "cost_usd": st.column_config.NumberColumn(format="$%.4f"),
+            "output_tokens_per_s": st.column_config.NumberColumn(format="%.1f"),
+            **{
+                col: st.column_config.NumberColumn(format="%.0f")
+                for col in stats.columns
+                if col.endswith("_ms")
+            },
+        },
+    )
+    st.caption(
+        f"{len(requests)} αιτήματα των τελευταίων {METRICS_WINDOW // 86400} ημερών. "
+        "Τα ποσοστημόρια αφορούν μόνο αιτήματα που έφτασαν στο API."
+    )
+
+    if st.toggle("Εξαγωγή Prometheus", key="prometheus_export"):
+        # Totals over the whole log, so the counters never go down between scrapes
+        exposition = to_prometheus(metrics_store.get_requests())
+        st.code(exposition, language="text")
+        st.download_button(
+            "Λήψη μετρικών",
+            data=exposition.encode("utf-8"),
+            file_name="metrics.prom",
+            mime="text/plain",
+            on_click="ignore",
+            icon=":material/download:",
+        )
+
+st.write("## Εκτίμηση κόστους")
+
+scenario = st.radio("Σενάριο MQM:", options=list(MQM_PROMPTS), horizontal=True, key="cost_scenario")
+src_lang_col, tgt_lang_col = st.columns(2)
+src_lang = src_lang_col.text_input("`src_lang`:", value="EL").upper()
+tgt_lang = tgt_lang_col.text_input("`tgt_lang`:", value="DE").upper()
+
+output_ratio = get_response_cache().get_output_ratio(scenario=scenario)
+if output_ratio is None:
+    output_ratio = DEFAULT_OUTPUT_RATIO
+    st.caption(f"Χωρίς αρκετό ιστορικό για το {scenario}, λόγος output/input: {output_ratio:.2f}")
+else:
+    st.caption(f"Ιστορικός λόγος output/input για το {scenario}: {output_ratio:.2f}")
+
+uploaded_file = st.file_uploader("Αρχείο τμημάτων (CSV/XLSX)", type=["csv", "xlsx"])
+
+if uploaded_file is not None:
+    segments = read_segments(uploaded_file, uploaded_file.name)
+
+    if missing := missing_columns(segments, scenario):
+        st.error(f"Λείπουν στήλες για το σενάριο {scenario}: {', '.join(missing)}")
+        st.stop()
+
+    started_at = time.perf_counter()
+    estimate = estimate_run_cost(segments, scenario, src_lang, tgt_lang, output_ratio)
+    st.caption(f"{len(segments)} τμήματα σε {time.perf_counter() - started_at:.2f}s")
+    st.dataframe(
+        estimate,
+        column_config={
+            col: st.column_config.NumberColumn(format="$%.4f")
+            for col in estimate.columns
+            if "cost" in col
+        },
+    )
+    st.caption(
+        "Το `total_cost_with_prompt_cache` αφαιρεί την έκπτωση του prompt cache μόνο όταν το "
+        f"σταθερό πρόθεμα φτάνει τα {PROMPT_CACHE_MIN_TOKENS} tokens, το ελάχιστο του παρόχου."
+    )
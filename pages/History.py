@@ -0,0 +1,70 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import streamlit as st
+
+from config import APP_NAME
+from modules.authentication import AuthenticationManager
+from modules.session import SessionHandler
+from modules.store import get_conversation_store
+
+SESSIONS_PAGE_SIZE = 50
+
+st.set_page_config(page_title=f"Ιστορικό | {APP_NAME}", layout="wide")
+
+if "authentication_manager" not in st.session_state:
+    st.session_state.authentication_manager = AuthenticationManager()
+
+if "session_handler" not in st.session_state:
+    st.session_state.session_handler = SessionHandler()
+
+# Kept in the URL, so that a refresh still lists this browser's conversations
+st.query_params["client"] = st.session_state["client_id"]
+
+st.write("## Προηγούμενες συνομιλίες")
+
+store = get_conversation_store()
+page = st.number_input("Σελίδα", min_value=1, value=1)
+# Only the conversations started in this browser
+sessions = store.list_sessions(
+    st.session_state["client_id"],
+    limit=SESSIONS_PAGE_SIZE,
+    offset=(page - 1) * SESSIONS_PAGE_SIZE,
+)
+
+if not sessions:
+    st.info("Δεν υπάρχουν αποθηκευμένες συνομιλίες.")
+    st.stop()
+
+
+def format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, ZoneInfo("Europe/Athens")).strftime("%Y-%m-%d %H:%M")
+
+
+event = st.dataframe(
+    [
+        {
+            "Τίτλος": session.title or "—",
+            "Μηνύματα": session.n_messages,
+            "Tokens": session.tokens,
+            "Έναρξη": format_time(session.created_at),
+            "Τελευταία ενημέρωση": format_time(session.updated_at),
+            "Τρέχουσα": session.session_id == st.session_state.get("session_id"),
+        }
+        for session in sessions
+    ],
+    hide_index=True,
+    use_container_width=True,
+    on_select="rerun",
+    selection_mode="single-row",
+)
+
+if event.selection.rows:
+    selected = sessions[event.selection.rows[0]]
+    with st.expander("Τελευταία μηνύματα", expanded=True):
+        for msg in store.get_messages(selected.session_id, limit=4, roles=("user", "assistant")):
+            st.chat_message(msg.role).write(msg.content)
+
+    if st.button("Συνέχεια συνομιλίας", type="primary"):
+        st.session_state.session_handler.switch_session(selected.session_id)
+        st.switch_page("App.py")
@@ -0,0 +1,157 @@
+import asyncio
+import unittest
+from datetime import UTC, datetime, timedelta
+from email.utils import format_datetime
+from typing import Any
+from unittest import mock
+
+import httpx
+from openai import APIStatusError, AsyncOpenAI, OpenAI
+
+from config import OPENAI_MAX_BACKOFF
+from modules.client import awith_retries, parse_retry_after, with_retries
+
+
+class FakeTransport:
+    """Answers each request with the next of `responses`, a (status, headers) pair."""
+
+    def __init__(self, *responses: tuple[int, dict[str, str]]) -> None:
+        self.responses = list(responses)
+        self.requests = 0
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        status, headers = self.responses.pop(0)
+        body: dict[str, Any] = (
+            {"object": "list", "data": []} if status == 200 else {"error": {"message": "x"}}
+        )
+        return httpx.Response(status, headers=headers, json=body)
+
+    async def ahandle(self, request: httpx.Request) -> httpx.Response:
+        return self.handle(request)
+
+
+def get_client(transport: FakeTransport) -> OpenAI:
+    return OpenAI(
+        api_key="test",
+        base_url="http://api.test/v1",
+        max_retries=0,
+        http_client=httpx.Client(transport=httpx.MockTransport(transport.handle)),
+    )
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+    def test_milliseconds(self) -> None:
+        self.assertEqual(parse_retry_after(httpx.Headers({"retry-after-ms": "1500"})), 1.5)
+
+    def test_milliseconds_take_precedence(self) -> None:
+        headers = httpx.Headers({"retry-after-ms": "250", "retry-after": "3"})
+        self.assertEqual(parse_retry_after(headers), 0.25)
+
+    def test_seconds(self) -> None:
+        self.assertEqual(parse_retry_after(httpx.Headers({"retry-after": "3"})), 3)
+
+    def test_http_date(self) -> None:
+        retry_at = format_datetime(datetime.now(UTC) + timedelta(seconds=30), usegmt=True)
+        delay = parse_retry_after(httpx.Headers({"retry-after": retry_at}))
+        assert delay is not None
+        self.assertAlmostEqual(delay, 30, delta=1.5)
+
+    def test_invalid_milliseconds_fall_back_to_seconds(self) -> None:
+        headers = httpx.Headers({"retry-after-ms": "soon", "retry-after": "2"})
+        self.assertEqual(parse_retry_after(headers), 2)
+
+    def test_missing_or_invalid(self) -> None:
+        self.assertIsNone(parse_retry_after(httpx.Headers()))
+        self.assertIsNone(parse_retry_after(httpx.Headers({"retry-after": "later"})))
+
+
+class RetryScheduleTest(unittest.TestCase):
+    def run_with_retries(
+        self, transport: FakeTransport, max_retries: int = 3
+    ) -> tuple[list[float], Exception | None]:
+        client = get_client(transport)
+        with mock.patch("modules.client.time.sleep") as sleep:
+            try:
+                with_retries(lambda: client.models.list(), max_retries=max_retries)
+                error = None
+            except APIStatusError as e:
+                error = e
+        return [call.args[0] for call in sleep.call_args_list], error
+
+    def test_429_waits_for_retry_after_ms(self) -> None:
+        transport = FakeTransport((429, {"retry-after-ms": "1200"}), (200, {}))
+        delays, error = self.run_with_retries(transport)
+        self.assertIsNone(error)
+        self.assertEqual(delays, [1.2])
+        self.assertEqual(transport.requests, 2)
+
+    def test_429_waits_for_retry_after(self) -> None:
+        transport = FakeTransport(
+            (429, {"retry-after": "2"}), (429, {"retry-after": "4"}), (200, {})
+        )
+        delays, error = self.run_with_retries(transport)
+        self.assertIsNone(error)
+        self.assertEqual(delays, [2, 4])
+
+    def test_retry_after_is_capped(self) -> None:
+        transport = FakeTransport((429, {"retry-after": str(OPENAI_MAX_BACKOFF * 10)}), (200, {}))
+        delays, _ = self.run_with_retries(transport)
+        self.assertEqual(delays, [OPENAI_MAX_BACKOFF])
+
+    def test_5xx_backs_off_exponentially_with_jitter(self) -> None:
+        transport = FakeTransport((500, {}), (502, {}), (503, {}), (200, {}))
+        # The jitter draws its upper bound, so the delays are the bounds themselves
+        with mock.patch("modules.client.random.uniform", side_effect=lambda low, high: high):
+            delays, error = self.run_with_retries(transport)
+        self.assertIsNone(error)
+        self.assertEqual(delays, [0.5, 1, 2])
+
+    def test_jitter_is_capped(self) -> None:
+        transport = FakeTransport((503, {}), (200, {}))
+        with (
+            mock.patch("modules.client.random.uniform", side_effect=lambda low, high: high),
+            mock.patch("modules.client.OPENAI_MAX_BACKOFF", 0.3),
+        ):
+            delays, _ = self.run_with_retries(transport)
+        self.assertEqual(delays, [0.3])
+
+    def test_gives_up_after_max_retries(self) -> None:
+        transport = FakeTransport(*[(503, {"retry-after": "0"})] * 3)
+        delays, error = self.run_with_retries(transport, max_retries=2)
+        self.assertIsInstance(error, APIStatusError)
+        self.assertEqual(len(delays), 2)
+        self.assertEqual(transport.requests, 3)
+
+    def test_client_errors_are_not_retried(self) -> None:
+        transport = FakeTransport((400, {}))
+        delays, error = self.run_with_retries(transport)
+        self.assertIsInstance(error, APIStatusError)
+        self.assertEqual(delays, [])
+        self.assertEqual(transport.requests, 1)
+
+
+class AsyncRetryScheduleTest(unittest.TestCase):
+    def test_429_then_5xx(self) -> None:
+        transport = FakeTransport((429, {"retry-after-ms": "500"}), (503, {}), (200, {}))
+        client = AsyncOpenAI(
+            api_key="test",
+            base_url="http://api.test/v1",
+            max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(transport.ahandle)),
+        )
+
+        async def run() -> None:
+            await awith_retries(lambda: client.models.list())
+
+        with (
+            mock.patch("modules.client.asyncio.sleep", new=mock.AsyncMock()) as sleep,
+            mock.patch("modules.client.random.uniform", side_effect=lambda low, high: high),
+        ):
+            asyncio.run(run())
+        self.assertEqual([call.args[0] for call in sleep.await_args_list], [0.5, 1])
+        self.assertEqual(transport.requests, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from modules.batch import BatchEvaluator, BatchResult
+from modules.mqm import MQMAnnotation
+from modules.pipeline import EvaluationPipeline
+
+
+class FakeEvaluator(BatchEvaluator):
+    """Answers a chunk's rows in reverse, like completions, and fails the `failing` sources."""
+
+    def __init__(self, failing: set[str]) -> None:
+        self.scenario = "S-T"
+        self.failing = failing
+        self.evaluated: list[str] = []
+
+    def run(self, df: pd.DataFrame, on_result: object = None) -> list[BatchResult]:
+        results = []
+        for position, row in reversed(list(enumerate(df.to_dict("records")))):
+            self.evaluated.append(row["source"])
+            if row["source"] in self.failing:
+                results.append(BatchResult(row=position, error="APIConnectionError"))
+            else:
+                results.append(
+                    BatchResult(
+                        row=position, annotation=MQMAnnotation(), input_tokens=10, output_tokens=2
+                    )
+                )
+        return results
+
+
+class RetryFailedTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.dir = Path(tmp_dir.name)
+        self.input_path = self.dir / "segments.jsonl"
+        self.input_path.write_text(
+            "".join(
+                json.dumps({"source": f"src {i}", "translation": f"tr {i}"}) + "\n"
+                for i in range(25)
+            )
+        )
+
+    def run_resumed_with_limit(self, output_name: str) -> EvaluationPipeline:
+        """A run stopped at 15 rows, then resumed, while rows 3, 12, 17 and 21 failed."""
+        evaluator = FakeEvaluator({"src 3", "src 12", "src 17", "src 21"})
+        output_path = self.dir / output_name
+        EvaluationPipeline(evaluator, self.input_path, output_path, chunk_size=10).run(limit=15)
+        checkpoint = EvaluationPipeline(
+            evaluator, self.input_path, output_path, chunk_size=10
+        ).run()
+        self.assertEqual((checkpoint.rows, checkpoint.failures), (25, 4))
+
+        # The outage is over, and the retry reads the output in other chunks than it was written
+        return EvaluationPipeline(FakeEvaluator(set()), self.input_path, output_path, chunk_size=4)
+
+    def assert_retried(self, pipeline: EvaluationPipeline, records: pd.DataFrame) -> None:
+        self.assertEqual(sorted(records["row"]), list(range(25)))
+        self.assertEqual(records["failure"].notna().sum(), 0)
+        for row, source in zip(records["row"], records["source"], strict=True):
+            self.assertEqual(source, f"src {row}")
+        assert isinstance(pipeline.evaluator, FakeEvaluator)
+        self.assertEqual(
+            sorted(pipeline.evaluator.evaluated), ["src 12", "src 17", "src 21", "src 3"]
+        )
+
+    def test_jsonl_resumed_with_limit(self) -> None:
+        pipeline = self.run_resumed_with_limit("results.jsonl")
+        checkpoint = pipeline.retry_failed(pipeline.load_checkpoint())
+        self.assertEqual(checkpoint.failures, 0)
+        self.assertEqual(checkpoint.output_bytes, pipeline.output_path.stat().st_size)
+        self.assert_retried(pipeline, pd.read_json(pipeline.output_path, lines=True))
+
+    def test_parquet_resumed_with_limit(self) -> None:
+        pipeline = self.run_resumed_with_limit("results.parquet")
+        checkpoint = pipeline.retry_failed(pipeline.load_checkpoint())
+        self.assertEqual(checkpoint.failures, 0)
+        self.assert_retried(pipeline, pd.read_parquet(pipeline.output_path))
+
+    def test_nothing_failed(self) -> None:
+        evaluator = FakeEvaluator(set())
+        pipeline = EvaluationPipeline(evaluator, self.input_path, self.dir / "results.jsonl")
+        written = pipeline.output_path
+        pipeline.run()
+        before = written.read_bytes()
+        pipeline.retry_failed(pipeline.load_checkpoint())
+        self.assertEqual(written.read_bytes(), before)
+        self.assertEqual(len(evaluator.evaluated), 25)
+
+
+if __name__ == "__main__":
+    unittest.main()